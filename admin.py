@@ -16,6 +16,7 @@ from PIL import Image as ima
 import os
 import base64 
 from io import StringIO
+from .iiif import PREVIEW_SIZE, THUMBNAIL_SIZE, get_image_url
 
 
 DEFAULT_LONGITUDE =  11.9900
@@ -26,6 +27,17 @@ MIN_ZOOM = 5
 
 
 
+class InternalFieldsAdminMixin:
+    """
+    Defers the INTERNAL_FIELDS (search vectors, extracted text), which no admin
+    page shows, so that changelists do not fetch them for every row.
+    """
+
+    def get_queryset(self, request):
+        names = {field.name for field in self.model._meta.concrete_fields}
+        return super().get_queryset(request).defer(*[name for name in INTERNAL_FIELDS if name in names])
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ['text']
@@ -47,7 +59,7 @@ class TypeOfDocumentAdmin(admin.ModelAdmin):
 @admin.register(Technique3D)
 class Technique3DAdmin(admin.ModelAdmin):
     list_display = [*get_fields(Technique3D, exclude=['id'])]
-    search_fields = ['title', 'type']
+    search_fields = ['text']
 
 
 @admin.register(StaffMember)
@@ -75,43 +87,46 @@ class LocationAdmin(LeafletGeoAdmin, admin.ModelAdmin):
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ['name', 'subtitle', 'location'] # [*get_fields(Object3DHop, exclude=['id', 'author'])]
-    search_fields = ['name', 'staff_member']
+    list_select_related = ['location']
+    search_fields = ['name', 'staff_member__firstname', 'staff_member__lastname']
     
 
 @admin.register(Image)
-class ImageModel(admin.ModelAdmin):
+class ImageModel(InternalFieldsAdminMixin, admin.ModelAdmin):
 
-    fields              = ['image_preview', *get_fields(Image, exclude=['id'])]
+    fields              = ['image_preview', *get_fields(Image, exclude=['id', *INTERNAL_FIELDS])]
     readonly_fields     = ['iiif_file', 'uuid', 'image_preview', *DEFAULT_FIELDS]
     autocomplete_fields = ['staff_member']
     list_display        = ['thumbnail_preview', 'title', 'file']
-    search_fields       = ['title', 'file', 'staff_member']
+    search_fields       = ['title', 'file', 'staff_member__firstname', 'staff_member__lastname']
     
     list_per_page = 10
 
     def image_preview(self, obj):
-        return format_html(f'<img src="{settings.IIIF_URL}{obj.iiif_file}/full/full/0/default.jpg" height="300" />')
+        return format_html('<img src="{}" height="300" />', get_image_url(obj, PREVIEW_SIZE))
 
     def thumbnail_preview(self, obj):
-        return format_html(f'<img src="{settings.IIIF_URL}{obj.iiif_file}/full/full/0/default.jpg" height="100" />')
+        return format_html('<img src="{}" height="100" loading="lazy" />', get_image_url(obj, THUMBNAIL_SIZE))
 
     
 
 @admin.register(Object3DHop)
-class Object3DHopAdmin(admin.ModelAdmin):
+class Object3DHopAdmin(InternalFieldsAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'scaled', 'project'] # [*get_fields(Object3DHop, exclude=['id', 'author'])]
-    search_fields = ['title', 'staff_member']
+    list_select_related = ['project']
+    search_fields = ['title', 'staff_member__firstname', 'staff_member__lastname']
     autocomplete_fields = ['preview_image']
     
 
 @admin.register(ObjectPointCloud)
-class ObjectPointCloudAdmin(admin.ModelAdmin):
+class ObjectPointCloudAdmin(InternalFieldsAdminMixin, admin.ModelAdmin):
     list_display = ['title', 'scaled', 'preview_image'] # [*get_fields(ObjectPointCloud, exclude=['id', 'author'])]
-    search_fields = ['title', 'staff_member']
+    list_select_related = ['preview_image']
+    search_fields = ['title', 'staff_member__firstname', 'staff_member__lastname']
     autocomplete_fields = ['preview_image']
 
 
 @admin.register(Document)
-class DocumentAdmin(admin.ModelAdmin):
-    list_display = ['title', 'size']# [*get_fields(Document, exclude=['id', 'type', 'place'])]
-    search_fields = ['title', 'staff_member']
\ No newline at end of file
+class DocumentAdmin(InternalFieldsAdminMixin, admin.ModelAdmin):
+    list_display = ['title', 'size', 'page_count']# [*get_fields(Document, exclude=['id', 'type', 'place'])]
+    search_fields = ['title', 'staff_member__firstname', 'staff_member__lastname']
\ No newline at end of file
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class MediaArchiveConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.mediaarchive'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,278 @@
+import json
+import mmap
+import os
+import struct
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import touch_models
+
+# Local directories serving the 3D assets, by URL prefix. The media files by default.
+ASSET_ROOTS = getattr(settings, 'MEDIAARCHIVE_ASSET_ROOTS', None) or {settings.MEDIA_URL: settings.MEDIA_ROOT}
+
+# The URL fields of the 3D models, keyed by the name of their entry in asset_metadata
+ASSET_URL_FIELDS = {'optimized': 'url_optimized', 'full_resolution': 'url_full_resolution'}
+
+PLY_TYPES = {
+    'char': 'b', 'int8': 'b', 'uchar': 'B', 'uint8': 'B',
+    'short': 'h', 'int16': 'h', 'ushort': 'H', 'uint16': 'H',
+    'int': 'i', 'int32': 'i', 'uint': 'I', 'uint32': 'I',
+    'float': 'f', 'float32': 'f', 'double': 'd', 'float64': 'd',
+}
+PLY_ENDIANNESS = {'binary_little_endian': '<', 'binary_big_endian': '>'}
+NEXUS_MAGIC = 0x4E787320
+# magic, version, vertices, faces, then the signature (2 x 8 attributes of 2 bytes, flags) and the bounding sphere
+NEXUS_HEADER = struct.Struct('<IIQQ36s4f')
+POTREE_METADATA = ('metadata.json', 'cloud.js')
+
+
+class AssetError(Exception):
+    pass
+
+
+def get_asset_path(url):
+    """
+    Returns the local path of an asset URL, from the longest matching prefix
+    of ASSET_ROOTS, or None when it is not served from local storage.
+    """
+    if not url:
+        return None
+    for prefix in sorted(ASSET_ROOTS, key=len, reverse=True):
+        if prefix and url.startswith(prefix):
+            relative = unquote(urlsplit(url[len(prefix):]).path).lstrip('/')
+            root = os.path.realpath(ASSET_ROOTS[prefix])
+            path = os.path.realpath(os.path.join(root, relative))
+            # Never follow a URL out of its root
+            return path if os.path.commonpath([root, path]) == root else None
+    return None
+
+
+def find_asset_file(url):
+    # Potree octrees are directories described by their metadata file
+    path = get_asset_path(url)
+    if path is not None and os.path.isdir(path):
+        for name in POTREE_METADATA:
+            if os.path.exists(os.path.join(path, name)):
+                return os.path.join(path, name)
+    return path
+
+
+def get_bounding_box(points, x, y, z):
+    low = [float('inf')] * 3
+    high = [float('-inf')] * 3
+    for point in points:
+        for axis, index in enumerate((x, y, z)):
+            value = point[index]
+            if value < low[axis]:
+                low[axis] = value
+            if value > high[axis]:
+                high[axis] = value
+    if low[0] > high[0]:
+        return None
+    return {'min': low, 'max': high}
+
+
+def read_ply_header(data):
+    end = data.find(b'end_header', 0, 64 * 1024)
+    if data[:3] != b'ply' or end < 0:
+        raise AssetError("Not a PLY file")
+    body = data.find(b'\n', end) + 1
+    if not body:
+        raise AssetError("Truncated PLY header")
+
+    encoding, elements = None, []
+    for line in data[:end].decode('ascii', 'replace').splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == 'format':
+            if len(words) < 2:
+                raise AssetError(f"Malformed PLY header line: {line}")
+            encoding = words[1]
+        elif words[0] == 'element':
+            if len(words) < 3 or not words[2].isdigit():
+                raise AssetError(f"Malformed PLY header line: {line}")
+            elements.append({'name': words[1], 'count': int(words[2]), 'properties': []})
+        elif words[0] == 'property' and elements:
+            # property list <count type> <item type> <name> has no fixed size
+            if len(words) < (5 if words[1:2] == ['list'] else 3):
+                raise AssetError(f"Malformed PLY header line: {line}")
+            elements[-1]['properties'].append((words[-1], None if words[1] == 'list' else PLY_TYPES.get(words[1])))
+    return encoding, elements, body
+
+
+def read_ascii_points(lines, count, size):
+    # The values of count vertex lines of at least size values each
+    if len(lines) < count:
+        raise AssetError("Truncated PLY vertex list")
+    for line in lines:
+        values = line.split()
+        if len(values) < size:
+            raise AssetError("Truncated PLY vertex line")
+        yield [float(value) for value in values]
+
+
+def probe_ply(data, bounds=False):
+    """
+    Reads the vertex and face counts of a PLY file from its header. With
+    bounds, also computes the bounding box of its vertices, which reads the
+    whole vertex list in Python (about a second per million points).
+    """
+    encoding, elements, offset = read_ply_header(data)
+    counts = {element['name']: element['count'] for element in elements}
+    metadata = {'format': 'ply', 'points': counts.get('vertex', 0), 'triangles': counts.get('face', 0)}
+    if not bounds:
+        return metadata
+
+    for element in elements:
+        names = [name for name, _ in element['properties']]
+        if element['name'] == 'vertex' and {'x', 'y', 'z'} <= set(names):
+            x, y, z = (names.index(axis) for axis in 'xyz')
+            if encoding == 'ascii':
+                lines = data[offset:].split(b'\n', element['count'])[:element['count']]
+                points = read_ascii_points(lines, element['count'], max(x, y, z) + 1)
+            elif encoding in PLY_ENDIANNESS and all(code for _, code in element['properties']):
+                record = struct.Struct(PLY_ENDIANNESS[encoding] + ''.join(code for _, code in element['properties']))
+                if offset + record.size * element['count'] > len(data):
+                    raise AssetError("Truncated PLY vertex list")
+                points = struct.iter_unpack(record.format, memoryview(data)[offset:offset + record.size * element['count']])
+            else:
+                break
+            metadata['bounding_box'] = get_bounding_box(points, x, y, z)
+            break
+        # The offset of the vertices is only known when the elements before them have a fixed size
+        if encoding == 'ascii' or not all(code for _, code in element['properties']):
+            break
+        offset += struct.calcsize(PLY_ENDIANNESS.get(encoding, '<') + ''.join(code for _, code in element['properties'])) * element['count']
+    return metadata
+
+
+def probe_nexus(data):
+    """
+    Reads the vertex and face counts and the bounding sphere of a Nexus
+    (.nxs, .nxz) multiresolution model from its header.
+    """
+    if len(data) < NEXUS_HEADER.size:
+        raise AssetError("Not a Nexus file")
+    magic, version, vertices, faces, _, cx, cy, cz, radius = NEXUS_HEADER.unpack_from(data)
+    if magic != NEXUS_MAGIC:
+        raise AssetError("Not a Nexus file")
+    return {
+        'format': 'nexus',
+        'version': version,
+        'points': vertices,
+        'triangles': faces,
+        'bounding_box': {'min': [cx - radius, cy - radius, cz - radius], 'max': [cx + radius, cy + radius, cz + radius]},
+        'bounding_sphere': {'center': [cx, cy, cz], 'radius': radius},
+    }
+
+
+def probe_potree(path):
+    """
+    Reads the point count and bounding box of a Potree octree from its
+    metadata.json (Potree 2) or cloud.js (Potree 1).
+    """
+    with open(path, encoding='utf-8') as metadata_file:
+        metadata = json.load(metadata_file)
+    box = metadata.get('tightBoundingBox') or metadata.get('boundingBox') or {}
+    if 'min' in box:
+        bounding_box = {'min': box['min'], 'max': box['max']}
+    elif 'lx' in box:
+        bounding_box = {'min': [box['lx'], box['ly'], box['lz']], 'max': [box['ux'], box['uy'], box['uz']]}
+    else:
+        bounding_box = None
+    return {'format': 'potree', 'version': str(metadata.get('version', '')), 'points': int(metadata.get('points', 0)),
+            'bounding_box': bounding_box}
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def probe_asset(url, bounds=False):
+    """
+    Returns the metadata of the 3D asset at url: format, point and triangle
+    counts, bounding box and size in bytes. Files are memory-mapped, so only
+    the pages holding the header are read; the bounding box of PLY files is
+    only computed with bounds, as it reads every vertex. Assets that cannot
+    be read get an error instead.
+    """
+    path = find_asset_file(url)
+    if path is None:
+        return {'url': url, 'error': "Not on local storage"}
+    try:
+        potree = os.path.basename(path) in POTREE_METADATA
+        modified = os.path.getmtime(path)
+        if potree:
+            metadata = probe_potree(path)
+        else:
+            with open(path, 'rb') as asset, mmap.mmap(asset.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                extension = os.path.splitext(path)[1].lower()
+                if extension == '.ply':
+                    metadata = probe_ply(data, bounds)
+                elif extension in ('.nxs', '.nxz'):
+                    metadata = probe_nexus(data)
+                else:
+                    raise AssetError(f"Unsupported format {extension}")
+        metadata['bytes'] = get_size(os.path.dirname(path) if potree else path)
+    except OSError as error:
+        # Without the local path, which is not for the API
+        return {'url': url, 'error': error.strerror or "Cannot read the asset"}
+    except (ValueError, KeyError, IndexError, TypeError, struct.error, AssetError) as error:
+        return {'url': url, 'error': str(error)}
+
+    return {'url': url, **metadata, 'modified': modified, 'probed_at': timezone.now().isoformat()}
+
+
+def is_current(metadata, url, bounds=False):
+    """
+    Whether metadata, a previous probe, still describes the asset at url (and
+    has the bounding box, with bounds).
+    """
+    if not metadata or metadata.get('url') != url or 'error' in metadata:
+        return False
+    if bounds and 'bounding_box' not in metadata:
+        return False
+    path = find_asset_file(url)
+    try:
+        return path is not None and os.path.getmtime(path) == metadata.get('modified')
+    except OSError:
+        return False
+
+
+def probe_instance_assets(instance, force=False, bounds=False):
+    """
+    Returns the asset_metadata of a 3D object, probing the assets that changed.
+    Previous probes of unchanged assets are kept, bounding boxes included.
+    """
+    previous = instance.asset_metadata or {}
+    metadata = {}
+    for key, field in ASSET_URL_FIELDS.items():
+        url = getattr(instance, field)
+        if not url:
+            continue
+        if not force and is_current(previous.get(key), url, bounds):
+            metadata[key] = previous[key]
+        else:
+            metadata[key] = probe_asset(url, bounds)
+    return metadata
+
+
+def update_asset_metadata(model, pk, force=False):
+    """
+    Probes the assets of a 3D object from their headers and stores their
+    metadata when it changed. Runs after saves, on the task threads of the web
+    process, so PLY bounding boxes are left to the probe_assets command.
+    """
+    instance = model.objects.filter(pk=pk).only('pk', 'asset_metadata', *ASSET_URL_FIELDS.values()).first()
+    if instance is None:
+        return
+    metadata = probe_instance_assets(instance, force)
+    if metadata != instance.asset_metadata:
+        # update() sends no signal, which would probe again, so invalidate here
+        model.objects.filter(pk=pk).update(asset_metadata=metadata)
+        touch_models(model)
@@ -0,0 +1,261 @@
+import math
+import re
+import statistics
+import time
+import uuid
+from functools import partial
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .models import Document
+from .pagination import KeysetPagination
+from .queries import annotate_relation_summaries
+from .search import SEARCH_MODELS, search
+from .serializers import DocumentSerializer
+from .views import ChunkedUploadViewSet, LocationViewSet, MediaArchiveViewSet, ProjectViewSet, SearchViewSet
+
+PERCENTILES = (50, 90, 95, 99)
+# Query parameter making each request miss the response cache
+CACHE_BUSTER = '_benchmark'
+# Offset of the 1000th page of 25 rows, reached with offset or keyset pagination
+DEEP_PAGE_OFFSET = 999 * 25
+SERVER_TIMING_DURATION = re.compile(r'dur=([0-9.]+)')
+# Shape of the type_names cases: this many documents with this many types each
+TYPE_NAMES_DOCUMENTS = 1000
+TYPE_NAMES_TYPES = 5
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def get_tile(zoom, lon, lat):
+    # Web Mercator tile holding a point
+    x = int((lon + 180) / 360 * 2 ** zoom)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** zoom)
+    return zoom, x, y
+
+
+def parse_server_timing(header):
+    # {'db': 1.2, 'serialize': 3.4, ...} in ms, from a Server-Timing header
+    timings = {}
+    for metric in filter(None, (part.strip() for part in header.split(','))):
+        name, _, params = metric.partition(';')
+        match = SERVER_TIMING_DURATION.search(params)
+        if match:
+            timings[name.strip()] = float(match.group(1))
+    return timings
+
+
+def get_keyset_cursor(model, offset):
+    # The cursor the page before offset links to, ordering by id
+    last = list(model.objects.order_by('id').values_list('id', flat=True)[offset - 1:offset])
+    if not last:
+        return None
+    paginator = KeysetPagination()
+    paginator.ordering = paginator.orderings['id']
+    return paginator.encode_cursor({'id': last[0]})
+
+
+def get_cases(router):
+    """
+    Returns (name, url) pairs covering every endpoint of router: lists at
+    depth 0, 1 and 2, details, filters, card views, offset and keyset pages
+    (the first ones and the 1000th), counts and facets of the media, tiles of
+    the map, and searches.
+    """
+    cases = []
+    for prefix, viewset, basename in router.registry:
+        url = f"/{prefix}/"
+        if issubclass(viewset, MediaArchiveViewSet):
+            model = viewset.queryset.model
+            cases += [(f"{basename} list depth={depth}", f"{url}?depth={depth}") for depth in (0, 1, 2)]
+            first = model.objects.order_by('pk').values_list('pk', flat=True).first()
+            if first is not None:
+                cases.append((f"{basename} detail depth=1", f"{url}{first}/?depth=1"))
+            cases += [
+                (f"{basename} card view", f"{url}?view=card"),
+                (f"{basename} page of 500", f"{url}?limit=500"),
+                (f"{basename} card view page of 500", f"{url}?limit=500&view=card"),
+                (f"{basename} offset page", f"{url}?limit=25&offset=500"),
+                (f"{basename} page of 1000", f"{url}?limit=1000"),
+                (f"{basename} keyset page", f"{url}?cursor=&limit=25"),
+                (f"{basename} offset page 1000", f"{url}?limit=25&offset={DEEP_PAGE_OFFSET}"),
+                (f"{basename} count", f"{url}count/"),
+                (f"{basename} facets", f"{url}facets/"),
+            ]
+            cursor = get_keyset_cursor(model, DEEP_PAGE_OFFSET)
+            if cursor is not None:
+                cases.append((f"{basename} keyset page 1000", f"{url}?{urlencode({'cursor': cursor, 'limit': 25})}"))
+            if issubclass(viewset, ProjectViewSet):
+                cases.append((f"{basename} filtered", f"{url}?images_count_min=10&ordering=-images_count"))
+            else:
+                location = model.objects.exclude(location=None).values_list('location', flat=True).first()
+                cases.append((f"{basename} filtered", f"{url}?{urlencode({'date_after': '2010-01-01', 'date_before': '2015-12-31'})}"))
+                cases.append((f"{basename} filtered by location", f"{url}?location={location or 0}"))
+        elif issubclass(viewset, LocationViewSet):
+            cases += [
+                (f"{basename} list", url),
+                (f"{basename} in bbox zoom=6", f"{url}?in_bbox=10,41,20,60&zoom=6"),
+                (f"{basename} tile", f"{url}tiles/{'/'.join(map(str, get_tile(6, 15, 50)))}.mvt"),
+            ]
+        elif issubclass(viewset, SearchViewSet):
+            cases += [
+                (f"{basename} all", f"{url}?q=tomb"),
+                (f"{basename} two words", f"{url}?{urlencode({'q': 'tomb chamber'})}"),
+                (f"{basename} typo", f"{url}?q=tmob"),
+                (f"{basename} images", f"{url}?q=church&type=image"),
+            ]
+        elif not issubclass(viewset, ChunkedUploadViewSet):
+            cases.append((f"{basename} list", url))
+    return cases
+
+
+def get_type_names_documents(types=TYPE_NAMES_TYPES, size=TYPE_NAMES_DOCUMENTS):
+    """
+    Primary keys of up to size documents having exactly the given number of
+    types. seed_archive --types-per-document gives that number to every document.
+    """
+    return list(Document.objects.alias(types_count=Count('type')).filter(types_count=types)
+                .order_by('pk').values_list('pk', flat=True)[:size])
+
+
+def serialize_type_names(annotated, pks):
+    # The type names of a page of documents, read per row or annotated in the same query
+    fields = ['id', 'type_names']
+    queryset = Document.objects.filter(pk__in=pks)
+    if annotated:
+        queryset = annotate_relation_summaries(queryset, DocumentSerializer, fields)
+    DocumentSerializer(queryset.order_by('pk'), many=True, context={'fields': fields, 'depth': 0}).data
+
+
+def search_icontains(text, limit=20):
+    # Unindexed substring lookups, like the admin searches
+    for model in SEARCH_MODELS.values():
+        list(model.objects.filter(Q(title__icontains=text) | Q(description__icontains=text)).order_by('pk')[:limit])
+
+
+def search_index(text, limit=20):
+    search(text, {name: model.objects.all() for name, model in SEARCH_MODELS.items()}, limit)
+
+
+def get_query_cases(log=print):
+    """
+    Returns (name, function) pairs timing two ways of running the same work
+    through the ORM, the one used by the API and the one it replaced.
+    """
+    pks = get_type_names_documents()
+    if len(pks) < TYPE_NAMES_DOCUMENTS:
+        log(f"Only {len(pks)} documents have {TYPE_NAMES_TYPES} types: seed the archive with "
+            f"--types-per-document {TYPE_NAMES_TYPES} to time the type_names of {TYPE_NAMES_DOCUMENTS}")
+    return [
+        ("document type_names per row", partial(serialize_type_names, False, pks)),
+        ("document type_names annotated", partial(serialize_type_names, True, pks)),
+        ("search icontains", partial(search_icontains, 'tomb')),
+        ("search index", partial(search_index, 'tomb')),
+    ]
+
+
+class Benchmark:
+    """
+    Requests each case through the Django test client, or calls it when it is a
+    function, and records its latency percentiles (ms), query count, response
+    size (bytes) and, with PerformanceMiddleware, the median database,
+    serialization and rendering times.
+    Requests carry a unique parameter so that they miss the response cache,
+    unless cached is set.
+    """
+
+    def __init__(self, cases, iterations=20, warmup=2, cached=False, log=print):
+        self.cases = cases
+        self.iterations = iterations
+        self.warmup = warmup
+        self.cached = cached
+        self.log = log
+
+    def get_url(self, url):
+        if self.cached:
+            return url
+        return f"{url}{'&' if '?' in url else '?'}{CACHE_BUSTER}={uuid.uuid4().hex}"
+
+    def request(self, client, target):
+        """
+        Returns the status code, the size of the body and the Server-Timing
+        durations of a request; 200, 0 and none for functions that do not raise.
+        """
+        if callable(target):
+            target()
+            return 200, 0, {}
+        response = client.get(self.get_url(target))
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, len(content), parse_server_timing(response.get('Server-Timing', ''))
+
+    def run_case(self, client, target):
+        latencies, queries, size, statuses, timings = [], 0, 0, set(), {}
+        for index in range(self.warmup + self.iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                status, length, server_timing = self.request(client, target)
+                elapsed = time.perf_counter() - started
+            statuses.add(status)
+            if index >= self.warmup:
+                latencies.append(elapsed * 1000)
+                queries = max(queries, len(captured))
+                size = max(size, length)
+                for name, duration in server_timing.items():
+                    timings.setdefault(name, []).append(duration)
+
+        return {
+            **{f'p{rank}': round(percentile(latencies, rank), 2) for rank in PERCENTILES},
+            'mean': round(statistics.fmean(latencies), 2),
+            'max': round(max(latencies), 2),
+            'queries': queries,
+            'bytes': size,
+            # Median split of the time, when PerformanceMiddleware is installed
+            'server_timing': {name: round(statistics.median(durations), 2) for name, durations in timings.items()},
+            'status': sorted(statuses),
+        }
+
+    def run(self):
+        client = Client()
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, target in self.cases:
+                results[name] = self.run_case(client, target)
+                self.log(f"{name}: p50 {results[name]['p50']} ms, p95 {results[name]['p95']} ms, "
+                         f"{results[name]['queries']} queries, {results[name]['bytes']} bytes")
+        return {
+            'created_at': timezone.now().isoformat(),
+            'iterations': self.iterations,
+            'cached': self.cached,
+            'rows': {name: model.objects.count() for name, model in SEARCH_MODELS.items()},
+            'results': results,
+        }
+
+
+def compare(results, baseline, tolerance=0.25, slack_ms=5.0, query_tolerance=0):
+    """
+    Returns the regressions of results against baseline: a p95 latency above
+    the baseline by more than tolerance (a fraction) plus slack_ms, more
+    queries than the baseline plus query_tolerance, or other status codes.
+    """
+    regressions = []
+    for name, expected in baseline['results'].items():
+        current = results['results'].get(name)
+        if current is None:
+            continue
+        limit = expected['p95'] * (1 + tolerance) + slack_ms
+        if current['p95'] > limit:
+            regressions.append(f"{name}: p95 {current['p95']} ms, over {limit:.2f} ms (baseline {expected['p95']} ms)")
+        if current['queries'] > expected['queries'] + query_tolerance:
+            regressions.append(f"{name}: {current['queries']} queries, baseline {expected['queries']}")
+        if current['status'] != expected['status']:
+            regressions.append(f"{name}: status {current['status']}, baseline {expected['status']}")
+    return regressions
@@ -0,0 +1,146 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .queries import get_related_models
+
+# Alias of the Django cache holding the responses: locmem in tests, Redis in production
+CACHE_ALIAS = getattr(settings, 'MEDIAARCHIVE_CACHE', 'default')
+CACHE_TIMEOUT = getattr(settings, 'MEDIAARCHIVE_CACHE_TIMEOUT', 60 * 60 * 24)
+CACHE_PREFIX = 'mediaarchive'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_stamp_key(model):
+    return f"{CACHE_PREFIX}:modified:{model._meta.label_lower}"
+
+
+def get_modified_stamps(models):
+    """
+    Returns the time of the last change of each model. A stamp missing from
+    the cache (never set, or evicted) is reset to now: deletes and
+    many-to-many changes leave no trace in the rows, so no older time is
+    known to be safe, and responses cached under an evicted stamp must not
+    be read again.
+    """
+    cache = get_cache()
+    keys = {get_stamp_key(model): model for model in models}
+    stamps = cache.get_many(keys)
+
+    now = time.time()
+    for key in keys:
+        if key in stamps:
+            continue
+        # Another process may have set the stamp in between
+        if cache.add(key, now, timeout=None):
+            stamps[key] = now
+        else:
+            stamps[key] = cache.get(key, now)
+
+    return {keys[key]: stamp for key, stamp in stamps.items()}
+
+
+def touch_models(*models):
+    """
+    Marks models as changed, which invalidates every cached response that
+    contains their rows. Runs after commit, so that a concurrent request cannot
+    cache the old rows under the new stamp.
+    """
+    def touch():
+        now = time.time()
+        get_cache().set_many({get_stamp_key(model): now for model in models}, timeout=None)
+    transaction.on_commit(touch)
+
+
+class CachedResponseMixin:
+    """
+    Caches the data of list, retrieve and count responses, keyed on the endpoint,
+    the normalized query parameters (depth included) and the modification
+    stamps of every model the response is built from. Changing any of those
+    models through the ORM bumps its stamp (see signals.py), so stale entries
+    are simply never read again. Responses carry ETag and Last-Modified
+    headers, and conditional requests are answered with 304.
+    """
+
+    cached_actions = ('list', 'retrieve', 'count')
+
+    def get_cache_depth(self):
+        raise NotImplementedError
+
+    def get_cache_models(self):
+        from .serializers import RelationSummaryField
+
+        serializer_class = self.get_serializer_class()
+        field_names = list(serializer_class.Meta.fields)
+        field_names += [field.relation for field in serializer_class._declared_fields.values()
+                        if isinstance(field, RelationSummaryField)]
+        return get_related_models(self.queryset.model, field_names, self.get_cache_depth())
+
+    def get_cache_key(self, request, stamps):
+        params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        stamps = sorted((model._meta.label_lower, stamp) for model, stamp in stamps.items())
+        digest = hashlib.sha1(repr((request.build_absolute_uri('/'), self.kwargs, params, stamps)).encode()).hexdigest()
+        return f"{CACHE_PREFIX}:response:{self.basename}:{self.action}:{digest}"
+
+    def dispatch(self, request, *args, **kwargs):
+        self._cache_entry = None
+        return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method != 'GET' or self.action not in self.cached_actions:
+            return
+
+        stamps = get_modified_stamps(self.get_cache_models())
+        key = self.get_cache_key(request, stamps)
+        last_modified = int(max(stamps.values(), default=0))
+        etag = quote_etag(hashlib.md5(f"{key}:{request.accepted_media_type}".encode()).hexdigest())
+        self._cache_entry = (key, etag, last_modified)
+
+    def handle_conditional(self, request):
+        key, etag, last_modified = self._cache_entry
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return if_modified_since is not None and last_modified <= if_modified_since
+
+    def cached(self, handler, request, *args, **kwargs):
+        """
+        Returns the response of handler from the cache, or a 304 when the
+        client copy is current. Extra actions opt in by calling this.
+        """
+        if self._cache_entry is None:
+            return handler(request, *args, **kwargs)
+
+        key, etag, last_modified = self._cache_entry
+        if self.handle_conditional(request):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = get_cache().get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                get_cache().set(key, response.data, timeout=CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import zipfile
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+
+from .cache import touch_models
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# PostgreSQL refuses tsvectors over 1 MB, so only the start of long documents is indexed
+MAX_CONTENT_LENGTH = getattr(settings, 'MEDIAARCHIVE_MAX_CONTENT_LENGTH', 200_000)
+# Where chunked uploads are assembled before they become documents
+UPLOAD_DIR = getattr(settings, 'MEDIAARCHIVE_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'chunked_uploads'))
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+PDF_PAGE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+# Bytes kept between the chunks of a PDF scanned for pages, longer than a page object marker
+PDF_PAGE_OVERLAP = 64
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_checksum(file):
+    """
+    SHA-256 of a file object, read in chunks from the start.
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def count_pdf_pages(file):
+    """
+    Counts the page objects of a PDF file, read in chunks.
+    """
+    pages, buffer = 0, b''
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        buffer += chunk
+        # Markers starting in the last bytes are counted with the next chunk, which tells /Page from /Pages
+        cut = max(len(buffer) - PDF_PAGE_OVERLAP, 0)
+        pages += sum(1 for match in PDF_PAGE.finditer(buffer) if match.start() < cut)
+        buffer = buffer[cut:]
+    return pages + len(PDF_PAGE.findall(buffer))
+
+
+def read_pdf(file):
+    if PdfReader is None:
+        # Without pypdf the pages can still be counted from the page objects
+        return count_pdf_pages(file), ''
+    reader = PdfReader(file)
+    texts, length = [], 0
+    for page in reader.pages:
+        if length >= MAX_CONTENT_LENGTH:
+            break
+        text = page.extract_text() or ''
+        texts.append(text)
+        length += len(text)
+    return len(reader.pages), '\n'.join(texts)
+
+
+def read_docx(file):
+    with zipfile.ZipFile(file) as archive:
+        body = ElementTree.fromstring(archive.read('word/document.xml'))
+        paragraphs = [''.join(node.text or '' for node in paragraph.iter(f'{WORD_NAMESPACE}t'))
+                      for paragraph in body.iter(f'{WORD_NAMESPACE}p')]
+        pages = None
+        if 'docProps/app.xml' in archive.namelist():
+            # Word saves the page count of the last layout in the document properties
+            match = re.search(rb'<Pages>(\d+)</Pages>', archive.read('docProps/app.xml'))
+            pages = int(match.group(1)) if match else None
+    return pages, '\n'.join(paragraph for paragraph in paragraphs if paragraph)
+
+
+DOCUMENT_READERS = {'.pdf': read_pdf, '.docx': read_docx}
+
+
+def extract_content(file, name):
+    """
+    Returns the page count and the text of a PDF or DOCX file, (None, '') for
+    other formats or unreadable files.
+    """
+    reader = DOCUMENT_READERS.get(os.path.splitext(name)[1].lower())
+    if reader is None:
+        return None, ''
+    try:
+        pages, text = reader(file)
+    except Exception as error:
+        # Broken files are common in archives, and the readers raise anything
+        logger.info("Could not read %s: %s", name, error)
+        return None, ''
+    return pages, text[:MAX_CONTENT_LENGTH]
+
+
+def update_document_content(pk):
+    """
+    Extracts the page count and text of a document that was not read yet and
+    reindexes it, and computes its checksum when it has none (rows from before
+    checksums). Documents whose file is missing are left as they are.
+    """
+    from .models import Document
+    from .search import update_search_vectors
+
+    document = Document.objects.filter(pk=pk).only('pk', 'upload', 'checksum', 'page_count').first()
+    if document is None or not document.upload:
+        return
+    updates = {}
+    try:
+        with document.upload.open('rb') as file:
+            if not document.checksum:
+                updates['checksum'] = get_checksum(file)
+            if document.page_count is None:
+                pages, updates['content'] = extract_content(file, document.upload.name)
+                # page_count 0 marks the document as read, so that it is not read again
+                updates['page_count'] = pages or 0
+    except OSError as error:
+        logger.warning("Could not read the file of document %s: %s", pk, error)
+        return
+    if not updates:
+        return
+    Document.objects.filter(pk=pk).update(**updates)
+    if 'content' in updates:
+        update_search_vectors(Document, [pk])
+    touch_models(Document)
+
+
+def parse_range(header, size):
+    """
+    Returns the (start, end) bytes, end included, of a single-range Range
+    header, None when the header is absent or not supported (the whole file is
+    sent), or False when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        # The last bytes of the file
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def iter_file(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def get_content_disposition(name):
+    try:
+        name.encode('ascii')
+    except UnicodeEncodeError:
+        return f"attachment; filename*=utf-8''{quote(name)}"
+    escaped = name.replace('\\', '\\\\').replace('"', '\\"')
+    return f'attachment; filename="{escaped}"'
+
+
+def ranged_file_response(request, field_file, etag=None):
+    """
+    Streams a stored file, honoring single Range requests (and If-Range) with
+    206 Partial Content responses, so that interrupted downloads can resume.
+    """
+    size = field_file.size
+    requested = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and if_range != etag:
+        requested = None
+    byte_range = parse_range(requested, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    name = os.path.basename(field_file.name)
+    response = StreamingHttpResponse(iter_file(field_file.open('rb'), start, end - start + 1), status=206 if byte_range else 200,
+                                     content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    response['Content-Length'] = str(end - start + 1)
+    if byte_range:
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = get_content_disposition(name)
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+def get_document_etag(document):
+    return quote_etag(document.checksum) if document.checksum else None
@@ -0,0 +1,169 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from diana.abstract.serializers import DynamicDepthSerializer
+
+from . import serializers
+from .queries import annotate_relation_summaries, defer_unused_columns, plan_queryset
+
+EXPORT_FORMATS = ('ndjson', 'csv', 'geojson')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'geojson': 'application/geo+json',
+}
+CHUNK_SIZE = 2000
+
+# Serializers of the exportable models, by the name used in urls.py
+EXPORT_SERIALIZERS = {
+    'image': serializers.TIFFImageSerializer,
+    'document': serializers.DocumentSerializer,
+    'object3dhop': serializers.Object3DHopSerializer,
+    'objectpointcloud': serializers.ObjectPointCloudSerializer,
+    'project': serializers.ProjectSerializer,
+    'location': serializers.LocationSerializer,
+}
+
+
+def parse_since(value):
+    """
+    Parses the since parameter of incremental exports, a date or a datetime.
+    """
+    if not value:
+        return None
+    try:
+        # Well formed but impossible values, e.g. 2024-02-30, raise ValueError
+        since = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        since = None
+    if since is None:
+        raise ValidationError({'since': "Expected an ISO 8601 date or datetime"})
+    return since
+
+
+def get_export_queryset(queryset, serializer_class, since=None):
+    """
+    Orders queryset for a stable export, with the relations the serializer
+    needs fetched in bulk for each chunk. Dynamic depth serializers are
+    exported at depth 0.
+    """
+    field_names = serializer_class.Meta.fields
+    depth = 0 if issubclass(serializer_class, DynamicDepthSerializer) else getattr(serializer_class.Meta, 'depth', 0)
+    if since is not None:
+        queryset = queryset.filter(updated_at__gt=since)
+    if 'location' in field_names:
+        queryset = queryset.select_related('location')
+    queryset = annotate_relation_summaries(queryset, serializer_class, field_names)
+    queryset = defer_unused_columns(queryset, field_names + ['location'])
+    return plan_queryset(queryset, field_names, depth).order_by('pk')
+
+
+def iter_features(queryset, serializer_class, request=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields a GeoJSON feature for each object of queryset, reading it through a
+    server-side cursor so that memory use does not depend on the table size.
+    Media objects take the geometry of their location.
+    """
+    serializer = serializer_class(context={'request': request, 'depth': 0})
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        data = serializer.to_representation(obj)
+        if data.get('type') == 'Feature':
+            yield data
+            continue
+        location = getattr(obj, 'location', None)
+        geometry = getattr(location, 'geometry', None)
+        yield {
+            'type': 'Feature',
+            'id': data.get('id'),
+            'geometry': json.loads(geometry.geojson) if geometry else None,
+            'properties': data,
+        }
+
+
+def get_properties(feature):
+    return {'id': feature['id'], **(feature['properties'] or {}), 'geometry': feature['geometry']}
+
+
+def dumps(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+
+
+class Echo:
+    """
+    File-like object handing back what the csv writer writes to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_ndjson(features):
+    for feature in features:
+        yield dumps(get_properties(feature)) + '\n'
+
+
+def stream_csv(features):
+    writer = None
+    for feature in features:
+        row = get_properties(feature)
+        if writer is None:
+            writer = csv.DictWriter(Echo(), fieldnames=list(row), extrasaction='ignore')
+            yield writer.writeheader()
+        yield writer.writerow({
+            key: dumps(value) if isinstance(value, (list, dict)) else ('' if value is None else value)
+            for key, value in row.items()
+        })
+
+
+def stream_geojson(features):
+    yield '{"type":"FeatureCollection","features":['
+    for index, feature in enumerate(features):
+        yield (',' if index else '') + dumps(feature)
+    yield ']}'
+
+
+STREAMS = {
+    'ndjson': stream_ndjson,
+    'csv': stream_csv,
+    'geojson': stream_geojson,
+}
+
+
+def stream_export(queryset, serializer_class, export_format, since=None, request=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns a generator of the chunks of the export of queryset in export_format.
+    """
+    queryset = get_export_queryset(queryset, serializer_class, since)
+    return STREAMS[export_format](iter_features(queryset, serializer_class, request, chunk_size))
+
+
+class StreamingExportMixin:
+    """
+    Adds export/<ndjson|csv|geojson>/ to a viewset: the whole filtered
+    queryset, streamed at depth 0. Pass since=<date or datetime> to only
+    export the objects updated after it.
+    """
+
+    def get_filterable_queryset(self):
+        # The rows before filtering, with the annotations the filters use
+        return self.queryset.all()
+
+    @action(detail=False, url_path=rf"export/(?P<export_format>{'|'.join(EXPORT_FORMATS)})", url_name='export')
+    def export(self, request, export_format, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        since = parse_since(request.query_params.get('since'))
+        queryset = self.filter_queryset(self.get_filterable_queryset())
+
+        response = StreamingHttpResponse(
+            stream_export(queryset, serializer_class, export_format, since, request),
+            content_type=CONTENT_TYPES[export_format],
+        )
+        filename = f"{queryset.model._meta.model_name}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,163 @@
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers as drf
+from rest_framework.fields import ISO_8601
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .queries import get_related_rows, get_relation_ordering
+from .serializers import NameListField, RelationSummaryField
+
+# Serves list pages at depth 0 from .values() rows, see FastListMixin
+FAST_SERIALIZATION = getattr(settings, 'MEDIAARCHIVE_FAST_SERIALIZATION', False)
+
+
+def pk_list_subquery(model, relation):
+    """
+    Correlated subquery collecting the primary keys behind a to-many relation,
+    in the order the relation is read by the serializers.
+    """
+    _, related = get_related_rows(model, relation)
+    return ArraySubquery(related.order_by(*get_relation_ordering(related.model)).values('pk'))
+
+
+def get_file_mapper(field, model_field, request):
+    # Same output as FileField.to_representation, from the stored name
+    storage = model_field.storage
+    use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+    def to_representation(name):
+        if not name:
+            return None
+        if not use_url:
+            return name
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+    return to_representation
+
+
+def get_value_mapper(field, model_field, request):
+    """
+    Returns the function turning a database value into the representation of
+    field, a shortcut of field.to_representation for the common field types.
+    """
+    if isinstance(field, drf.FileField):
+        return get_file_mapper(field, model_field, request)
+    if type(field) is drf.CharField:
+        return str
+    if type(field) is drf.IntegerField:
+        return int
+    if type(field) is drf.FloatField:
+        return float
+    if type(field) is drf.DateField and str(getattr(field, 'format', '')).lower() == ISO_8601:
+        return lambda value: value.isoformat()
+    if type(field) is drf.ListField and type(field.child) is drf.FloatField:
+        return lambda value: [None if item is None else float(item) for item in value]
+    return field.to_representation
+
+
+def compile_mappers(serializer, model, request):
+    """
+    Returns the annotations to add, the columns to read with .values() and a
+    (name, column, mapper) triple per serialized field, or None when a field
+    needs the model instance (nested objects, method fields, geometries...).
+    """
+    annotations, columns, mappers = {}, [], []
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, RelationSummaryField):
+            annotations[name] = field.get_annotation(model)
+            mappers.append((name, name, list if isinstance(field, NameListField) else int))
+            columns.append(name)
+            continue
+        if isinstance(field, drf.ManyRelatedField) and isinstance(field.child_relation, drf.PrimaryKeyRelatedField):
+            alias = f"_fast_{name}"
+            annotations[alias] = pk_list_subquery(model, field.source)
+            mappers.append((name, alias, list))
+            columns.append(alias)
+            continue
+        if isinstance(field, (drf.BaseSerializer, drf.SerializerMethodField, drf.RelatedField, drf.ManyRelatedField)) \
+                and not isinstance(field, drf.PrimaryKeyRelatedField):
+            return None
+        if field.source == '*' or '.' in field.source:
+            return None
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+
+        column = model_field.attname
+        if isinstance(field, drf.PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                return None
+            mapper = None
+        else:
+            mapper = get_value_mapper(field, model_field, request)
+        mappers.append((name, column, mapper))
+        columns.append(column)
+
+    return annotations, columns, mappers
+
+
+class FastSerializer:
+    """
+    Read-only serializer producing the representation of serializer_class at
+    depth 0 from .values() rows: relation ids and name lists come from array
+    subqueries, and each column goes through a mapper compiled once per
+    request instead of per field and row.
+    """
+
+    def __init__(self, serializer_class, context):
+        serializer = serializer_class(context={**context, 'depth': 0})
+        self.model = serializer_class.Meta.model
+        self.compiled = compile_mappers(serializer, self.model, context.get('request'))
+
+    @property
+    def supported(self):
+        return self.compiled is not None
+
+    def get_rows(self, queryset, extra_columns=()):
+        annotations, columns, _ = self.compiled
+        queryset = queryset.prefetch_related(None).select_related(None)
+        new_annotations = {name: value for name, value in annotations.items() if name not in queryset.query.annotations}
+        return queryset.annotate(**new_annotations).values(*dict.fromkeys([*columns, *extra_columns]))
+
+    def to_representation(self, rows):
+        _, _, mappers = self.compiled
+        return [
+            {name: row[column] if mapper is None or row[column] is None else mapper(row[column])
+             for name, column, mapper in mappers}
+            for row in rows
+        ]
+
+
+class FastListMixin:
+    """
+    Serves list requests at depth 0 through FastSerializer when the setting
+    MEDIAARCHIVE_FAST_SERIALIZATION is on and every field is supported. The
+    output is the same as the one of the regular serializer.
+    """
+
+    def get_fast_serializer(self):
+        if not FAST_SERIALIZATION or self.get_cache_depth() != 0:
+            return None
+        serializer = FastSerializer(self.get_serializer_class(), self.get_serializer_context())
+        return serializer if serializer.supported else None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_fast_serializer()
+        if serializer is None:
+            return super().list(request, *args, **kwargs)
+
+        # The columns keyset pagination reads from the last row of the page
+        keys = [name for name in ('id', 'date') if hasattr(serializer.model, name)]
+        rows = serializer.get_rows(self.filter_queryset(self.get_filterable_queryset()), keys)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(rows))
@@ -0,0 +1,57 @@
+from django_filters import rest_framework as filters
+from diana.utils import get_fields, DEFAULT_FIELDS
+from .models import *
+
+
+class ProjectFilter(filters.FilterSet):
+    # Ranges over the counts annotated by ProjectViewSet, e.g. images_count_min=10
+    images_count = filters.RangeFilter()
+    threedhop_count = filters.RangeFilter()
+    pointcloud_count = filters.RangeFilter()
+    documents_count = filters.RangeFilter()
+
+    class Meta:
+        model = Project
+        fields = get_fields(Project, exclude=DEFAULT_FIELDS)
+
+
+class MediaFilter(filters.FilterSet):
+    # Dates between date_after and date_before included, e.g. date_after=2019-01-01&date_before=2021-12-31.
+    # Separate filters, so that date=2020-05-01 keeps its exact lookup from Meta.fields
+    date_after = filters.DateFilter(field_name='date', lookup_expr='gte')
+    date_before = filters.DateFilter(field_name='date', lookup_expr='lte')
+
+
+class ImageFilter(MediaFilter):
+
+    class Meta:
+        model = Image
+        fields = get_fields(Image, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS + ['iiif_file', 'file'])
+
+
+class Object3DHopFilter(MediaFilter):
+    # Ranges over the parsed numbers, e.g. triangles_optimized_count_min=1000000
+    triangles_optimized_count = filters.RangeFilter()
+    triangles_full_resolution_count = filters.RangeFilter()
+
+    class Meta:
+        model = Object3DHop
+        fields = get_fields(Object3DHop, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS + COMPUTED_FIELDS + [
+            'preview_image', 'trackball_start', 'start_angle', 'start_pan', 'min_max_phi', 'min_max_theta'])
+
+
+class ObjectPointCloudFilter(MediaFilter):
+    points_optimized_count = filters.RangeFilter()
+    points_full_resolution_count = filters.RangeFilter()
+
+    class Meta:
+        model = ObjectPointCloud
+        fields = get_fields(ObjectPointCloud, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS + COMPUTED_FIELDS + [
+            'preview_image', 'camera_position', 'look_at'])
+
+
+class DocumentFilter(MediaFilter):
+
+    class Meta:
+        model = Document
+        fields = get_fields(Document, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS + ['upload'])
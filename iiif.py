@@ -0,0 +1,244 @@
+import hashlib
+import json
+import logging
+from functools import partial
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from diana.utils import build_app_endpoint
+from django.conf import settings
+from django.db import transaction
+from django.utils.http import quote_etag
+
+from .cache import CACHE_PREFIX, get_cache
+from .tasks import enqueue
+
+logger = logging.getLogger(__name__)
+
+# IIIF sizes of the admin thumbnails and previews, fitted in a box of that many pixels
+THUMBNAIL_SIZE = '!200,200'
+PREVIEW_SIZE = '!600,600'
+
+# Request the derivatives of each saved image, so that the IIIF server has them cached
+WARM_DERIVATIVES = getattr(settings, 'MEDIAARCHIVE_WARM_DERIVATIVES', True)
+WARM_TIMEOUT = 30
+
+# Base of the manifest ids, e.g. https://data.dh.gu.se; the host of the request when not set, and then
+# manifests are not cached, as the ids of one host must not be served to another
+MANIFEST_BASE_URL = getattr(settings, 'MEDIAARCHIVE_BASE_URL', None)
+MANIFEST_CONTEXT = 'http://iiif.io/api/presentation/3/context.json'
+MANIFEST_CONTENT_TYPE = f'application/ld+json;profile="{MANIFEST_CONTEXT}"'
+# Resource served for each kind of object: a manifest per image, a collection of them per project and location
+MANIFEST_KINDS = {'image': 'manifest', 'project': 'collection', 'location': 'collection'}
+INFO_TIMEOUT = 10
+
+
+def get_image_url(image, size='full', region='full', rotation=0, quality='default', format='jpg'):
+    return f"{settings.IIIF_URL}{image.iiif_file}/{region}/{size}/{rotation}/{quality}.{format}"
+
+
+def warm_urls(urls):
+    for url in urls:
+        try:
+            with urlopen(url, timeout=WARM_TIMEOUT) as response:
+                response.read()
+        except (URLError, OSError) as error:
+            logger.info("Could not warm %s: %s", url, error)
+
+
+def warm_derivatives(image, sizes=(THUMBNAIL_SIZE, PREVIEW_SIZE)):
+    """
+    Requests the given derivatives of image on the background task threads,
+    once the current transaction commits.
+    """
+    urls = [get_image_url(image, size) for size in sizes]
+    if not WARM_DERIVATIVES or not image.iiif_file or not urls[0].startswith('http'):
+        return
+    enqueue(warm_urls, urls)
+
+
+def get_manifest_url(base_url, kind, pk):
+    return f"{base_url.rstrip('/')}/{build_app_endpoint('mediaarchive')}/iiif/{kind}/{pk}/{MANIFEST_KINDS[kind]}.json"
+
+
+def get_manifest_key(kind, pk):
+    return f"{CACHE_PREFIX}:iiif:{kind}:{pk}"
+
+
+def get_image_info(iiif_file):
+    """
+    Returns the size and image service of an image from the info.json of the
+    IIIF server, cached until the file changes, or None when it cannot be read.
+    """
+    key = f"{CACHE_PREFIX}:iiif:info:{hashlib.sha1(str(iiif_file).encode()).hexdigest()}"
+    info = get_cache().get(key)
+    if info is not None:
+        return info
+
+    url = f"{settings.IIIF_URL}{iiif_file}/info.json"
+    try:
+        with urlopen(url, timeout=INFO_TIMEOUT) as response:
+            data = json.load(response)
+        profile = data.get('profile')
+        info = {
+            'width': int(data['width']),
+            'height': int(data['height']),
+            'service': {
+                'id': data.get('id') or data.get('@id') or f"{settings.IIIF_URL}{iiif_file}",
+                'type': 'ImageService3' if 'image/3' in str(data.get('@context')) else 'ImageService2',
+                'profile': profile[0] if isinstance(profile, list) else profile,
+            },
+        }
+    except (URLError, OSError, ValueError, KeyError, TypeError) as error:
+        logger.info("Could not read %s: %s", url, error)
+        return None
+
+    get_cache().set(key, info, timeout=None)
+    return info
+
+
+def get_label(text):
+    return {'none': [str(text) if text else '']}
+
+
+def get_metadata(pairs):
+    return [{'label': {'en': [label]}, 'value': {'none': [str(value)]}} for label, value in pairs if value]
+
+
+def get_thumbnail(image):
+    return [{'id': get_image_url(image, THUMBNAIL_SIZE), 'type': 'Image', 'format': 'image/jpeg'}]
+
+
+def build_image_manifest(image, base_url):
+    """
+    IIIF Presentation 3 manifest with a single canvas painted with image. The
+    canvas size comes from the image server and is left out when it is down.
+    Returns None for images without IIIF file.
+    """
+    if not image.iiif_file:
+        return None
+    manifest_url = get_manifest_url(base_url, 'image', image.pk)
+    canvas_url = f"{manifest_url.rsplit('/', 1)[0]}/canvas/1"
+    info = get_image_info(image.iiif_file)
+
+    body = {'id': get_image_url(image), 'type': 'Image', 'format': 'image/jpeg'}
+    canvas = {'id': canvas_url, 'type': 'Canvas', 'label': get_label(image.title)}
+    if info is not None:
+        body.update(width=info['width'], height=info['height'], service=[info['service']])
+        canvas.update(width=info['width'], height=info['height'])
+    canvas['items'] = [{
+        'id': f"{canvas_url}/page/1",
+        'type': 'AnnotationPage',
+        'items': [{
+            'id': f"{canvas_url}/page/1/annotation/1",
+            'type': 'Annotation',
+            'motivation': 'painting',
+            'body': body,
+            'target': canvas_url,
+        }],
+    }]
+
+    manifest = {
+        '@context': MANIFEST_CONTEXT,
+        'id': manifest_url,
+        'type': 'Manifest',
+        'label': get_label(image.title),
+        'metadata': get_metadata([
+            ('Date', image.date and image.date.isoformat()),
+            ('Project', image.project and image.project.name),
+            ('Location', image.location and image.location.name),
+        ]),
+        'thumbnail': get_thumbnail(image),
+        'items': [canvas],
+    }
+    if image.description:
+        manifest['summary'] = {'none': [image.description]}
+    return manifest
+
+
+def build_collection(kind, instance, images, base_url):
+    """
+    IIIF Presentation 3 collection of the manifests of images, a queryset.
+    """
+    images = images.exclude(iiif_file='').exclude(iiif_file__isnull=True).order_by('date', 'id') \
+        .only('id', 'title', 'iiif_file')
+    return {
+        '@context': MANIFEST_CONTEXT,
+        'id': get_manifest_url(base_url, kind, instance.pk),
+        'type': 'Collection',
+        'label': get_label(instance.name),
+        'items': [{
+            'id': get_manifest_url(base_url, 'image', image.pk),
+            'type': 'Manifest',
+            'label': get_label(image.title),
+            'thumbnail': get_thumbnail(image),
+        } for image in images.iterator()],
+    }
+
+
+def build_manifest(kind, pk, base_url):
+    from .models import Image, Location, Project
+
+    if kind == 'image':
+        image = Image.objects.select_related('project', 'location').filter(pk=pk).first()
+        return build_image_manifest(image, base_url) if image is not None else None
+    model = {'project': Project, 'location': Location}[kind]
+    instance = model.objects.filter(pk=pk).only('id', 'name').first()
+    if instance is None:
+        return None
+    return build_collection(kind, instance, Image.objects.filter(**{kind: instance}), base_url)
+
+
+def render_manifest(manifest):
+    # (strong ETag, JSON content)
+    content = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode()
+    return quote_etag(hashlib.sha256(content).hexdigest()), content
+
+
+def store_manifest(kind, pk, manifest):
+    """
+    Caches the rendered manifest with its strong ETag until it is invalidated.
+    Manifests of images whose size is unknown are not cached, so that the
+    next request asks the image server again.
+    """
+    entry = render_manifest(manifest)
+    complete = kind != 'image' or 'width' in manifest['items'][0]
+    if complete:
+        get_cache().set(get_manifest_key(kind, pk), entry, timeout=None)
+    return entry
+
+
+def get_manifest(kind, pk, base_url):
+    """
+    Returns the (ETag, JSON content) of the manifest of an image or the
+    collection of a project or location, from the cache or built, or None
+    when the object does not exist. Only manifests of MANIFEST_BASE_URL are
+    cached.
+    """
+    cached = MANIFEST_BASE_URL is not None and base_url == MANIFEST_BASE_URL
+    if cached:
+        entry = get_cache().get(get_manifest_key(kind, pk))
+        if entry is not None:
+            return entry
+    manifest = build_manifest(kind, pk, base_url)
+    if manifest is None:
+        return None
+    return store_manifest(kind, pk, manifest) if cached else render_manifest(manifest)
+
+
+def get_collection_targets(images):
+    """
+    The (kind, pk) pairs of the collections listing images, to invalidate when
+    images are added without signals, e.g. with bulk_create.
+    """
+    return {(kind, getattr(image, f'{kind}_id')) for image in images for kind in ('project', 'location')}
+
+
+def invalidate_manifests(targets):
+    """
+    Drops the cached manifests of targets, (kind, pk) pairs, once the current
+    transaction commits. They are rebuilt on their next request.
+    """
+    keys = [get_manifest_key(kind, pk) for kind, pk in targets if pk is not None]
+    if keys:
+        transaction.on_commit(partial(get_cache().delete_many, keys))
@@ -0,0 +1,260 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import connections, transaction
+from django.utils.dateparse import parse_date
+
+from .cache import touch_models
+from .documents import get_checksum, update_document_content
+from .iiif import get_collection_targets, invalidate_manifests
+from .models import Document, Image, Location, Project, StaffMember, TypeOfDocument, TypeOfImage
+from .search import update_search_vectors
+from .tasks import enqueue
+from .validators import DOCUMENT_EXTENSIONS, validate_file_extension, validate_image_extension
+
+# Manifest columns holding several values, separated by ';' in CSV manifests
+LIST_COLUMNS = ['staff_members', 'types']
+
+
+def read_manifest(path):
+    """
+    Returns the entries of a CSV or JSON manifest, or one entry per file when
+    path is a directory. Relative paths are resolved against the manifest.
+    """
+    if os.path.isdir(path):
+        return [{'path': os.path.join(root, name)}
+                for root, _, names in sorted(os.walk(path)) for name in sorted(names)
+                if not name.startswith('.')]
+
+    with open(path, encoding='utf-8') as manifest:
+        if path.lower().endswith('.json'):
+            entries = json.load(manifest)
+        else:
+            entries = list(csv.DictReader(manifest))
+            for entry in entries:
+                for column in LIST_COLUMNS:
+                    entry[column] = [value.strip() for value in (entry.get(column) or '').split(';') if value.strip()]
+
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        entry['path'] = os.path.join(base, entry['path'])
+    return entries
+
+
+def get_kind(entry):
+    if entry.get('kind'):
+        return entry['kind']
+    extension = os.path.splitext(entry['path'])[1].lower()
+    return 'document' if extension in DOCUMENT_EXTENSIONS else 'image'
+
+
+def get_date(entry):
+    """
+    Returns the date of a manifest entry, None when it has none, or raises a
+    ValidationError when it is not a valid YYYY-MM-DD date.
+    """
+    text = str(entry.get('date') or '').strip()
+    if not text:
+        return None
+    try:
+        value = parse_date(text)
+    except ValueError:
+        # Well formed but impossible, e.g. 2024-02-30
+        value = None
+    if value is None:
+        raise ValidationError(f"Invalid date {text}, expected YYYY-MM-DD")
+    return value
+
+
+def init_worker():
+    # Spawned workers start without the app registry, forked ones already have it
+    import django
+    django.setup()
+
+
+def process_entry(entry):
+    """
+    Runs in a worker process: validates the file, stores it and does the
+    expensive per-file work (the IIIF pyramid TIFF of images, the size and
+    checksum of documents). Returns the field values of the row to create.
+    """
+    path = entry['path']
+    name = os.path.basename(path)
+    kind = get_kind(entry)
+    try:
+        date = get_date(entry)
+        if kind == 'image':
+            validate_image_extension(SimpleNamespace(name=name))
+            image = Image()
+            with open(path, 'rb') as source:
+                image.file.save(name, File(source), save=False)
+            image._save_tiled_pyramid_tif()
+            fields = {'file': image.file.name, 'iiif_file': image.iiif_file.name, 'uuid': image.uuid}
+        elif kind == 'document':
+            validate_file_extension(SimpleNamespace(name=name))
+            document = Document()
+            with open(path, 'rb') as source:
+                document.upload.save(name, File(source), save=False)
+                checksum = get_checksum(source)
+            fields = {'upload': document.upload.name, 'size': round(os.path.getsize(path) / 1024 ** 2, 2),
+                      'checksum': checksum}
+        else:
+            raise ValidationError(f"Unknown kind {kind}")
+    except (OSError, ValidationError) as error:
+        return {'entry': entry, 'error': '; '.join(error.messages) if isinstance(error, ValidationError) else str(error)}
+
+    if date is not None:
+        fields['date'] = date
+
+    return {'entry': entry, 'kind': kind, 'fields': fields, 'bytes': os.path.getsize(path)}
+
+
+class RelationCache:
+    """
+    Looks up (or creates) the related objects named in a manifest, once per run.
+    """
+
+    def __init__(self):
+        self.objects = {}
+
+    def get(self, model, value, lookup):
+        if value in (None, ''):
+            return None
+        key = (model, str(value))
+        if key not in self.objects:
+            if str(value).isdigit() and lookup != 'text':
+                self.objects[key] = model.objects.filter(pk=int(value)).first()
+            else:
+                self.objects[key] = model.objects.filter(**{lookup: value}).first() or model.objects.create(**{lookup: value})
+        return self.objects[key]
+
+    def get_staff_member(self, value):
+        key = (StaffMember, str(value))
+        if key not in self.objects:
+            if str(value).isdigit():
+                self.objects[key] = StaffMember.objects.filter(pk=int(value)).first()
+            else:
+                firstname, _, lastname = str(value).strip().partition(' ')
+                self.objects[key], _ = StaffMember.objects.get_or_create(firstname=firstname, lastname=lastname)
+        return self.objects[key]
+
+
+def link_many(field, pairs):
+    """
+    Creates the rows of the through table of a many-to-many field in bulk,
+    pairs being (source id, target id) tuples.
+    """
+    through = field.remote_field.through
+    source, target = f"{field.m2m_field_name()}_id", f"{field.m2m_reverse_field_name()}_id"
+    through.objects.bulk_create([through(**{source: a, target: b}) for a, b in pairs], ignore_conflicts=True)
+
+
+class Ingest:
+    """
+    Bulk ingest of images and documents. Files are processed in a process pool
+    and rows are written in batches with bulk_create. The paths of the files of
+    each committed batch are appended to a state file, so an interrupted
+    ingest resumes where it stopped.
+    """
+
+    models = {'image': Image, 'document': Document}
+    type_models = {'image': ('type_of_image', TypeOfImage), 'document': ('type', TypeOfDocument)}
+
+    def __init__(self, entries, state_path, workers=None, batch_size=100, log=print):
+        self.entries = entries
+        self.state_path = state_path
+        self.workers = workers
+        self.batch_size = batch_size
+        self.log = log
+        self.relations = RelationCache()
+        self.errors = []
+
+    def get_done(self):
+        if not os.path.exists(self.state_path):
+            return set()
+        with open(self.state_path, encoding='utf-8') as state:
+            return {line.strip() for line in state if line.strip()}
+
+    def build(self, result):
+        entry = result['entry']
+        model = self.models[result['kind']]
+        instance = model(
+            title=entry.get('title') or os.path.splitext(os.path.basename(entry['path']))[0],
+            description=entry.get('description') or None,
+            project=self.relations.get(Project, entry.get('project'), 'name'),
+            location=self.relations.get(Location, entry.get('location'), 'name'),
+            **result['fields'],
+        )
+        return instance
+
+    @transaction.atomic
+    def write(self, results):
+        by_kind = {}
+        for result in results:
+            by_kind.setdefault(result['kind'], []).append(result)
+
+        for kind, kind_results in by_kind.items():
+            model = self.models[kind]
+            instances = model.objects.bulk_create([self.build(result) for result in kind_results])
+
+            staff, types = [], []
+            type_field, type_model = self.type_models[kind]
+            for instance, result in zip(instances, kind_results):
+                entry = result['entry']
+                staff += [(instance.pk, member.pk) for member in map(self.relations.get_staff_member, entry.get('staff_members') or []) if member]
+                types += [(instance.pk, self.relations.get(type_model, text, 'text').pk) for text in entry.get('types') or []]
+
+            link_many(model._meta.get_field('staff_member'), staff)
+            link_many(model._meta.get_field(type_field), types)
+            # bulk_create sends no signals
+            update_search_vectors(model, [instance.pk for instance in instances])
+            if model is Document:
+                # Pages and text, as Document.save would, after the batch commits
+                for instance in instances:
+                    enqueue(update_document_content, instance.pk)
+            else:
+                # The collections of the projects and locations list the new images
+                invalidate_manifests(get_collection_targets(instances))
+            touch_models(model, StaffMember, type_model, Project, Location)
+
+    def record(self, results):
+        with open(self.state_path, 'a', encoding='utf-8') as state:
+            state.writelines(result['entry']['path'] + '\n' for result in results)
+
+    def flush(self, batch):
+        if batch:
+            self.write(batch)
+            self.record(batch)
+
+    def run(self):
+        done = self.get_done()
+        pending = [entry for entry in self.entries if entry['path'] not in done]
+        self.log(f"{len(pending)} files to ingest, {len(self.entries) - len(pending)} already done")
+
+        started, files, size, batch = time.monotonic(), 0, 0, []
+        # Forked workers must not share the database connections of this process
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker) as pool:
+            for future in as_completed([pool.submit(process_entry, entry) for entry in pending]):
+                result = future.result()
+                if 'error' in result:
+                    self.errors.append(result)
+                    self.log(f"Skipped {result['entry']['path']}: {result['error']}")
+                    continue
+                batch.append(result)
+                files, size = files + 1, size + result['bytes']
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+            self.flush(batch)
+
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.log(f"Ingested {files} files ({size / 1024 ** 2:.1f} MB) in {elapsed:.1f}s: "
+                 f"{files / elapsed:.2f} files/s, {size / 1024 ** 2 / elapsed:.2f} MB/s, {len(self.errors)} errors")
+        return files
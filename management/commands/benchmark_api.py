@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmark import Benchmark, compare, get_cases, get_query_cases
+from ...urls import router
+
+
+class Command(BaseCommand):
+    help = ("Measures the latency percentiles and query counts of every API endpoint, and compares them with a "
+            "JSON baseline, e.g. on an archive filled by seed_archive.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Measured requests per case")
+        parser.add_argument('--warmup', type=int, default=2, help="Requests per case before measuring")
+        parser.add_argument('--cached', action='store_true', help="Measure cached responses instead of bypassing the cache")
+        parser.add_argument('--only', help="Only run the cases whose name contains this text")
+        parser.add_argument('--output', help="Write the results to this JSON file, e.g. to make a new baseline")
+        parser.add_argument('--baseline', help="JSON results to compare with; regressions fail the command")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p95 increase, as a fraction")
+        parser.add_argument('--slack-ms', type=float, default=5.0, help="Allowed p95 increase in ms, on top of the tolerance")
+        parser.add_argument('--query-tolerance', type=int, default=0, help="Allowed number of extra queries")
+
+    def handle(self, *args, **options):
+        cases = [(name, target) for name, target in get_cases(router) + get_query_cases(log=self.stdout.write)
+                 if not options['only'] or options['only'] in name]
+        results = Benchmark(cases, iterations=options['iterations'], warmup=options['warmup'],
+                            cached=options['cached'], log=self.stdout.write).run()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2)
+                output.write('\n')
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as baseline:
+                regressions = compare(results, json.load(baseline), options['tolerance'], options['slack_ms'],
+                                      options['query_tolerance'])
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions:\n" + '\n'.join(regressions))
+            self.stdout.write("No regression against the baseline")
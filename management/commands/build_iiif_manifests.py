@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...cache import get_cache
+from ...iiif import MANIFEST_BASE_URL, MANIFEST_KINDS, build_image_manifest, build_manifest, get_image_info, get_manifest_key, store_manifest
+from ...models import Image, Location, Project
+
+
+class Command(BaseCommand):
+    help = ("Builds and caches the IIIF manifests of the images and the collections of the projects and locations, "
+            "with ids under MEDIAARCHIVE_BASE_URL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', choices=list(MANIFEST_KINDS), help="Kinds of manifests to build, all by default")
+        parser.add_argument('--workers', type=int, default=8, help="Parallel requests to the IIIF server")
+        parser.add_argument('--force', action='store_true', help="Rebuild the manifests that are already cached")
+
+    def handle(self, *args, **options):
+        # The cached manifests are served to every host, so their ids use the configured address
+        base_url = MANIFEST_BASE_URL
+        if not base_url:
+            raise CommandError("Set MEDIAARCHIVE_BASE_URL, the manifests are only cached for it")
+        models = {'image': Image, 'project': Project, 'location': Location}
+
+        for kind in options['kinds'] or MANIFEST_KINDS:
+            pks = list(models[kind].objects.order_by('pk').values_list('pk', flat=True))
+            if not options['force']:
+                cached = get_cache().get_many([get_manifest_key(kind, pk) for pk in pks])
+                pks = [pk for pk in pks if get_manifest_key(kind, pk) not in cached]
+
+            if kind == 'image':
+                # The image sizes are the slow part: fetch them in parallel, they are cached
+                files = Image.objects.filter(pk__in=pks).exclude(iiif_file='').values_list('iiif_file', flat=True)
+                with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                    missing = sum(info is None for info in pool.map(get_image_info, files))
+                if missing:
+                    self.stderr.write(f"{missing} images could not be read from the IIIF server")
+
+                images = Image.objects.select_related('project', 'location').filter(pk__in=pks).iterator()
+                manifests = ((image.pk, build_image_manifest(image, base_url)) for image in images)
+            else:
+                manifests = ((pk, build_manifest(kind, pk, base_url)) for pk in pks)
+
+            built = 0
+            for pk, manifest in manifests:
+                if manifest is not None:
+                    store_manifest(kind, pk, manifest)
+                    built += 1
+            self.stdout.write(f"Built {built} {kind} {MANIFEST_KINDS[kind]}s")
@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from ...export import CHUNK_SIZE, EXPORT_FORMATS, EXPORT_SERIALIZERS, parse_since, stream_export
+
+
+class Command(BaseCommand):
+    help = "Streams every object of a media archive model to a file as NDJSON, CSV or GeoJSON, in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(EXPORT_SERIALIZERS))
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--since', help="Only export the objects updated after this ISO 8601 date or datetime")
+        parser.add_argument('--output', help="Output file, standard output when omitted")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        serializer_class = EXPORT_SERIALIZERS[options['model']]
+        try:
+            since = parse_since(options['since'])
+        except ValidationError:
+            raise CommandError("--since must be an ISO 8601 date or datetime")
+
+        queryset = serializer_class.Meta.model.objects.all()
+        chunks = stream_export(queryset, serializer_class, options['export_format'], since,
+                               chunk_size=options['chunk_size'])
+
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,28 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...ingest import Ingest, read_manifest
+
+
+class Command(BaseCommand):
+    help = ("Ingests the images and documents of a directory, or of a CSV/JSON manifest with the columns "
+            "path, kind, title, description, date, project, location, staff_members and types.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Directory of files, or manifest file")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes, one per CPU by default")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--state', help="File recording the ingested paths, to resume an interrupted ingest")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.exists(source):
+            raise CommandError(f"{source} does not exist")
+
+        state = options['state'] or os.path.join(source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source)), '.ingest-state')
+        ingest = Ingest(read_manifest(source), state, workers=options['workers'], batch_size=options['batch_size'],
+                        log=self.stdout.write)
+        ingest.run()
+        if ingest.errors:
+            self.stderr.write(f"{len(ingest.errors)} files could not be ingested")
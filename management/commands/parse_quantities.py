@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...cache import touch_models
+from ...models import Object3DHop, ObjectPointCloud
+
+
+class Command(BaseCommand):
+    help = "Fills the numeric triangle and point counts from their text, e.g. after loading data without save()."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Rows written per query")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in (Object3DHop, ObjectPointCloud):
+            fields = list(model.quantity_fields.values())
+            rows, unreadable = [], 0
+            with transaction.atomic():
+                for instance in model.objects.only('pk', *model.quantity_fields).iterator(chunk_size=batch_size):
+                    instance.parse_quantities()
+                    unreadable += sum(1 for text_field, number_field in model.quantity_fields.items()
+                                      if getattr(instance, text_field) and getattr(instance, number_field) is None)
+                    rows.append(instance)
+                # bulk_update sends no signals
+                model.objects.bulk_update(rows, fields, batch_size=batch_size)
+                touch_models(model)
+            self.stdout.write(f"Parsed {len(rows)} {model._meta.verbose_name_plural}, {unreadable} values could not be read")
@@ -0,0 +1,48 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from ...assets import ASSET_URL_FIELDS, probe_instance_assets
+from ...cache import touch_models
+from ...ingest import init_worker
+from ...models import Object3DHop, ObjectPointCloud
+
+
+class Command(BaseCommand):
+    help = "Reads the format, counts, bounds and size of the assets of the 3D-hop objects and point clouds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Parallel probes, one per CPU by default")
+        parser.add_argument('--processes', action='store_true', help="Probe in processes instead of threads, for large PLY files")
+        parser.add_argument('--bounds', action='store_true',
+                            help="Compute the bounding box of PLY files, which reads every vertex; implies --processes")
+        parser.add_argument('--force', action='store_true', help="Probe the assets that did not change as well")
+
+    def handle(self, *args, **options):
+        for model in (Object3DHop, ObjectPointCloud):
+            instances = list(model.objects.only('pk', 'asset_metadata', *ASSET_URL_FIELDS.values()).order_by('pk'))
+            if options['processes'] or options['bounds']:
+                # Forked workers must not share the database connections of this process
+                connections.close_all()
+                pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker)
+            else:
+                pool = ThreadPoolExecutor(max_workers=options['workers'])
+            with pool:
+                results = list(pool.map(partial(probe_instance_assets, force=options['force'], bounds=options['bounds']),
+                                        instances))
+
+            changed = []
+            for instance, metadata in zip(instances, results):
+                if metadata != instance.asset_metadata:
+                    instance.asset_metadata = metadata
+                    changed.append(instance)
+            with transaction.atomic():
+                # bulk_update sends no signals
+                model.objects.bulk_update(changed, ['asset_metadata'], batch_size=500)
+                touch_models(model)
+
+            errors = sum('error' in asset for metadata in results for asset in metadata.values())
+            self.stdout.write(f"Probed {len(instances)} {model._meta.verbose_name_plural}: "
+                              f"{len(changed)} updated, {errors} assets could not be read")
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...seed import Seeder
+
+
+class Command(BaseCommand):
+    help = "Fills the archive with generated projects, locations, media, tags and staff, for load tests and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=50)
+        parser.add_argument('--images', type=int, default=5000)
+        parser.add_argument('--documents', type=int, default=1000)
+        parser.add_argument('--objects', type=int, default=300, help="3D-hop objects, and as many point clouds")
+        parser.add_argument('--staff', type=int, default=40)
+        parser.add_argument('--types-per-document', type=int,
+                            help="Types of every document, instead of one or two for most and many for a few")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator, for reproducible archives")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--force', action='store_true', help="Seed even when DEBUG is off")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("This adds thousands of fake objects: run it with DEBUG on, or pass --force")
+        Seeder(projects=options['projects'], images=options['images'], documents=options['documents'],
+               objects=options['objects'], staff=options['staff'], seed=options['seed'],
+               batch_size=options['batch_size'], types_per_document=options['types_per_document'],
+               log=self.stdout.write).run()
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ...documents import update_document_content
+from ...models import Document
+
+
+class Command(BaseCommand):
+    help = ("Computes the missing checksums, page counts and texts of the documents, e.g. for rows from before "
+            "they existed. Documents whose file is missing are skipped.")
+
+    def handle(self, *args, **options):
+        pks = list(Document.objects.exclude(upload='').exclude(upload=None)
+                   .filter(Q(checksum='') | Q(page_count=None)).order_by('pk').values_list('pk', flat=True))
+        for pk in pks:
+            update_document_content(pk)
+        self.stdout.write(f"Read {len(pks)} documents")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...search import SEARCH_MODELS, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Recomputes the full text search vectors of the media, e.g. after loading data without signals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', choices=list(SEARCH_MODELS), help="Models to index, all by default")
+
+    def handle(self, *args, **options):
+        for name in options['models'] or SEARCH_MODELS:
+            updated = update_search_vectors(SEARCH_MODELS[name])
+            self.stdout.write(f"Indexed {updated} {name} rows")
@@ -0,0 +1,74 @@
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the buckets of the request duration histogram
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABELS = ('viewset', 'action', 'depth', 'filters')
+# Timings summed per label set, after the request duration
+TIMINGS = {
+    'db': "Time spent in database queries",
+    'serialize': "Time spent in the view outside database queries, mostly serialization",
+    'render': "Time spent rendering the response",
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestMetrics:
+    """
+    Request timings aggregated in the memory of the process, per label set,
+    exposed in the Prometheus text format. With several worker processes each
+    one has its own counters.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, duration, queries, timings):
+        key = tuple(str(labels.get(name, '')) for name in LABELS)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1), 'count': 0, 'sum': 0.0, 'queries': 0,
+                    **{name: 0.0 for name in TIMINGS},
+                }
+            series['buckets'][bisect_left(self.buckets, duration)] += 1
+            series['count'] += 1
+            series['sum'] += duration
+            series['queries'] += queries
+            for name in TIMINGS:
+                series[name] += timings.get(name, 0.0)
+
+    def render(self):
+        with self.lock:
+            series = {key: {**values, 'buckets': list(values['buckets'])} for key, values in self.series.items()}
+
+        lines = [
+            '# HELP mediaarchive_request_duration_seconds Duration of the API requests',
+            '# TYPE mediaarchive_request_duration_seconds histogram',
+        ]
+        for key, values in sorted(series.items()):
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(LABELS, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), values['buckets']):
+                cumulative += count
+                lines.append(f'mediaarchive_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'mediaarchive_request_duration_seconds_sum{{{labels}}} {values["sum"]}')
+            lines.append(f'mediaarchive_request_duration_seconds_count{{{labels}}} {values["count"]}')
+
+        counters = {f'mediaarchive_request_{name}_seconds_total': (name, help_text) for name, help_text in TIMINGS.items()}
+        counters['mediaarchive_request_queries_total'] = ('queries', "Number of database queries")
+        for metric, (name, help_text) in counters.items():
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for key, values in sorted(series.items()):
+                labels = ','.join(f'{label}="{escape(value)}"' for label, value in zip(LABELS, key))
+                lines.append(f'{metric}{{{labels}}} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
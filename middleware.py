@@ -0,0 +1,176 @@
+import heapq
+import logging
+import time
+from contextlib import ExitStack
+from functools import lru_cache
+
+from diana.utils import build_app_endpoint
+from django.conf import settings
+from django.db import connections
+
+from .metrics import request_metrics
+from .queries import MAX_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged with their slowest queries
+SLOW_REQUEST_MS = getattr(settings, 'MEDIAARCHIVE_SLOW_REQUEST_MS', 1000)
+SLOW_QUERY_SAMPLES = 5
+# Adds a Server-Timing header with the split of each response time
+SERVER_TIMING = getattr(settings, 'MEDIAARCHIVE_SERVER_TIMING', True)
+# Query parameters that are not filters, left out of the filters label
+NON_FILTER_PARAMS = {'depth', 'limit', 'offset', 'page', 'page_size', 'cursor', 'cursor_ordering', 'format',
+                     'fields', 'omit', 'view', 'compact', 'estimate', 'ordering', 'zoom', 'since'}
+# Stands for the query parameters that are not filters of the view, in the filters label, and for
+# unknown methods in the action label
+OTHER_PARAMS = 'other'
+# Methods labelled by name when they are not mapped to an action
+HTTP_METHODS = {'get', 'post', 'put', 'patch', 'delete', 'head', 'options', 'trace'}
+
+
+class QueryTimer:
+    """
+    Database execute wrapper timing the queries of a request, and keeping the
+    slowest ones as samples for the log.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            sample = (duration, self.count, sql)
+            if len(self.slowest) < SLOW_QUERY_SAMPLES:
+                heapq.heappush(self.slowest, sample)
+            else:
+                heapq.heappushpop(self.slowest, sample)
+
+
+@lru_cache(maxsize=None)
+def get_filter_keys(view_class):
+    """
+    Returns the query parameters a view filters on: those of its filterset
+    (with the suffixes of range filters, e.g. images_count_min) or its
+    filterset_fields, and the bounding box of InBBoxFilter.
+    """
+    keys = set()
+    filterset_class = getattr(view_class, 'filterset_class', None)
+    if filterset_class is not None:
+        for name, filter_ in filterset_class.base_filters.items():
+            suffixes = getattr(filter_.field.widget, 'suffixes', None)
+            keys |= {f"{name}_{suffix}" if suffix else name for suffix in suffixes} if suffixes else {name}
+    else:
+        fields = getattr(view_class, 'filterset_fields', None) or ()
+        if isinstance(fields, dict):
+            keys |= {field if lookup == 'exact' else f"{field}__{lookup}" for field, lookups in fields.items() for lookup in lookups}
+        else:
+            keys |= set(fields)
+    for backend in getattr(view_class, 'filter_backends', None) or ():
+        if getattr(backend, 'bbox_param', None):
+            keys.add(backend.bbox_param)
+    return frozenset(keys)
+
+
+def get_filters_label(params, view_class):
+    # Only the known filter keys, so that arbitrary parameters cannot create new series
+    keys = get_filter_keys(view_class) if view_class else frozenset()
+    names = {key for key in params if key not in NON_FILTER_PARAMS}
+    return ','.join(sorted(names & keys) + ([OTHER_PARAMS] if names - keys else []))
+
+
+def get_labels(request, view_func):
+    """
+    Returns the viewset, action, depth and filter keys of an API request. Each
+    label has a bounded set of values, whatever the client sends.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    actions = getattr(view_func, 'actions', None) or {}
+    method = request.method.lower()
+    try:
+        # The depth the views serialize at, see queries.plan_relations
+        depth = str(max(0, min(int(request.GET.get('depth', 0)), MAX_DEPTH)))
+    except ValueError:
+        depth = '0'
+    return {
+        'viewset': view_class.__name__ if view_class else getattr(view_func, '__name__', ''),
+        'action': actions.get(method, method if method in HTTP_METHODS else OTHER_PARAMS),
+        'depth': depth,
+        'filters': get_filters_label(request.GET, view_class),
+    }
+
+
+class PerformanceMiddleware:
+    """
+    Records the time of each request to the media archive API, split into
+    database time (and query count), view time outside the database (mostly
+    serialization) and render time, labelled by viewset, action, depth and
+    filter keys. The timings are aggregated in metrics.request_metrics, sent
+    in a Server-Timing header, and slow requests are logged with their
+    slowest SQL statements. Other routes are passed through untouched.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = f"/{build_app_endpoint('mediaarchive').strip('/')}/"
+
+    def __call__(self, request):
+        if not request.path.startswith(self.prefix):
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        request._performance = {'labels': None, 'view_started': None, 'view_finished': None}
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        if request._performance['labels'] is not None:
+            self.record(request, response, timer, started, finished)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, '_performance'):
+            request._performance['labels'] = get_labels(request, view_func)
+            request._performance['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called between the view and the rendering of DRF responses
+        if hasattr(request, '_performance'):
+            request._performance['view_finished'] = time.perf_counter()
+        return response
+
+    def record(self, request, response, timer, started, finished):
+        # Responses that are not rendered (files, streams) end with the view
+        state = request._performance
+        view_finished = state['view_finished'] or finished
+        duration = finished - started
+        timings = {
+            'db': timer.duration,
+            'serialize': max(view_finished - state['view_started'] - timer.duration, 0.0),
+            'render': finished - view_finished,
+        }
+        request_metrics.observe(state['labels'], duration, timer.count, timings)
+
+        if SERVER_TIMING:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={timings["db"] * 1000:.1f};desc="{timer.count} queries"',
+                f'serialize;dur={timings["serialize"] * 1000:.1f}',
+                f'render;dur={timings["render"] * 1000:.1f}',
+                f'total;dur={duration * 1000:.1f}',
+            ])
+
+        if duration * 1000 >= SLOW_REQUEST_MS:
+            samples = '\n'.join(f"  {seconds * 1000:.1f} ms: {sql}" for seconds, _, sql in sorted(timer.slowest, reverse=True))
+            logger.warning("Slow request %s %s (%.0f ms, %d queries, %.0f ms in the database) %s\n%s",
+                           request.method, request.get_full_path(), duration * 1000, timer.count,
+                           timings['db'] * 1000, state['labels'], samples)
@@ -8,16 +8,50 @@ from ckeditor.fields import RichTextField
 from markdownfield.models import MarkdownField, RenderedMarkdownField
 from markdownfield.validators import VALIDATOR_STANDARD
 from datetime import date
+import os
+import uuid
+from .documents import UPLOAD_DIR, get_checksum
+from .utils import parse_quantity
 from .validators import validate_file_extension, validate_image_extension
 # Create your models here.
 
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+
+# Fields maintained by the application, hidden from the API and the admin forms
+INTERNAL_FIELDS = ['search_vector', 'content']
+# Fields maintained by the application and shown in the API, which cannot be filtered on
+COMPUTED_FIELDS = ['asset_metadata']
+
 def get_list_zeros():
     return [0.0, 0.0, 0.0]
 def get_min_max_default():
     return [-180, 180]
 
 
+class QuantityFieldsMixin:
+    """
+    Keeps integer copies of the quantities written as text (e.g. "250 millions")
+    so that they can be filtered and ordered. quantity_fields maps each text
+    field to its integer field.
+    """
+
+    quantity_fields = {}
+
+    def parse_quantities(self):
+        for text_field, number_field in self.quantity_fields.items():
+            setattr(self, number_field, parse_quantity(getattr(self, text_field)))
+
+    def save(self, *args, **kwargs):
+        self.parse_quantities()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *(number_field for text_field, number_field in self.quantity_fields.items()
+                                                         if text_field in update_fields)}
+        super().save(*args, **kwargs)
+
+
 class Tag(abstract.AbstractTagModel):
     
     class Meta:
@@ -97,6 +131,11 @@ class Project(abstract.AbstractBaseModel):
     
     def __str__(self) -> str:
         return self.name
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', 'id'], name='project_location_id_idx'),
+        ]
     
 
 class Image(abstract.AbstractTIFFImageModel):
@@ -108,12 +147,23 @@ class Image(abstract.AbstractTIFFImageModel):
     description = RichTextField(null=True, blank=True, help_text=("Descriptive text about the images"))
     date = models.DateField(default=date.today, help_text=_("Date in which the image was taken"))
     location = models.ForeignKey(Location, verbose_name=_("Location"), blank=True, null=True, on_delete=models.SET_NULL)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self) -> str:
         return f"{self.title}"
+
+    class Meta(abstract.AbstractTIFFImageModel.Meta):
+        indexes = [
+            GinIndex(fields=['search_vector'], name='image_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='image_title_trgm_idx'),
+            # Filters of the API followed by its (date, id) and id orderings
+            models.Index(fields=['project', 'date', 'id'], name='image_project_date_idx'),
+            models.Index(fields=['location', 'id'], name='image_location_id_idx'),
+            models.Index(fields=['date', 'id'], name='image_date_id_idx'),
+        ]
         
 
-class Object3DHop(abstract.AbstractBaseModel):
+class Object3DHop(QuantityFieldsMixin, abstract.AbstractBaseModel):
     title = models.CharField(max_length=1024, null=True, blank=True, verbose_name=_("Title"))
     staff_member = models.ManyToManyField(StaffMember, blank=True, verbose_name=_("Staff member"), help_text=_("staff member responsible for this piece of data"))
     project = models.ForeignKey(Project, blank=True, null=True, on_delete=models.SET_NULL, help_text=_("Project attached to this media"), related_name="object3dhop_in_project")
@@ -122,6 +172,8 @@ class Object3DHop(abstract.AbstractBaseModel):
     url_full_resolution = models.CharField(max_length=1024, blank=True, null=True, verbose_name=_("URL of full resolution model"))
     triangles_optimized = models.CharField(max_length=256, blank=True, null=True, verbose_name=_("Triangles (optimized)"), help_text=_("number of triangles of the optimized mesh, e.g.: 250 millions"))
     triangles_full_resolution = models.CharField(max_length=256, blank=True, null=True, verbose_name=_("Triangles (full resolution)"), help_text=_("number of triangles of the full resolution mesh, e.g.: 1.3 billions"))
+    triangles_optimized_count = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name=_("Triangles (optimized), as a number"))
+    triangles_full_resolution_count = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name=_("Triangles (full resolution), as a number"))
     description = RichTextField(null=True, blank=True, help_text=("Descriptive text about the 3D object"))
     date = models.DateField(default=date.today, help_text=_("Date in which the 3D object was created"))
     technique = models.ForeignKey(Technique3D, null=True, blank=True, on_delete=models.SET_NULL, help_text=_("Technique used to generate the 3D model"))
@@ -136,7 +188,14 @@ class Object3DHop(abstract.AbstractBaseModel):
 
     preview_image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True)
     location = models.ForeignKey(Location, verbose_name=_("Location"), blank=True, null=True, on_delete=models.SET_NULL)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    asset_metadata = models.JSONField(default=dict, blank=True, editable=False, help_text=_("Format, counts, bounds and size of the assets, read from the files"))
 
+    quantity_fields = {
+        'triangles_optimized': 'triangles_optimized_count',
+        'triangles_full_resolution': 'triangles_full_resolution_count',
+    }
 
     def __str__(self) -> str:
         return f"{self.title}"
@@ -144,9 +203,18 @@ class Object3DHop(abstract.AbstractBaseModel):
     class Meta:
         verbose_name = _("Object 3D-hop")
         verbose_name_plural = _("Objects 3D-hop")
-
-
-class ObjectPointCloud(abstract.AbstractBaseModel):
+        indexes = [
+            GinIndex(fields=['search_vector'], name='object3dhop_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='object3dhop_title_trgm_idx'),
+            # Filters of the API followed by its (date, id) and id orderings
+            models.Index(fields=['project', 'date', 'id'], name='object3dhop_project_date_idx'),
+            models.Index(fields=['location', 'id'], name='object3dhop_location_id_idx'),
+            models.Index(fields=['date', 'id'], name='object3dhop_date_id_idx'),
+            models.Index(fields=['technique', 'id'], name='object3dhop_technique_id_idx'),
+        ]
+
+
+class ObjectPointCloud(QuantityFieldsMixin, abstract.AbstractBaseModel):
     title = models.CharField(max_length=1024, null=True, blank=True, verbose_name=_("title"))
     subtitle = models.CharField(max_length=1024, null=True, blank=True, verbose_name=_("subtitle"))
     staff_member = models.ManyToManyField(StaffMember, blank=True, verbose_name=_("Staff member"), help_text=_("staff member responsible for this piece of data"))
@@ -156,6 +224,8 @@ class ObjectPointCloud(abstract.AbstractBaseModel):
     url_full_resolution = models.CharField(max_length=1024, blank=True, null=True, verbose_name=_("URL of full resolution model"))
     points_optimized = models.CharField(max_length=256, blank=True, null=True, verbose_name=_("Points (optimized)"), help_text=_("number of points of the optimized models, e.g.: 250 millions"))
     points_full_resolution = models.CharField(max_length=256, blank=True, null=True, verbose_name=_("Points (full resolution)"),  help_text=_("number of points of the full resolution model, e.g.: 1.3 billions"))
+    points_optimized_count = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name=_("Points (optimized), as a number"))
+    points_full_resolution_count = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name=_("Points (full resolution), as a number"))
     description = RichTextField(null=True, blank=True, help_text=("Descriptive text about the 3D object"))
     date = models.DateField(default=date.today, help_text=_("Date in which the 3D object was created"))
     technique = models.ForeignKey(Technique3D, null=True, blank=True, on_delete=models.SET_NULL, help_text=_("Technique used to generate the 3D model"))
@@ -166,6 +236,14 @@ class ObjectPointCloud(abstract.AbstractBaseModel):
 
     preview_image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True)
     location = models.ForeignKey(Location, verbose_name=_("Location"), blank=True, null=True, on_delete=models.SET_NULL)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    asset_metadata = models.JSONField(default=dict, blank=True, editable=False, help_text=_("Format, counts, bounds and size of the assets, read from the files"))
+
+    quantity_fields = {
+        'points_optimized': 'points_optimized_count',
+        'points_full_resolution': 'points_full_resolution_count',
+    }
 
     def __str__(self) -> str:
         return f"{self.title}"
@@ -173,6 +251,15 @@ class ObjectPointCloud(abstract.AbstractBaseModel):
     class Meta:
         verbose_name = _("Object Pointcloud")
         verbose_name_plural = _("Objects Pointcloud")
+        indexes = [
+            GinIndex(fields=['search_vector'], name='pointcloud_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='pointcloud_title_trgm_idx'),
+            # Filters of the API followed by its (date, id) and id orderings
+            models.Index(fields=['project', 'date', 'id'], name='pointcloud_project_date_idx'),
+            models.Index(fields=['location', 'id'], name='pointcloud_location_id_idx'),
+            models.Index(fields=['date', 'id'], name='pointcloud_date_id_idx'),
+            models.Index(fields=['technique', 'id'], name='pointcloud_technique_id_idx'),
+        ]
 
 
 class Document(abstract.AbstractBaseModel):
@@ -181,13 +268,59 @@ class Document(abstract.AbstractBaseModel):
     project = models.ForeignKey(Project, blank=True, null=True, on_delete=models.SET_NULL, help_text=_("Project attached to this media"), related_name="document_in_project")
     upload = models.FileField(null=True, blank=True, storage=OriginalFileStorage, upload_to=get_original_path, verbose_name=_("file"), validators=[validate_file_extension])
     type = models.ManyToManyField(TypeOfDocument, blank=True, verbose_name=_("Type of document: Report, Thesis, etc"))
-    size = models.FloatField(null=True, blank=True, help_text=_("Document size in mb"), default=None)
+    size = models.FloatField(null=True, blank=True, help_text=_("Document size in mb, computed from the file when there is one"), default=None)
+    checksum = models.CharField(max_length=64, blank=True, default='', editable=False, help_text=_("SHA-256 of the file"))
+    page_count = models.PositiveIntegerField(null=True, blank=True, editable=False, help_text=_("Number of pages, 0 when unknown"))
+    content = models.TextField(blank=True, default='', editable=False, help_text=_("Text of the file, for the search"))
     description = RichTextField(null=True, blank=True, help_text=("Descriptive text about the document"))
     date = models.DateField(default=date.today, help_text=_("Date in which the document was created"))
     location = models.ForeignKey(Location, verbose_name=_("Location"), blank=True, null=True, on_delete=models.SET_NULL)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self) -> str:
         return f"{self.title}"
     
+    def save(self, *args, **kwargs):
+        # A new file: size and checksum now, pages and text in the background (see signals.py).
+        # Stored files without a checksum (older rows) get theirs in the background too.
+        if self.upload and not self.upload._committed:
+            self.checksum = get_checksum(self.upload)
+            self.size = round(self.upload.size / 1024 ** 2, 2)
+            self.page_count, self.content = None, ''
+        super().save(*args, **kwargs)
+
     class Meta:
-        verbose_name = _("Document")
\ No newline at end of file
+        verbose_name = _("Document")
+        indexes = [
+            GinIndex(fields=['search_vector'], name='document_search_vector_idx'),
+            GinIndex(fields=['title'], opclasses=['gin_trgm_ops'], name='document_title_trgm_idx'),
+            # Filters of the API followed by its (date, id) and id orderings
+            models.Index(fields=['project', 'date', 'id'], name='document_project_date_idx'),
+            models.Index(fields=['location', 'id'], name='document_location_id_idx'),
+            models.Index(fields=['date', 'id'], name='document_date_id_idx'),
+        ]
+
+
+class ChunkedUpload(abstract.AbstractBaseModel):
+    """
+    A document file uploaded in chunks, assembled in UPLOAD_DIR. The upload
+    resumes from offset after an interruption, and becomes a Document once
+    complete.
+    """
+
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    filename = models.CharField(max_length=256)
+    size = models.BigIntegerField(help_text=_("Size of the complete file in bytes"))
+    offset = models.BigIntegerField(default=0, help_text=_("Number of bytes received"))
+    checksum = models.CharField(max_length=64, blank=True, default='', help_text=_("Expected SHA-256 of the complete file"))
+    document = models.ForeignKey(Document, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+
+    class Meta:
+        verbose_name = _("Chunked upload")
+
+    def __str__(self) -> str:
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    @property
+    def path(self):
+        return os.path.join(UPLOAD_DIR, f"{self.uuid}.part")
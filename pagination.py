@@ -0,0 +1,108 @@
+import base64
+import json
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset (cursor) pagination: each page continues after the last row of
+    the previous one, so deep pages cost the same as the first and no COUNT(*)
+    is needed. Pages are keyed on id, or on (date, id) when ordering by date.
+    """
+
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'cursor_ordering'
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    orderings = {
+        'id': ('id',),
+        '-id': ('-id',),
+        'date': ('date', 'id'),
+        '-date': ('-date', '-id'),
+    }
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE or 100
+
+    def get_ordering(self, request, queryset):
+        ordering = request.query_params.get(self.ordering_query_param, 'id')
+        if ordering not in self.orderings:
+            raise NotFound(f"Invalid cursor ordering, use one of: {', '.join(self.orderings)}")
+        ordering = self.orderings[ordering]
+        if 'date' in ordering[0] and not hasattr(queryset.model, 'date'):
+            raise NotFound("This endpoint cannot be ordered by date")
+        return ordering
+
+    def encode_cursor(self, row):
+        # Rows are model instances, or dictionaries on the fast serialization path
+        position = [row[field.lstrip('-')] if isinstance(row, dict) else getattr(row, field.lstrip('-'))
+                    for field in self.ordering]
+        position = [value.isoformat() if isinstance(value, date) else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [date.fromisoformat(value) if field.lstrip('-') == 'date' else int(value)
+                    for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def get_position_filter(self, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            field = self.ordering[index].lstrip('-')
+            lookup = 'lt' if self.ordering[index].startswith('-') else 'gt'
+            equal = {self.ordering[i].lstrip('-'): position[i] for i in range(index)}
+            condition |= Q(**equal, **{f'{field}__{lookup}': position[index]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_position_filter(self.decode_cursor(cursor)))
+
+        # One extra row tells whether there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,301 @@
+import math
+
+from django.contrib.gis.db.models.functions import GeomOutputGeoFunc, SnapToGrid
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections
+from django.db.models import CharField, Count, F, FloatField, ForeignObjectRel, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+# DRF refuses to nest serializers deeper than this
+MAX_DEPTH = 10
+
+
+def get_nested_field_names(model):
+    """
+    Field names of the serializer DRF builds for a nested relation,
+    i.e. the ones behind fields = '__all__': every forward field.
+    """
+    return [field.name for field in model._meta.get_fields()
+            if field.primary_key or ((field.concrete or field.many_to_many) and not field.auto_created)]
+
+
+def _prefixed(lookup, prefix):
+    if isinstance(lookup, Prefetch):
+        return Prefetch(f"{prefix}__{lookup.prefetch_through}", queryset=lookup.queryset)
+    return f"{prefix}__{lookup}"
+
+
+def get_relation_ordering(model):
+    """
+    Order of the rows of model behind to-many relations, the same for
+    prefetches and array subqueries so that every path lists them alike.
+    """
+    return model._meta.ordering or ['pk']
+
+
+def get_internal_fields(model, selects=()):
+    """
+    Lookups of the INTERNAL_FIELDS (search vectors, extracted text) of model
+    and of the relations joined by selects, which no serializer reads.
+    """
+    from .models import INTERNAL_FIELDS
+
+    lookups = []
+    for path in ('', *selects):
+        related = model
+        for name in filter(None, path.split('__')):
+            related = related._meta.get_field(name).related_model
+        names = {field.name for field in related._meta.concrete_fields}
+        lookups += [f"{path}__{name}" if path else name for name in INTERNAL_FIELDS if name in names]
+    return lookups
+
+
+def get_relation_queryset(model, selects=()):
+    """
+    Rows of model behind a to-many relation, joined to selects, without the
+    internal columns of any of them.
+    """
+    queryset = model._default_manager.order_by(*get_relation_ordering(model))
+    if selects:
+        queryset = queryset.select_related(*selects)
+    internal = get_internal_fields(model, selects)
+    return queryset.defer(*internal) if internal else queryset
+
+
+def get_id_queryset(field):
+    """
+    Rows of a to-many relation reduced to the columns a list of ids needs: the
+    primary key, and the foreign key back to the source of reverse relations.
+    """
+    related = field.related_model
+    columns = [related._meta.pk.name]
+    if field.one_to_many:
+        columns.append(field.field.name)
+    return get_relation_queryset(related).only(*columns)
+
+
+def plan_relations(model, field_names, depth):
+    """
+    Returns the select_related and prefetch_related lookups needed to serialize
+    field_names of model at the given depth without a query per row.
+
+    Forward foreign keys are serialized as bare ids at depth 0, so they are only
+    joined when nested. Many-to-many and reverse relations always need their
+    rows, either as an id list (only their keys are fetched) or as nested
+    objects, in the order of get_relation_ordering.
+    """
+    depth = max(0, min(depth, MAX_DEPTH))
+    selects, prefetches = [], []
+
+    for name in field_names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not field.is_relation or field.related_model is None:
+            continue
+
+        related = field.related_model
+        sub_selects, sub_prefetches = [], []
+        if depth > 0:
+            sub_selects, sub_prefetches = plan_relations(related, get_nested_field_names(related), depth - 1)
+
+        if field.concrete and (field.many_to_one or field.one_to_one):
+            if depth == 0:
+                continue
+            selects.append(name)
+            selects += [_prefixed(lookup, name) for lookup in sub_selects]
+        elif depth == 0:
+            prefetches.append(Prefetch(name, queryset=get_id_queryset(field)))
+        else:
+            prefetches.append(Prefetch(name, queryset=get_relation_queryset(related, sub_selects)))
+
+        prefetches += [_prefixed(lookup, name) for lookup in sub_prefetches]
+
+    return selects, prefetches
+
+
+def get_related_models(model, field_names, depth):
+    """
+    Returns the set of models whose rows appear in the serialization of
+    field_names of model at the given depth, model included.
+    """
+    depth = max(0, min(depth, MAX_DEPTH))
+    found = {model}
+
+    for name in field_names:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not field.is_relation or field.related_model is None:
+            continue
+        if field.concrete and (field.many_to_one or field.one_to_one) and depth == 0:
+            continue
+
+        related = field.related_model
+        found.add(related)
+        if depth > 0:
+            found |= get_related_models(related, get_nested_field_names(related), depth - 1)
+
+    return found
+
+
+def defer_unused_columns(queryset, field_names):
+    """
+    Defers the columns of queryset that no serialized field reads, e.g. long
+    descriptions left out of a card view.
+    """
+    deferred = [field.name for field in queryset.model._meta.concrete_fields
+                if not field.primary_key and field.name not in field_names]
+    return queryset.defer(*deferred) if deferred else queryset
+
+
+def plan_queryset(queryset, field_names, depth):
+    """
+    Applies the lookups from plan_relations to queryset, so that a page of
+    results costs a constant number of queries regardless of its size.
+    """
+    selects, prefetches = plan_relations(queryset.model, field_names, depth)
+    if selects:
+        # The columns of queryset itself are deferred by the callers, see defer_unused_columns
+        internal = [lookup for lookup in get_internal_fields(queryset.model, selects) if '__' in lookup]
+        queryset = queryset.select_related(*selects)
+        if internal:
+            queryset = queryset.defer(*internal)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
+
+
+def get_related_rows(model, relation):
+    """
+    Returns the lookup pointing back to model from the rows behind relation,
+    and a queryset of those rows correlated with the outer query.
+    """
+    field = model._meta.get_field(relation)
+    if isinstance(field, ForeignObjectRel):
+        lookup = field.field.name
+    else:
+        lookup = field.related_query_name()
+    return lookup, field.related_model._default_manager.filter(**{lookup: OuterRef('pk')})
+
+
+def get_names(queryset, name_field):
+    """
+    Flat values queryset of name_field in the order of get_relation_ordering.
+    name_field is a field of the model of queryset, or an expression composed
+    of its fields, e.g. Concat('firstname', Value(' '), 'lastname').
+    """
+    queryset = queryset.order_by(*get_relation_ordering(queryset.model))
+    if isinstance(name_field, str):
+        return queryset.values_list(name_field, flat=True)
+    return queryset.annotate(summary_name=name_field).values_list('summary_name', flat=True)
+
+
+def name_list_subquery(model, relation, name_field):
+    """
+    Correlated subquery collecting the names (see get_names) of every row
+    behind a to-many relation of model.
+    """
+    _, related = get_related_rows(model, relation)
+    return ArraySubquery(get_names(related, name_field))
+
+
+def related_count_subquery(model, relation):
+    """
+    Correlated subquery counting the rows behind a to-many relation of model.
+    """
+    lookup, related = get_related_rows(model, relation)
+    counts = related.order_by().values(lookup).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def annotate_relation_summaries(queryset, serializer_class, field_names):
+    """
+    Annotates the values read by the RelationSummaryFields of serializer_class,
+    so that a page of results fetches them all in the same query.
+    """
+    from .serializers import RelationSummaryField
+
+    annotations = {
+        name: field.get_annotation(queryset.model)
+        for name, field in serializer_class._declared_fields.items()
+        if isinstance(field, RelationSummaryField) and name in field_names and name not in queryset.query.annotations
+    }
+    return queryset.annotate(**annotations) if annotations else queryset
+
+
+def estimate_count(queryset):
+    """
+    Row count of an unfiltered queryset from the PostgreSQL planner statistics,
+    which avoids a sequential scan of the table. Returns None when no estimate
+    is available (filtered queryset, other backend, table never analyzed).
+    """
+    connection = connections[queryset.db]
+    if queryset.query.where or connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+def count_facets(queryset, facets):
+    """
+    Counts the rows of queryset per related object of each relation in facets,
+    which maps relation names to the field labelling their objects, in a
+    single UNION ALL of grouped queries. Returns {relation: [{id, label, count}]}
+    with the most frequent objects first; rows without a related object are
+    counted under id None.
+    """
+    if not facets:
+        return {}
+    queryset = queryset.order_by()
+    # A filter on a many-to-many relation (e.g. type=3) keeps its join, which F()
+    # would reuse and count the filtered objects only: those facets count the
+    # filtered rows through a fresh join instead
+    rows = queryset.model._default_manager.filter(pk__in=queryset.values('pk')).order_by()
+    parts = []
+    for relation, label in facets.items():
+        field = queryset.model._meta.get_field(relation)
+        source = rows if field.many_to_many or field.one_to_many else queryset
+        parts.append(
+            source.annotate(facet=Value(relation, output_field=CharField()), value=F(relation), label=F(f'{relation}__{label}'))
+            .values('facet', 'value', 'label')
+            .annotate(count=Count('pk', distinct=True))
+        )
+
+    counts = {relation: [] for relation in facets}
+    for row in parts[0].union(*parts[1:], all=True):
+        counts[row['facet']].append({'id': row['value'], 'label': row['label'], 'count': row['count']})
+    for values in counts.values():
+        values.sort(key=lambda value: (-value['count'], value['label'] or ''))
+    return counts
+
+
+class SimplifyPreserveTopology(GeomOutputGeoFunc):
+    function = 'ST_SimplifyPreserveTopology'
+
+
+def get_zoom_tolerance(zoom):
+    """
+    Size in degrees of one pixel of a 256px web map tile at the given zoom,
+    the largest error that stays invisible on screen.
+    """
+    return 360 / (256 * 2 ** zoom)
+
+
+def annotate_display_geometry(queryset, zoom, field_name='geometry'):
+    """
+    Annotates display_geometry: the geometry simplified to the pixel size of
+    the zoom level and snapped to the coordinate precision that still tells
+    two pixels apart.
+    """
+    tolerance = get_zoom_tolerance(zoom)
+    grid = 10 ** -max(0, math.ceil(-math.log10(tolerance)))
+    simplified = SimplifyPreserveTopology(F(field_name), Value(tolerance, output_field=FloatField()))
+    return queryset.annotate(display_geometry=SnapToGrid(simplified, grid))
@@ -0,0 +1,38 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Numbers that json.dumps writes with an exponent while orjson may not, or the other way round
+RISKY_NUMBER = re.compile(rb'[:,\[]-?(?:0\.0000|[0-9.]+e|[0-9]{17,}\.)')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders compact JSON with orjson when it is installed, byte for byte like
+    JSONRenderer. Indented output, ASCII-only output and pages holding floats
+    formatted differently by the two encoders fall back to JSONRenderer.
+    Like JSONRenderer with strict JSON, NaN and infinite floats are not
+    supported: orjson writes them as null.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type or '', renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            # Dates go through the encoder of JSONRenderer, which formats them differently
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if RISKY_NUMBER.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping of the two Unicode line terminators as JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
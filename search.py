@@ -0,0 +1,167 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F, Q, TextField, Value
+from django.db.models.functions import Greatest
+from django.utils.html import strip_tags
+
+from . import models
+
+# Text search configuration, 'simple' as the archive mixes Swedish and English
+SEARCH_CONFIG = getattr(settings, 'MEDIAARCHIVE_SEARCH_CONFIG', 'simple')
+
+# Searchable models, by the name used in urls.py
+SEARCH_MODELS = {
+    'image': models.Image,
+    'document': models.Document,
+    'object3dhop': models.Object3DHop,
+    'objectpointcloud': models.ObjectPointCloud,
+}
+
+# Attributes indexed at each weight, A ranking highest
+SEARCH_WEIGHTS = {
+    'A': ['title'],
+    'B': ['subtitle', 'type_of_image', 'type', 'technique'],
+    'C': ['staff_member', 'project', 'location'],
+    'D': ['description', 'content'],
+}
+
+
+def get_label(obj):
+    if isinstance(obj, models.StaffMember):
+        return f"{obj.firstname or ''} {obj.lastname or ''}"
+    return getattr(obj, 'text', None) or getattr(obj, 'name', None) or ''
+
+
+def get_search_texts(instance):
+    """
+    Returns the text indexed at each weight for instance: its own text fields
+    with the HTML stripped, and the names of its tags, types, staff members,
+    project and location.
+    """
+    field_names = {field.name for field in instance._meta.get_fields()}
+    texts = {}
+    for weight, names in SEARCH_WEIGHTS.items():
+        parts = []
+        for name in names:
+            if name not in field_names:
+                continue
+            field = instance._meta.get_field(name)
+            if field.many_to_many:
+                parts += [get_label(obj) for obj in getattr(instance, name).all()]
+            elif field.is_relation:
+                related = getattr(instance, name)
+                parts.append(get_label(related) if related else '')
+            else:
+                parts.append(strip_tags(getattr(instance, name) or ''))
+        texts[weight] = ' '.join(part for part in parts if part)
+    return texts
+
+
+def get_search_vector(instance):
+    vectors = [
+        SearchVector(Value(text, output_field=TextField()), weight=weight, config=SEARCH_CONFIG)
+        for weight, text in get_search_texts(instance).items() if text
+    ]
+    if not vectors:
+        return None
+    vector = vectors[0]
+    for other in vectors[1:]:
+        vector = vector + other
+    return vector
+
+
+def update_search_vectors(model, pks=None, chunk_size=500):
+    """
+    Recomputes the search vector of the given rows of model, all of them when
+    pks is None, with one UPDATE per chunk of rows. Uses bulk_update(), so no
+    signal is sent.
+    """
+    queryset = model.objects.prefetch_related(*[
+        name for names in SEARCH_WEIGHTS.values() for name in names
+        if name in {field.name for field in model._meta.many_to_many}
+    ]).select_related(*[
+        name for name in ('project', 'location', 'technique')
+        if name in {field.name for field in model._meta.fields}
+    ])
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+
+    updated, chunk = 0, []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        instance.search_vector = get_search_vector(instance)
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            updated += model.objects.bulk_update(chunk, ['search_vector'])
+            chunk = []
+    if chunk:
+        updated += model.objects.bulk_update(chunk, ['search_vector'])
+    return updated
+
+
+@lru_cache(maxsize=None)
+def get_indexed_relations(model):
+    """
+    Returns the (search model, field name) pairs of the relations to model
+    whose names are indexed, e.g. the project of the images; none for the
+    models that no search vector mentions.
+    """
+    relations = []
+    for search_model in SEARCH_MODELS.values():
+        for name in [name for names in SEARCH_WEIGHTS.values() for name in names]:
+            try:
+                field = search_model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.is_relation and field.related_model is model:
+                relations.append((search_model, name))
+    return tuple(relations)
+
+
+def get_dependent_rows(model, pk):
+    """
+    Returns the primary keys, by model, of the rows whose search vector
+    contains the name of the row pk of model, e.g. the images of a project.
+    """
+    rows = {}
+    for search_model, name in get_indexed_relations(model):
+        rows.setdefault(search_model, set()).update(
+            search_model.objects.filter(**{name: pk}).values_list('pk', flat=True))
+    return rows
+
+
+def update_rows_search_vectors(rows):
+    for model, pks in rows.items():
+        if pks:
+            update_search_vectors(model, pks)
+
+
+def update_dependent_search_vectors(model, pk):
+    """
+    Reindexes the rows whose search vector contains the name of the row pk of
+    model, after it changed.
+    """
+    update_rows_search_vectors(get_dependent_rows(model, pk))
+
+
+def search(text, querysets, limit=20):
+    """
+    Ranked full text search across the querysets of the media models, given by
+    their name in SEARCH_MODELS. Matches the search vector with a websearch
+    query, and the title by trigram similarity so that typos still find it.
+    Returns (name, instance) pairs, best first; each instance carries its score
+    in search_score.
+    """
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+    results = []
+    for name, queryset in querysets.items():
+        queryset = (queryset
+                    .filter(Q(search_vector=query) | Q(title__trigram_similar=text))
+                    .annotate(search_score=Greatest(SearchRank(F('search_vector'), query), TrigramSimilarity('title', text)))
+                    .order_by('-search_score', 'pk'))
+        results += [(name, instance) for instance in queryset[:limit]]
+
+    results.sort(key=lambda result: -(result[1].search_score or 0))
+    return results[:limit]
@@ -0,0 +1,160 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.gis.geos import Point, Polygon
+from django.db import transaction
+
+from .cache import touch_models
+from .iiif import get_collection_targets, invalidate_manifests
+from .ingest import link_many
+from .models import (Document, Image, Location, Object3DHop, ObjectPointCloud, Project, StaffMember, Tag, Technique3D,
+                     TypeOfDocument, TypeOfImage)
+from .search import SEARCH_MODELS, update_search_vectors
+from .utils import parse_quantity
+
+# Words of the generated titles and names, so that searches find something
+WORDS = ['tomb', 'chamber', 'church', 'rune', 'stone', 'fresco', 'altar', 'grave', 'villa', 'temple', 'harbour',
+         'fortress', 'mosaic', 'inscription', 'facade', 'portal', 'crypt', 'well', 'bridge', 'kiln']
+PLACES = ['Cerveteri', 'Tarquinia', 'Vulci', 'Uppsala', 'Lund', 'Visby', 'Birka', 'Gamla Uppsala', 'Kalmar', 'Skara',
+          'Orvieto', 'Chiusi', 'Populonia', 'Veii', 'Sigtuna', 'Ystad']
+FIRSTNAMES = ['Anna', 'Erik', 'Maria', 'Lars', 'Giulia', 'Marco', 'Sara', 'Johan', 'Elena', 'Karin']
+LASTNAMES = ['Andersson', 'Rossi', 'Johansson', 'Bianchi', 'Karlsson', 'Esposito', 'Nilsson', 'Romano']
+QUANTITIES = ['{} thousands', '{} millions', '{:.1f} millions', '{:.1f} billions']
+
+
+class Seeder:
+    """
+    Fills the archive with generated objects for load tests and benchmarks.
+    Sizes follow the skew of the real archive: a few projects hold most of the
+    media, media sit mostly at the location of their project, and dates
+    cluster around the years of each project. Rows are written with
+    bulk_create, and the search vectors computed at the end.
+    types_per_document gives every document that many types instead of a skewed
+    number, e.g. for the type_names benchmarks.
+    """
+
+    def __init__(self, projects=50, images=5000, documents=1000, objects=300, staff=40, seed=0, batch_size=1000,
+                 types_per_document=None, log=print):
+        self.counts = {'projects': projects, 'images': images, 'documents': documents, 'objects': objects,
+                       'staff': staff}
+        self.types_per_document = types_per_document
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.created = {}
+        self.log = log
+
+    def title(self, words=3):
+        return ' '.join(self.random.sample(WORDS, words)).capitalize()
+
+    def some(self, objects, mean):
+        # Most objects get one or two, a few get many
+        count = min(len(objects), max(0, int(self.random.expovariate(1 / mean))))
+        return self.random.sample(objects, count)
+
+    def quantity(self):
+        return self.random.choice(QUANTITIES).format(self.random.uniform(1, 999) if self.random.random() < 0.5
+                                                     else self.random.randint(1, 999))
+
+    def bulk_create(self, model, objects):
+        objects = model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.created.setdefault(model, []).extend(obj.pk for obj in objects)
+        return objects
+
+    def vocabulary(self, model, texts):
+        # Tags are shared with earlier seeds and real data
+        return [model.objects.get_or_create(text=text)[0] for text in texts]
+
+    def create_vocabularies(self):
+        self.tags = self.vocabulary(Tag, WORDS)
+        self.image_types = self.vocabulary(TypeOfImage, [
+            'photograph', 'drawing', 'plan', 'section', 'orthophoto', 'map', 'aerial photograph', 'scan'])
+        self.document_types = self.vocabulary(TypeOfDocument, [
+            'report', 'thesis', 'article', 'field notes', 'catalogue', 'dataset'])
+        self.techniques = self.vocabulary(Technique3D, [
+            'photogrammetry', 'laser scanning', 'structured light', 'CT scan', 'modelling'])
+        self.staff = self.bulk_create(StaffMember, [
+            StaffMember(firstname=self.random.choice(FIRSTNAMES), lastname=self.random.choice(LASTNAMES))
+            for _ in range(self.counts['staff'])])
+
+    def create_places(self):
+        locations = []
+        for index in range(max(1, self.counts['projects'] // 2)):
+            x, y = self.random.uniform(10, 20), self.random.uniform(41, 60)
+            if self.random.random() < 0.3:
+                size = self.random.uniform(0.001, 0.05)
+                geometry = Polygon(((x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)), srid=4326)
+            else:
+                geometry = Point(x, y, srid=4326)
+            locations.append(Location(name=f"{self.random.choice(PLACES)} {index}", geometry=geometry))
+        self.locations = self.bulk_create(Location, locations)
+        link_many(Location._meta.get_field('tags'), [(location.pk, tag.pk) for location in self.locations
+                                                     for tag in self.some(self.tags, 2)])
+
+        self.projects = self.bulk_create(Project, [
+            Project(name=f"{self.title(2)} {index}", subtitle=self.title(), location=self.random.choice(self.locations),
+                    description=f"<p>{self.title(6)}.</p>")
+            for index in range(self.counts['projects'])])
+        link_many(Project._meta.get_field('staff_member'), [(project.pk, member.pk) for project in self.projects
+                                                           for member in self.some(self.staff, 3)])
+        # Pareto weights: a few large projects, a long tail of small ones
+        self.weights = [self.random.paretovariate(1.2) for _ in self.projects]
+        self.years = {project.pk: self.random.randint(2000, 2024) for project in self.projects}
+
+    def media_fields(self, index):
+        project = self.random.choices(self.projects, self.weights)[0] if self.projects and self.random.random() < 0.9 else None
+        location = project.location if project and self.random.random() < 0.8 else self.random.choice(self.locations)
+        year = self.years[project.pk] if project else self.random.randint(2000, 2024)
+        day = date(year, 1, 1) + timedelta(days=int(self.random.gauss(180, 200)))
+        return {
+            'title': f"{self.title()} {index}",
+            'project': project,
+            'location': location,
+            'date': day,
+            'description': f"<p>{self.title(8)}.</p>" if self.random.random() < 0.7 else None,
+        }
+
+    def link_media(self, model, objects, types_field=None, types=(), types_count=None):
+        link_many(model._meta.get_field('staff_member'), [(obj.pk, member.pk) for obj in objects
+                                                         for member in self.some(self.staff, 1.5)])
+        if types_field:
+            types = list(types)
+            link_many(model._meta.get_field(types_field), [
+                (obj.pk, kind.pk) for obj in objects
+                for kind in (self.some(types, 1.2) if types_count is None
+                             else self.random.sample(types, min(types_count, len(types))))])
+
+    def create_media(self):
+        images = self.bulk_create(Image, [
+            Image(file=f"seed/image-{index}.tif", iiif_file=f"seed/image-{index}.tif", **self.media_fields(index))
+            for index in range(self.counts['images'])])
+        self.link_media(Image, images, 'type_of_image', self.image_types)
+        invalidate_manifests(get_collection_targets(images))
+
+        documents = self.bulk_create(Document, [
+            Document(size=round(self.random.lognormvariate(0, 1.5), 2), **self.media_fields(index))
+            for index in range(self.counts['documents'])])
+        self.link_media(Document, documents, 'type', self.document_types, self.types_per_document)
+
+        for model in (Object3DHop, ObjectPointCloud):
+            objects = []
+            for index in range(self.counts['objects']):
+                obj = model(technique=self.random.choice(self.techniques), scaled=self.random.random() < 0.5,
+                            preview_image=self.random.choice(images) if images else None, **self.media_fields(index))
+                for text_field, number_field in model.quantity_fields.items():
+                    setattr(obj, text_field, self.quantity())
+                    setattr(obj, number_field, parse_quantity(getattr(obj, text_field)))
+                objects.append(obj)
+            self.link_media(model, self.bulk_create(model, objects))
+
+    def run(self):
+        with transaction.atomic():
+            self.create_vocabularies()
+            self.create_places()
+            self.create_media()
+            self.log(f"Created {len(self.projects)} projects, {len(self.locations)} locations, "
+                     f"{self.counts['images']} images, {self.counts['documents']} documents and "
+                     f"{self.counts['objects']} 3D objects of each kind")
+            # bulk_create sends no signals
+            for name, model in SEARCH_MODELS.items():
+                self.log(f"Indexed {update_search_vectors(model, self.created.get(model, []))} {name} rows")
+            touch_models(Tag, TypeOfImage, TypeOfDocument, Technique3D, *self.created)
@@ -1,19 +1,154 @@
 from diana.abstract.serializers import DynamicDepthSerializer, GenericSerializer
+from django.db.models import Value
+from django.db.models.functions import Concat
+from rest_framework_gis.fields import GeometryField
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
-from rest_framework.serializers import SerializerMethodField
+from rest_framework.serializers import Field, ModelSerializer
 from . import models
 from diana.utils import get_fields, DEFAULT_FIELDS
 from .models import *
+from .queries import get_names, name_list_subquery, related_count_subquery
 
+# First and last name of a staff member, for NameListField
+STAFF_MEMBER_NAME = Concat('firstname', Value(' '), 'lastname')
 
-class TIFFImageSerializer(DynamicDepthSerializer):
+
+class RelationSummaryField(Field):
+    """
+    Read-only value summarizing the objects behind a to-many relation. Reads the
+    annotation added by queries.annotate_relation_summaries when present, and
+    computes it from the (possibly prefetched) relation otherwise.
+    """
+
+    def __init__(self, relation, **kwargs):
+        self.relation = relation
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_annotation(self, model):
+        raise NotImplementedError
+
+    def summarize(self, related):
+        raise NotImplementedError
+
+    def to_representation(self, instance):
+        value = getattr(instance, self.field_name, None)
+        if value is None:
+            value = self.summarize(getattr(instance, self.relation))
+        return value
+
+
+class NameListField(RelationSummaryField):
+    """
+    List with the names of the objects behind a to-many relation. name_field
+    is a field of the related model, or an expression composed of its fields,
+    e.g. NameListField('staff_member', STAFF_MEMBER_NAME).
+    """
+
+    def __init__(self, relation, name_field='text', **kwargs):
+        self.name_field = name_field
+        super().__init__(relation, **kwargs)
+
+    def get_annotation(self, model):
+        return name_list_subquery(model, self.relation, self.name_field)
+
+    def summarize(self, related):
+        if isinstance(self.name_field, str):
+            return [getattr(obj, self.name_field) for obj in related.all()]
+        # Expressions are computed by the database
+        return list(get_names(related.all(), self.name_field))
+
+    def to_representation(self, instance):
+        return list(super().to_representation(instance))
+
+
+class RelatedCountField(RelationSummaryField):
+    """
+    Number of objects behind a to-many relation.
+    """
+
+    def get_annotation(self, model):
+        return related_count_subquery(model, self.relation)
+
+    def summarize(self, related):
+        return related.count()
+
+
+class InternalFieldsMixin:
+    """
+    Leaves the INTERNAL_FIELDS out of the serializers DRF builds for nested
+    relations, which otherwise use every field of the related model.
+    """
+
+    def build_nested_field(self, field_name, relation_info, nested_depth):
+        field_class, field_kwargs = super().build_nested_field(field_name, relation_info, nested_depth)
+        model_fields = {field.name for field in relation_info.related_model._meta.get_fields()}
+        internal = [name for name in INTERNAL_FIELDS if name in model_fields]
+        if not internal:
+            return field_class, field_kwargs
+
+        class NestedSerializer(InternalFieldsMixin, field_class):
+            class Meta(field_class.Meta):
+                fields = None
+                exclude = internal
+
+        return NestedSerializer, field_kwargs
+
+
+def select_fields(serializer_class, params):
+    """
+    Returns the fields of serializer_class requested by the query parameters:
+    view=card for the Meta.card_fields of grid views, fields=a,b to keep only
+    some fields and omit=a,b to leave some out.
+    """
+    names = list(serializer_class.Meta.fields)
+    if params.get('view') == 'card':
+        names = list(getattr(serializer_class.Meta, 'card_fields', names))
+    if params.get('fields'):
+        requested = params['fields'].split(',')
+        names = [name for name in names if name in requested]
+    if params.get('omit'):
+        omitted = params['omit'].split(',')
+        names = [name for name in names if name not in omitted]
+    return names
+
+
+class SparseFieldsMixin:
+    """
+    Serializes only the field names listed in context['fields'], see select_fields.
+    """
+
+    def get_field_names(self, declared_fields, info):
+        names = super().get_field_names(declared_fields, info)
+        selected = self.context.get('fields')
+        if selected is None:
+            return names
+        return [name for name in names if name in selected]
+
+
+class TIFFImageSerializer(SparseFieldsMixin, InternalFieldsMixin, DynamicDepthSerializer):
+    type_names = NameListField('type_of_image')
     
     class Meta:
         model = Image
-        fields = get_fields(Image, exclude=DEFAULT_FIELDS)+ ['id']
+        fields = get_fields(Image, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS)+ ['id', 'type_names']
+        card_fields = ['id', 'title', 'iiif_file', 'date', 'type_names']
         
     
-class LocationSerializer(GeoFeatureModelSerializer):
+class DisplayGeometryField(GeometryField):
+    """
+    Serializes the simplified geometry annotated by queries.annotate_display_geometry
+    when there is one, and the stored geometry otherwise.
+    """
+
+    def get_attribute(self, instance):
+        simplified = getattr(instance, 'display_geometry', None)
+        return simplified if simplified is not None else super().get_attribute(instance)
+
+
+class LocationSerializer(InternalFieldsMixin, GeoFeatureModelSerializer):
+    geometry = DisplayGeometryField(required=False, allow_null=True)
     
     class Meta:
         model = Location
@@ -22,40 +157,59 @@ class LocationSerializer(GeoFeatureModelSerializer):
         depth = 1
 
 
-class Object3DHopSerializer(DynamicDepthSerializer):
+class Object3DHopSerializer(SparseFieldsMixin, InternalFieldsMixin, DynamicDepthSerializer):
     
     class Meta:
         model = Object3DHop
-        fields = get_fields(Object3DHop, exclude=DEFAULT_FIELDS)+ ['id']
+        fields = get_fields(Object3DHop, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS)+ ['id']
+        card_fields = ['id', 'title', 'preview_image', 'date', 'project']
 
 
-class ObjectPointCloudSerializer(DynamicDepthSerializer):
+class ObjectPointCloudSerializer(SparseFieldsMixin, InternalFieldsMixin, DynamicDepthSerializer):
 
     class Meta:
         model = ObjectPointCloud
-        fields = get_fields(ObjectPointCloud, exclude=DEFAULT_FIELDS)+ ['id']
+        fields = get_fields(ObjectPointCloud, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS)+ ['id']
+        card_fields = ['id', 'title', 'subtitle', 'preview_image', 'date', 'project']
 
 
-class DocumentSerializer(DynamicDepthSerializer):
-    type_names = SerializerMethodField()
+class DocumentSerializer(SparseFieldsMixin, InternalFieldsMixin, DynamicDepthSerializer):
+    type_names = NameListField('type')
     
     class Meta:
         model = Document
-        fields = get_fields(Document, exclude=DEFAULT_FIELDS)+ ['id']
-
-    def get_type_names(self, obj):
-        type_names = []
-        types = obj.type.all()
-        for type in types:
-            type_names.append(type.text)
-        return type_names
+        fields = get_fields(Document, exclude=DEFAULT_FIELDS + INTERNAL_FIELDS)+ ['id', 'type_names']
+        card_fields = ['id', 'title', 'upload', 'size', 'date', 'type_names']
 
 
-class ProjectSerializer(DynamicDepthSerializer):
+class ProjectSerializer(SparseFieldsMixin, InternalFieldsMixin, DynamicDepthSerializer):
+    images_count = RelatedCountField('image_in_project')
+    threedhop_count = RelatedCountField('object3dhop_in_project')
+    pointcloud_count = RelatedCountField('pointcloud_in_project')
+    documents_count = RelatedCountField('document_in_project')
     
     class Meta:
         model = Project
         fields = get_fields(Project, exclude=DEFAULT_FIELDS)+ ['id', 'image_in_project', 
                                                                'pointcloud_in_project', 'object3dhop_in_project',
-                                                               'document_in_project']
+                                                               'document_in_project', 'images_count', 'threedhop_count',
+                                                               'pointcloud_count', 'documents_count']
+        card_fields = ['id', 'name', 'subtitle', 'location', 'images_count', 'threedhop_count',
+                       'pointcloud_count', 'documents_count']
+
+
+class CompactProjectSerializer(ProjectSerializer):
+    
+    class Meta(ProjectSerializer.Meta):
+        fields = get_fields(Project, exclude=DEFAULT_FIELDS)+ ['id', 'images_count', 'threedhop_count',
+                                                               'pointcloud_count', 'documents_count']
 
+
+class DocumentUploadSerializer(ModelSerializer):
+    """
+    Fields set on the document created from a chunked upload.
+    """
+
+    class Meta:
+        model = Document
+        fields = ['title', 'description', 'date', 'project', 'location', 'staff_member', 'type']
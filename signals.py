@@ -0,0 +1,110 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .assets import update_asset_metadata
+from .cache import touch_models
+from .documents import update_document_content
+from .iiif import invalidate_manifests, warm_derivatives
+from .models import Document, Image, Location, Object3DHop, ObjectPointCloud, Project
+from .search import (SEARCH_MODELS, get_dependent_rows, get_indexed_relations, update_dependent_search_vectors,
+                     update_rows_search_vectors, update_search_vectors)
+from .tasks import enqueue
+
+
+def is_archive_model(model):
+    return model._meta.app_label == 'mediaarchive'
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_cached_responses(sender, **kwargs):
+    if is_archive_model(sender):
+        touch_models(sender)
+
+
+@receiver(m2m_changed)
+def invalidate_cached_relations(sender, instance, model, action, **kwargs):
+    # Both ends of the relation list each other
+    if action.startswith('post_') and is_archive_model(sender):
+        touch_models(type(instance), model)
+
+
+@receiver(post_save)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if raw or not is_archive_model(sender):
+        return
+    if sender in SEARCH_MODELS.values():
+        update_search_vectors(sender, [instance.pk])
+    elif get_indexed_relations(sender):
+        # Renaming a project can touch thousands of media, found and indexed in the background
+        enqueue(update_dependent_search_vectors, sender, instance.pk)
+
+
+@receiver(pre_delete)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    # The media lose the reference only once the row is gone, so they are found now
+    if is_archive_model(sender) and sender not in SEARCH_MODELS.values() and get_indexed_relations(sender):
+        enqueue(update_rows_search_vectors, get_dependent_rows(sender, instance.pk))
+
+
+@receiver(m2m_changed)
+def update_search_index_relations(sender, instance, model, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear') or not is_archive_model(sender):
+        return
+    if type(instance) in SEARCH_MODELS.values():
+        update_search_vectors(type(instance), [instance.pk])
+    elif model in SEARCH_MODELS.values() and pk_set:
+        enqueue(update_search_vectors, model, set(pk_set))
+
+
+@receiver(post_save, sender=Image)
+def warm_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw:
+        warm_derivatives(instance)
+
+
+@receiver(pre_save, sender=Image)
+def remember_image_collections(sender, instance, raw=False, **kwargs):
+    # The collections an image leaves change as well as the ones it joins
+    previous = None
+    if instance.pk is not None and not raw:
+        previous = Image.objects.filter(pk=instance.pk).values('project_id', 'location_id').first()
+    instance._previous_collections = previous or {}
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_image_manifests(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_collections', {})
+    invalidate_manifests([
+        ('image', instance.pk),
+        ('project', instance.project_id),
+        ('location', instance.location_id),
+        ('project', previous.get('project_id')),
+        ('location', previous.get('location_id')),
+    ])
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Location)
+@receiver(pre_delete, sender=Project)
+@receiver(pre_delete, sender=Location)
+def invalidate_collection_manifests(sender, instance, **kwargs):
+    # The manifests of the images show the name of their project and location
+    kind = sender._meta.model_name
+    images = Image.objects.filter(**{kind: instance.pk}).values_list('pk', flat=True)
+    invalidate_manifests([(kind, instance.pk), *(('image', pk) for pk in images)])
+
+
+@receiver(post_save, sender=Object3DHop)
+@receiver(post_save, sender=ObjectPointCloud)
+def probe_3d_assets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue(update_asset_metadata, sender, instance.pk)
+
+
+@receiver(post_save, sender=Document)
+def extract_document_content(sender, instance, raw=False, **kwargs):
+    # Document.save clears the page count when the file changes
+    if not raw and instance.upload and (instance.page_count is None or not instance.checksum):
+        enqueue(update_document_content, instance.pk)
@@ -0,0 +1,48 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Threads running background tasks in each process; 0 runs them inline, at commit
+TASK_WORKERS = getattr(settings, 'MEDIAARCHIVE_TASK_WORKERS', 2)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=TASK_WORKERS, thread_name_prefix='mediaarchive-task')
+        return _executor
+
+
+def run_task(task, close_connections=True):
+    try:
+        task()
+    except Exception:
+        logger.exception("Background task %r failed", task)
+    finally:
+        # Worker threads open their own database connections
+        if close_connections:
+            connections.close_all()
+
+
+def enqueue(func, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) in a local pool of worker threads once the
+    current transaction commits, without an external broker. Tasks are lost
+    if the process stops, so they must be safe to run again (e.g. from a
+    management command).
+    """
+    task = partial(func, *args, **kwargs)
+    if TASK_WORKERS <= 0:
+        transaction.on_commit(partial(run_task, task, close_connections=False))
+    else:
+        transaction.on_commit(partial(get_executor().submit, run_task, task))
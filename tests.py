@@ -1,4 +1,1141 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from urllib.error import URLError
+from urllib.parse import urlsplit
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Polygon
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
 
+from . import assets, documents, fastpath, iiif, ingest, middleware, models, signals, tasks, views
+from .benchmark import get_tile, get_type_names_documents
+from .cache import get_cache, get_modified_stamps, get_stamp_key
+from .export import parse_since
+from .fastpath import FastSerializer
+from .metrics import RequestMetrics
+from .queries import MAX_DEPTH, get_relation_ordering
+from .middleware import PerformanceMiddleware, QueryTimer
+from .renderers import FastJSONRenderer
+from .search import search, update_dependent_search_vectors, update_search_vectors
+from .seed import Seeder
+from .serializers import STAFF_MEMBER_NAME, NameListField
+from .urls import router
+from .utils import parse_quantity
+
+# Viewsets serializing with DynamicDepthSerializer, whose depth is set by the request
+DEPTH_VIEWSETS = [views.ProjectViewSet, views.IIIFImageViewSet, views.DocumentViewSet, views.Object3DHopViewSet,
+                  views.ObjectPointcloudViewSet]
+
+
+def get_url(viewset_class):
+    prefix = next(prefix for prefix, viewset, _ in router.registry if viewset is viewset_class)
+    return f"/{prefix}/"
+
+
+class SeededTestCase(TestCase):
+    """
+    Test case on a small generated archive, see seed.Seeder. The response cache
+    is emptied before each test, so that every request reaches the database.
+    """
+
+    seed_sizes = {'projects': 6, 'images': 60, 'documents': 40, 'objects': 30, 'staff': 10}
+
+    @classmethod
+    def setUpTestData(cls):
+        Seeder(**cls.seed_sizes, log=lambda message: None).run()
+
+    def setUp(self):
+        get_cache().clear()
+
+
+class QueryCountTests(SeededTestCase):
+    """
+    A list page costs the same number of queries whatever its size.
+    """
+
+    def assertConstantQueries(self, url, small=10, large=50):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(f"{url}&limit={small}").status_code, 200)
+        with self.assertNumQueries(len(captured)):
+            response = self.client.get(f"{url}&limit={large}")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_lists(self):
+        for viewset in DEPTH_VIEWSETS:
+            for depth in (0, 1, 2):
+                with self.subTest(viewset=viewset.__name__, depth=depth):
+                    response = self.assertConstantQueries(f"{get_url(viewset)}?depth={depth}", small=3, large=20)
+                    self.assertGreater(len(response.json()['results']), 3)
+
+    def test_locations(self):
+        self.assertConstantQueries(f"{get_url(views.LocationViewSet)}?format=json", small=3, large=20)
+
+    def test_id_lists_fetch_keys_only(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(f"{get_url(views.ProjectViewSet)}?depth=0&limit=10")
+        table = models.Image._meta.db_table
+        self.assertTrue(any(f'"{table}"."id"' in query['sql'] for query in captured))
+        self.assertFalse(any(f'"{table}"."description"' in query['sql'] for query in captured))
+
+    def test_nested_rows_skip_internal_columns(self):
+        for viewset in DEPTH_VIEWSETS:
+            for depth in (1, 2):
+                with self.subTest(viewset=viewset.__name__, depth=depth):
+                    with CaptureQueriesContext(connection) as captured:
+                        self.client.get(f"{get_url(viewset)}?depth={depth}&limit=10")
+                    for column in models.INTERNAL_FIELDS:
+                        self.assertFalse(any(f'."{column}"' in query['sql'] for query in captured), column)
+
+
+class ModifiedStampTests(SimpleTestCase):
+
+    def tearDown(self):
+        get_cache().delete(get_stamp_key(models.Tag))
+
+    def test_evicted_stamp_moves_forward(self):
+        # An evicted stamp must not come back with the time of cached responses
+        get_cache().set(get_stamp_key(models.Tag), 1.0, timeout=None)
+        self.assertEqual(get_modified_stamps([models.Tag])[models.Tag], 1.0)
+        get_cache().delete(get_stamp_key(models.Tag))
+        stamp = get_modified_stamps([models.Tag])[models.Tag]
+        self.assertGreater(stamp, 1.0)
+        self.assertEqual(get_modified_stamps([models.Tag])[models.Tag], stamp)
+
+
+class LocationGeometryTests(SeededTestCase):
+    """
+    Map requests: geometries simplified to the zoom, bounding box queries and vector tiles.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ring = [(15 + 0.2 * math.cos(2 * math.pi * index / 500), 50 + 0.1 * math.sin(2 * math.pi * index / 500))
+                for index in range(500)]
+        cls.lake = models.Location.objects.create(name="Lake", geometry=Polygon(ring + ring[:1], srid=4326))
+        cls.url = get_url(views.LocationViewSet)
+
+    def get_features(self, **params):
+        response = self.client.get(self.url, {'format': 'json', 'limit': 1000, **params})
+        self.assertEqual(response.status_code, 200)
+        return response, response.json()['features']
+
+    def test_zoom_reduces_payload(self):
+        full, full_features = self.get_features()
+        zoomed, zoomed_features = self.get_features(zoom=5)
+        self.assertEqual([feature['id'] for feature in zoomed_features], [feature['id'] for feature in full_features])
+        self.assertLess(len(zoomed.content), len(full.content) / 2)
+
+        lake = next(feature for feature in zoomed_features if feature['id'] == self.lake.pk)
+        self.assertLess(len(lake['geometry']['coordinates'][0]), 100)
+        self.assertTrue(all(round(value, 2) == value for point in lake['geometry']['coordinates'][0] for value in point))
+
+    def test_in_bbox(self):
+        bbox = (14.5, 49.5, 15.5, 50.5)
+        _, features = self.get_features(in_bbox=','.join(map(str, bbox)))
+        expected = models.Location.objects.filter(geometry__bboverlaps=Polygon.from_bbox(bbox))
+        self.assertEqual({feature['id'] for feature in features}, set(expected.values_list('pk', flat=True)))
+        self.assertIn(self.lake.pk, {feature['id'] for feature in features})
+
+    def test_tiles(self):
+        z, x, y = get_tile(8, 15, 50)
+        response = self.client.get(f"{self.url}tiles/{z}/{x}/{y}.mvt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        # The layer and attribute names are stored as strings in the protobuf
+        self.assertIn(b'locations', response.content)
+        self.assertIn(b'Lake', response.content)
+
+        self.assertEqual(self.client.get(f"{self.url}tiles/8/0/0.mvt").content, b'')
+        self.assertEqual(self.client.get(f"{self.url}tiles/2/4/0.mvt").status_code, 404)
+
+
+class ExportTests(SimpleTestCase):
+
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(''))
+        self.assertEqual(parse_since('2024-02-29').isoformat()[:10], '2024-02-29')
+        self.assertEqual(parse_since('2024-02-29T10:00:00+00:00').isoformat(), '2024-02-29T10:00:00+00:00')
+        for value in ('yesterday', '2024-02-30', '2024-13-01T10:00:00'):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                parse_since(value)
+
+
+class SearchTests(SeededTestCase):
+
+    def test_update_in_chunks(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(update_search_vectors(models.Image, chunk_size=25), models.Image.objects.count())
+        updates = [query for query in captured if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), math.ceil(models.Image.objects.count() / 25))
+
+    def test_search(self):
+        image = models.Image.objects.order_by('pk').first()
+        word = image.title.split()[0]
+        results = search(word, {'image': models.Image.objects.all()}, limit=100)
+        self.assertIn(image.pk, [instance.pk for _, instance in results])
+
+    def test_dependents_in_the_background(self):
+        project = models.Project.objects.annotate(images=Count('image_in_project')).filter(images__gt=0).first()
+        with mock.patch.object(signals, 'enqueue') as enqueue:
+            models.Tag.objects.create(text="Unindexed")
+            enqueue.assert_not_called()
+            # Only the task looks the media up
+            with CaptureQueriesContext(connection) as captured:
+                project.name = "Zanzibarian excavation"
+                project.save()
+            # (the images are read by the IIIF invalidation, the other media only by the task)
+            for model in (models.Document, models.Object3DHop, models.ObjectPointCloud):
+                self.assertFalse(any(model._meta.db_table in query['sql'] for query in captured))
+            enqueue.assert_called_once_with(update_dependent_search_vectors, models.Project, project.pk)
+
+        update_dependent_search_vectors(models.Project, project.pk)
+        results = search("zanzibarian", {'image': models.Image.objects.all()}, limit=100)
+        self.assertEqual({instance.pk for _, instance in results},
+                         set(project.image_in_project.values_list('pk', flat=True)))
+
+
+class ProjectCountTests(SeededTestCase):
+    """
+    Filters on the media counts of projects, which are annotations.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.url = get_url(views.ProjectViewSet)
+        self.expected = set(models.Project.objects.annotate(count=Count('image_in_project'))
+                            .filter(count__gte=5).values_list('pk', flat=True))
+
+    def test_list(self):
+        response = self.client.get(self.url, {'images_count_min': 5, 'ordering': '-images_count'})
+        self.assertEqual({project['id'] for project in response.json()['results']}, self.expected)
+        counts = [project['images_count'] for project in response.json()['results']]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+    def test_count(self):
+        response = self.client.get(f"{self.url}count/", {'images_count_min': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], len(self.expected))
+
+    def test_export(self):
+        response = self.client.get(f"{self.url}export/ndjson/", {'images_count_min': 5})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual({json.loads(line)['id'] for line in lines}, self.expected)
+
+
+class AdminChangelistTests(SeededTestCase):
+    """
+    Changelist pages cost the same number of queries whatever their size.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = get_user_model().objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_changelists(self):
+        for model in (models.Image, models.Object3DHop, models.ObjectPointCloud, models.Document):
+            model_admin = admin.site._registry[model]
+            url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            for params in ({}, {'q': 'a'}):
+                with self.subTest(model=model.__name__, params=params):
+                    with mock.patch.object(model_admin, 'list_per_page', 5), CaptureQueriesContext(connection) as captured:
+                        self.assertEqual(self.client.get(url, params).status_code, 200)
+                    with mock.patch.object(model_admin, 'list_per_page', 30), self.assertNumQueries(len(captured)):
+                        self.assertEqual(self.client.get(url, params).status_code, 200)
+                    for column in models.INTERNAL_FIELDS:
+                        self.assertFalse(any(f'."{column}"' in query['sql'] for query in captured), column)
+
+
+class SparseFieldsTests(SeededTestCase):
+
+    def test_unselected_counts_can_filter_and_order(self):
+        url = get_url(views.ProjectViewSet)
+        response = self.client.get(url, {'fields': 'id,name', 'ordering': '-images_count'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'name'})
+        response = self.client.get(url, {'omit': 'images_count', 'images_count_min': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('images_count', response.json()['results'][0])
+
+    def test_card_view(self):
+        for viewset in DEPTH_VIEWSETS:
+            with self.subTest(viewset=viewset.__name__):
+                full = self.client.get(get_url(viewset), {'limit': 30})
+                card = self.client.get(get_url(viewset), {'limit': 30, 'view': 'card'})
+                card_fields = viewset.serializer_class.Meta.card_fields
+                self.assertEqual(list(card.json()['results'][0]), [name for name in full.json()['results'][0] if name in card_fields])
+                self.assertLess(len(card.content), len(full.content))
+
+
+class FastPathTests(SeededTestCase):
+    """
+    The fast serialization path and renderer give the same bytes as DRF.
+    """
+
+    def get_content(self, url, params, fast):
+        get_cache().clear()
+        with mock.patch.object(fastpath, 'FAST_SERIALIZATION', fast):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_supported(self):
+        for viewset in DEPTH_VIEWSETS:
+            with self.subTest(viewset=viewset.__name__):
+                self.assertTrue(FastSerializer(viewset.serializer_class, {'request': None}).supported)
+
+    def test_same_output(self):
+        for viewset in DEPTH_VIEWSETS:
+            for params in ({'limit': 50}, {'limit': 50, 'view': 'card'}, {'cursor': '', 'limit': 20},
+                           {'limit': 20, 'offset': 10, 'fields': 'id,title,staff_member'}):
+                with self.subTest(viewset=viewset.__name__, params=params):
+                    url = get_url(viewset)
+                    self.assertEqual(self.get_content(url, params, True), self.get_content(url, params, False))
+
+    def test_renderer(self):
+        data = {
+            'id': 1, 'title': "Rune stone \u2028 \u00e5\u00e4\u00f6 \"quoted\"", 'empty': None, 'flag': True,
+            'floats': [0.1, 1.5, -2.25, 1e-7, 12345678.9, 1e20], 'big': 2 ** 53 + 1,
+            'date': date(2020, 5, 1), 'datetime': datetime(2020, 5, 1, 10, 30, tzinfo=timezone.utc),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'), 'nested': [{'ids': [1, 2, 3]}, []],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        for viewset in DEPTH_VIEWSETS:
+            with self.subTest(viewset=viewset.__name__):
+                response = self.client.get(get_url(viewset), {'limit': 50, 'depth': 1})
+                self.assertEqual(FastJSONRenderer().render(response.data), JSONRenderer().render(response.data))
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    # Throughput of the list pages through each serialization path, with pytest-django and
+    # pytest-benchmark: pytest tests.py --benchmark-group-by=param:viewset
+
+    @pytest.fixture
+    def seeded_archive(db):
+        Seeder(**{**SeededTestCase.seed_sizes, 'images': 500, 'documents': 500, 'objects': 500},
+               log=lambda message: None).run()
+
+    @pytest.mark.parametrize('fast', [False, True], ids=['serializer', 'fast'])
+    @pytest.mark.parametrize('viewset', DEPTH_VIEWSETS, ids=lambda viewset: viewset.__name__)
+    def test_list_throughput(benchmark, seeded_archive, client, viewset, fast):
+        requests = iter(range(10 ** 9))
+
+        def get_page():
+            # A new parameter each time, so that the response cache is missed
+            return client.get(get_url(viewset), {'limit': 500, '_': next(requests)})
+
+        with mock.patch.object(fastpath, 'FAST_SERIALIZATION', fast):
+            response = benchmark(get_page)
+        assert response.status_code == 200
+
+
+class IndexTests(SeededTestCase):
+    """
+    The common filter and ordering patterns of the API can use the composite
+    indexes. Sequential scans are turned off, as a table this small would
+    be read whole anyway.
+    """
+
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_media(self):
+        project = models.Project.objects.order_by('pk').first()
+        location = models.Location.objects.order_by('pk').first()
+        for model, prefix in ((models.Image, 'image'), (models.Object3DHop, 'object3dhop'),
+                              (models.ObjectPointCloud, 'pointcloud'), (models.Document, 'document')):
+            with self.subTest(model=model.__name__):
+                self.assertUsesIndex(model.objects.filter(project=project).order_by('date', 'id'),
+                                     f'{prefix}_project_date_idx')
+                self.assertUsesIndex(model.objects.filter(location=location).order_by('id'), f'{prefix}_location_id_idx')
+                self.assertUsesIndex(model.objects.filter(date__gte=date(2010, 1, 1), date__lte=date(2015, 12, 31))
+                                     .order_by('date', 'id'), f'{prefix}_date_id_idx')
+
+    def test_techniques(self):
+        technique = models.Technique3D.objects.order_by('pk').first()
+        self.assertUsesIndex(models.Object3DHop.objects.filter(technique=technique).order_by('id'),
+                             'object3dhop_technique_id_idx')
+        self.assertUsesIndex(models.ObjectPointCloud.objects.filter(technique=technique).order_by('id'),
+                             'pointcloud_technique_id_idx')
+
+    def test_projects(self):
+        location = models.Location.objects.order_by('pk').first()
+        self.assertUsesIndex(models.Project.objects.filter(location=location).order_by('id'), 'project_location_id_idx')
+
+
+class DateFilterTests(SeededTestCase):
+
+    def get_ids(self, **params):
+        response = self.client.get(get_url(views.IIIFImageViewSet), {'limit': 1000, **params})
+        self.assertEqual(response.status_code, 200)
+        return {image['id'] for image in response.json()['results']}
+
+    def test_exact(self):
+        day = models.Image.objects.order_by('pk').values_list('date', flat=True).first()
+        self.assertEqual(self.get_ids(date=day.isoformat()),
+                         set(models.Image.objects.filter(date=day).values_list('pk', flat=True)))
+
+    def test_range(self):
+        expected = models.Image.objects.filter(date__gte=date(2010, 1, 1), date__lte=date(2015, 12, 31))
+        self.assertEqual(self.get_ids(date_after='2010-01-01', date_before='2015-12-31'),
+                         set(expected.values_list('pk', flat=True)))
+        self.assertEqual(self.get_ids(date_after='2010-01-01'),
+                         set(models.Image.objects.filter(date__gte=date(2010, 1, 1)).values_list('pk', flat=True)))
+
+
+class IIIFManifestTests(SeededTestCase):
+    """
+    Structure of the IIIF Presentation 3 manifests and collections. The image
+    server is replaced by a fixed info.json.
+    """
+
+    base_url = 'https://archive.example.org/'
+    info = {'width': 4000, 'height': 3000,
+            'service': {'id': 'https://iiif.example.org/seed/image-0.tif', 'type': 'ImageService3', 'profile': 'level2'}}
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (mock.patch.object(iiif, 'get_image_info', return_value=self.info),
+                        mock.patch.object(iiif, 'MANIFEST_BASE_URL', self.base_url),
+                        mock.patch.object(views, 'MANIFEST_BASE_URL', self.base_url)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.image = models.Image.objects.exclude(project=None).order_by('pk').first()
+
+    def test_image_manifest(self):
+        manifest = iiif.build_manifest('image', self.image.pk, self.base_url)
+        self.assertEqual(manifest['@context'], iiif.MANIFEST_CONTEXT)
+        self.assertEqual(manifest['type'], 'Manifest')
+        self.assertEqual(manifest['id'], iiif.get_manifest_url(self.base_url, 'image', self.image.pk))
+        self.assertEqual(manifest['label'], {'none': [self.image.title]})
+        self.assertIn({'label': {'en': ['Project']}, 'value': {'none': [self.image.project.name]}}, manifest['metadata'])
+        self.assertEqual(manifest['thumbnail'][0]['type'], 'Image')
+
+        canvas, = manifest['items']
+        self.assertEqual((canvas['type'], canvas['width'], canvas['height']), ('Canvas', 4000, 3000))
+        page, = canvas['items']
+        self.assertEqual(page['type'], 'AnnotationPage')
+        annotation, = page['items']
+        self.assertEqual((annotation['type'], annotation['motivation'], annotation['target']),
+                         ('Annotation', 'painting', canvas['id']))
+        self.assertEqual(annotation['body']['type'], 'Image')
+        self.assertEqual(annotation['body']['service'], [self.info['service']])
+        self.assertEqual(annotation['body']['id'], iiif.get_image_url(self.image))
+
+        ids = [canvas['id'], page['id'], annotation['id']]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_ingest_invalidates_collections(self):
+        targets = [(kind, pk) for kind, pk in (('project', self.image.project_id), ('location', self.image.location_id))
+                   if pk is not None]
+        for kind, pk in targets:
+            iiif.get_manifest(kind, pk, self.base_url)
+        result = {'entry': {'path': '/import/new.tif', 'project': self.image.project_id,
+                            'location': self.image.location_id},
+                  'kind': 'image', 'fields': {'file': 'new.tif', 'iiif_file': 'new.tif', 'uuid': uuid.uuid4()}, 'bytes': 0}
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest.Ingest([], os.devnull).write([result])
+        for kind, pk in targets:
+            self.assertIsNone(get_cache().get(iiif.get_manifest_key(kind, pk)))
+
+    @override_settings(IIIF_URL='https://iiif.example.org/')
+    def test_warm_derivatives(self):
+        images = list(models.Image.objects.exclude(iiif_file='').order_by('pk')[:3])
+        with mock.patch.object(iiif, 'enqueue') as enqueue, mock.patch.object(iiif, 'WARM_DERIVATIVES', True):
+            for image in images:
+                iiif.warm_derivatives(image)
+        # Through the bounded pool of task threads, not a thread per image
+        self.assertEqual(enqueue.call_args_list, [
+            mock.call(iiif.warm_urls, [iiif.get_image_url(image, size) for size in (iiif.THUMBNAIL_SIZE, iiif.PREVIEW_SIZE)])
+            for image in images])
+
+        with mock.patch.object(iiif, 'urlopen', side_effect=URLError("down")), self.assertLogs(iiif.logger.name, 'INFO'):
+            iiif.warm_urls(['https://iiif.example.org/a.tif/full/!200,200/0/default.jpg'])
+
+    def test_unknown_size(self):
+        with mock.patch.object(iiif, 'get_image_info', return_value=None):
+            manifest = iiif.build_manifest('image', self.image.pk, self.base_url)
+            self.assertNotIn('width', manifest['items'][0])
+            iiif.store_manifest('image', self.image.pk, manifest)
+        self.assertIsNone(get_cache().get(iiif.get_manifest_key('image', self.image.pk)))
+
+    def test_collections(self):
+        for kind, instance in (('project', self.image.project), ('location', self.image.location)):
+            with self.subTest(kind=kind):
+                collection = iiif.build_manifest(kind, instance.pk, self.base_url)
+                self.assertEqual(collection['type'], 'Collection')
+                self.assertEqual(collection['id'], iiif.get_manifest_url(self.base_url, kind, instance.pk))
+                self.assertEqual(collection['label'], {'none': [instance.name]})
+                images = models.Image.objects.filter(**{kind: instance}).order_by('date', 'id')
+                self.assertEqual([item['id'] for item in collection['items']],
+                                 [iiif.get_manifest_url(self.base_url, 'image', pk) for pk in images.values_list('pk', flat=True)])
+                self.assertTrue(all(item['type'] == 'Manifest' for item in collection['items']))
+
+    def test_view(self):
+        path = urlsplit(iiif.get_manifest_url(self.base_url, 'image', self.image.pk)).path
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], iiif.MANIFEST_CONTENT_TYPE)
+        self.assertEqual(json.loads(response.content)['type'], 'Manifest')
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        missing = urlsplit(iiif.get_manifest_url(self.base_url, 'project', 0)).path
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    @override_settings(ALLOWED_HOSTS=['one.example.org', 'two.example.org'])
+    def test_request_host(self):
+        path = urlsplit(iiif.get_manifest_url(self.base_url, 'image', self.image.pk)).path
+        with mock.patch.object(iiif, 'MANIFEST_BASE_URL', None), mock.patch.object(views, 'MANIFEST_BASE_URL', None):
+            for host in ('one.example.org', 'two.example.org'):
+                with self.subTest(host=host):
+                    manifest = json.loads(self.client.get(path, HTTP_HOST=host).content)
+                    self.assertEqual(manifest['id'], iiif.get_manifest_url(f'http://{host}/', 'image', self.image.pk))
+        self.assertIsNone(get_cache().get(iiif.get_manifest_key('image', self.image.pk)))
+
+
+def write_ply(path, points, faces=(), encoding='ascii'):
+    # A PLY file with float vertices and triangle faces
+    header = (f"ply\nformat {encoding} 1.0\ncomment generated\nelement vertex {len(points)}\n"
+              "property float x\nproperty float y\nproperty float z\nproperty uchar red\n"
+              f"element face {len(faces)}\nproperty list uchar int vertex_indices\nend_header\n")
+    with open(path, 'wb') as ply:
+        ply.write(header.encode('ascii'))
+        if encoding == 'ascii':
+            ply.writelines(f"{x} {y} {z} 255\n".encode('ascii') for x, y, z in points)
+            ply.writelines(f"3 {' '.join(map(str, face))}\n".encode('ascii') for face in faces)
+        else:
+            order = assets.PLY_ENDIANNESS[encoding]
+            ply.writelines(struct.pack(f'{order}fffB', x, y, z, 255) for x, y, z in points)
+            ply.writelines(struct.pack(f'{order}B3i', 3, *face) for face in faces)
+
+
+class AssetProbeTests(SimpleTestCase):
+    """
+    Metadata of generated PLY, Nexus and Potree assets, served from a
+    temporary directory.
+    """
+
+    points = [(0.5, -2.0, 3.0), (-1.5, 4.0, 0.0), (2.5, 1.0, -6.0), (0.0, 0.0, 1.0)]
+    faces = [(0, 1, 2), (1, 2, 3)]
+    bounding_box = {'min': [-1.5, -2.0, -6.0], 'max': [2.5, 4.0, 3.0]}
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        patcher = mock.patch.dict(assets.ASSET_ROOTS, {'/assets/': self.root}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ply(self):
+        for encoding in ('ascii', 'binary_little_endian', 'binary_big_endian'):
+            with self.subTest(encoding=encoding):
+                write_ply(os.path.join(self.root, f'{encoding}.ply'), self.points, self.faces, encoding)
+                metadata = assets.probe_asset(f'/assets/{encoding}.ply', bounds=True)
+                self.assertEqual((metadata['format'], metadata['points'], metadata['triangles']), ('ply', 4, 2))
+                self.assertEqual(metadata['bounding_box'], self.bounding_box)
+                self.assertEqual(metadata['bytes'], os.path.getsize(os.path.join(self.root, f'{encoding}.ply')))
+
+    def test_ply_header_only(self):
+        write_ply(os.path.join(self.root, 'model.ply'), self.points, self.faces, 'binary_little_endian')
+        metadata = assets.probe_asset('/assets/model.ply')
+        self.assertEqual((metadata['points'], metadata['triangles']), (4, 2))
+        self.assertNotIn('bounding_box', metadata)
+
+        # Kept by later header-only probes, and completed by probes with bounds
+        self.assertTrue(assets.is_current(metadata, '/assets/model.ply'))
+        self.assertFalse(assets.is_current(metadata, '/assets/model.ply', bounds=True))
+        instance = models.Object3DHop(url_optimized='/assets/model.ply', asset_metadata={'optimized': metadata})
+        self.assertEqual(assets.probe_instance_assets(instance), {'optimized': metadata})
+        self.assertEqual(assets.probe_instance_assets(instance, bounds=True)['optimized']['bounding_box'],
+                         self.bounding_box)
+
+    def test_malformed_ply(self):
+        header = b"ply\nformat ascii 1.0\nelement vertex 2\nproperty float x\nproperty float y\nproperty float z\nend_header\n"
+        for data, bounds in ((b"ply\nformat\nend_header\n", False),
+                             (b"ply\nformat ascii 1.0\nelement vertex\nend_header\n", False),
+                             (b"ply\nformat ascii 1.0\nelement vertex many\nend_header\n", False),
+                             (b"ply\nformat ascii 1.0\nelement vertex 1\nproperty float\nend_header\n", False),
+                             (b"ply\nformat ascii 1.0\nelement face 1\nproperty list uchar\nend_header\n", False),
+                             (b"ply\nformat ascii 1.0\nend_header", False),
+                             (header + b"1 2 3\n4 5\n", True),
+                             (header + b"1 2 3\n", True)):
+            with self.subTest(data=data):
+                with self.assertRaises(assets.AssetError):
+                    assets.probe_ply(data, bounds)
+
+        with open(os.path.join(self.root, 'truncated.ply'), 'wb') as truncated:
+            truncated.write(header.replace(b'ascii', b'binary_little_endian') + struct.pack('<3f', 1, 2, 3))
+        self.assertEqual(assets.probe_asset('/assets/truncated.ply', bounds=True)['error'], "Truncated PLY vertex list")
+
+    def test_nexus(self):
+        signature = bytes(36)
+        with open(os.path.join(self.root, 'model.nxz'), 'wb') as nexus:
+            nexus.write(assets.NEXUS_HEADER.pack(assets.NEXUS_MAGIC, 3, 1000, 500, signature, 1.0, 2.0, 3.0, 0.5))
+        metadata = assets.probe_asset('/assets/model.nxz')
+        self.assertEqual((metadata['format'], metadata['version'], metadata['points'], metadata['triangles']),
+                         ('nexus', 3, 1000, 500))
+        self.assertEqual(metadata['bounding_box'], {'min': [0.5, 1.5, 2.5], 'max': [1.5, 2.5, 3.5]})
+
+    def test_potree(self):
+        os.mkdir(os.path.join(self.root, 'cloud'))
+        with open(os.path.join(self.root, 'cloud', 'metadata.json'), 'w', encoding='utf-8') as metadata_file:
+            json.dump({'version': '2.0', 'points': 12345, 'boundingBox': {'min': [0, 0, 0], 'max': [1, 2, 3]}},
+                      metadata_file)
+        metadata = assets.probe_asset('/assets/cloud/')
+        self.assertEqual((metadata['format'], metadata['version'], metadata['points']), ('potree', '2.0', 12345))
+        self.assertEqual(metadata['bounding_box'], {'min': [0, 0, 0], 'max': [1, 2, 3]})
+
+    def test_errors(self):
+        with open(os.path.join(self.root, 'broken.ply'), 'wb') as broken:
+            broken.write(b'not a model')
+        self.assertEqual(assets.probe_asset('/assets/broken.ply')['error'], "Not a PLY file")
+        self.assertIn('error', assets.probe_asset('/assets/missing.ply'))
+        self.assertEqual(assets.probe_asset('https://elsewhere.example.org/model.ply')['error'], "Not on local storage")
+        self.assertIsNone(assets.get_asset_path('/assets/../outside.ply'))
+
+
+class RangeTests(SimpleTestCase):
+    """
+    Range requests of downloads, on a generated file.
+    """
+
+    data = bytes(range(256)) * 4
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'report.csv')
+        with open(self.path, 'wb') as file:
+            file.write(self.data)
+
+    def get(self, **headers):
+        request = RequestFactory().get('/download/', **headers)
+        response = documents.ranged_file_response(request, File(open(self.path, 'rb')), '"abc"')
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_parse_range(self):
+        for header, expected in (('bytes=0-99', (0, 99)), ('bytes=500-', (500, 1023)), ('bytes=900-5000', (900, 1023)),
+                                 ('bytes=-100', (924, 1023)), ('bytes=-5000', (0, 1023)), (' bytes=7-7 ', (7, 7)),
+                                 ('bytes=1024-', False), ('bytes=200-100', False), ('bytes=-0', False),
+                                 (None, None), ('', None), ('bytes=-', None), ('bytes=0-1,5-6', None),
+                                 ('items=0-1', None), ('bytes=a-b', None)):
+            with self.subTest(header=header):
+                self.assertEqual(documents.parse_range(header, len(self.data)), expected)
+        self.assertIs(documents.parse_range('bytes=0-', 0), False)
+
+    def test_whole_file(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.data)
+        self.assertEqual((response['Accept-Ranges'], response['ETag']), ('bytes', '"abc"'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="report.csv"')
+
+    def test_partial(self):
+        for header, start, end in (('bytes=100-199', 100, 199), ('bytes=1000-', 1000, 1023), ('bytes=-10', 1014, 1023)):
+            with self.subTest(header=header):
+                response, content = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], f"bytes {start}-{end}/1024")
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+                self.assertEqual(content, self.data[start:end + 1])
+
+    def test_unsatisfiable(self):
+        response, content = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], "bytes */1024")
+        self.assertEqual(content, b'')
+
+    def test_if_range(self):
+        response, content = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"abc"')
+        self.assertEqual((response.status_code, content), (206, self.data[:10]))
+        # The file changed since the first part was downloaded: send it all again
+        response, content = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual((response.status_code, content), (200, self.data))
+
+
+class ChunkedUploadTests(TestCase):
+    """
+    Chunked uploads, resumed and out of order, the documents they create and
+    their downloads. Files are written to a temporary directory.
+    """
+
+    data = b''.join(f"{index},row {index}\n".encode('ascii') for index in range(300))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        for patcher in (mock.patch.object(views, 'UPLOAD_DIR', os.path.join(self.root, 'uploads')),
+                        mock.patch.object(models, 'UPLOAD_DIR', os.path.join(self.root, 'uploads')),
+                        mock.patch.object(models.Document._meta.get_field('upload'), 'storage',
+                                          FileSystemStorage(location=os.path.join(self.root, 'documents')))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(self.user)
+        self.url = get_url(views.ChunkedUploadViewSet)
+        self.checksum = hashlib.sha256(self.data).hexdigest()
+
+    def start(self, checksum=None):
+        response = self.client.post(self.url, {'filename': 'report.csv', 'size': len(self.data),
+                                               'checksum': checksum or self.checksum})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['offset'], 0)
+        return response.json()['id']
+
+    def send(self, upload, start, end):
+        return self.client.patch(f"{self.url}{upload}/", self.data[start:end + 1], content_type='application/octet-stream',
+                                 HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(self.data)}")
+
+    def test_resumed_upload(self):
+        upload = self.start()
+        middle = len(self.data) // 2
+        self.assertEqual(self.send(upload, 0, 99).json()['offset'], 100)
+
+        # A chunk after a lost one, or a chunk sent twice: the client resumes from the offset
+        for start, end in ((middle, len(self.data) - 1), (0, 99)):
+            with self.subTest(start=start):
+                response = self.send(upload, start, end)
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['offset'], 100)
+        self.assertEqual(self.client.get(f"{self.url}{upload}/").json()['offset'], 100)
+        self.assertEqual(self.client.post(f"{self.url}{upload}/complete/", {'title': "Report"}).status_code, 409)
+
+        self.assertEqual(self.send(upload, 100, middle - 1).json()['offset'], middle)
+        self.assertEqual(self.send(upload, middle, len(self.data) - 1).json()['offset'], len(self.data))
+        response = self.client.post(f"{self.url}{upload}/complete/", {'title': "Report"})
+        self.assertEqual(response.status_code, 201)
+
+        document = models.Document.objects.get(pk=response.json()['document'])
+        self.assertEqual((document.title, document.checksum), ("Report", self.checksum))
+        with document.upload.open('rb') as file:
+            self.assertEqual(file.read(), self.data)
+        # Completing again returns the same document
+        self.assertEqual(self.client.post(f"{self.url}{upload}/complete/", {'title': "Report"}).json()['document'],
+                         document.pk)
+
+        download = f"{get_url(views.DocumentViewSet)}{document.pk}/download/"
+        response = self.client.get(download, HTTP_RANGE='bytes=-20')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[-20:])
+        self.assertEqual(response['ETag'], f'"{self.checksum}"')
+        response = self.client.get(download, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(response.status_code, 206)
+
+    def test_invalid_chunks(self):
+        upload = self.start()
+        self.assertEqual(self.send(upload, 0, len(self.data)).status_code, 400)
+        response = self.client.patch(f"{self.url}{upload}/", self.data, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f"{self.url}{upload}/", self.data[:10], content_type='application/octet-stream',
+                                     HTTP_CONTENT_RANGE=f"bytes 0-99/{len(self.data)}")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f"{self.url}{upload}/").json()['offset'], 0)
+        self.assertEqual(self.client.get(f"{self.url}{uuid.uuid4()}/").status_code, 404)
+
+    def test_checksum_mismatch(self):
+        upload = self.start(checksum='0' * 64)
+        self.send(upload, 0, len(self.data) - 1)
+        response = self.client.post(f"{self.url}{upload}/complete/", {'title': "Report"})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertFalse(models.Document.objects.exists())
+
+    def test_staff_only(self):
+        self.client.logout()
+        response = self.client.post(self.url, {'filename': 'report.csv', 'size': len(self.data)})
+        self.assertIn(response.status_code, (401, 403))
+
+
+class PerformanceMetricsTests(SimpleTestCase):
+    """
+    Metrics of PerformanceMiddleware, its labels and its overhead, without a
+    database.
+    """
+
+    labels = {'viewset': 'DocumentViewSet', 'action': 'list', 'depth': '1', 'filters': 'date_after'}
+
+    def test_render(self):
+        metrics = RequestMetrics(buckets=(0.1, 1.0))
+        metrics.observe(self.labels, 0.05, 3, {'db': 0.01, 'serialize': 0.03, 'render': 0.01})
+        metrics.observe(self.labels, 0.5, 4, {'db': 0.2, 'serialize': 0.2, 'render': 0.1})
+        metrics.observe({**self.labels, 'viewset': 'Say "hi"\n'}, 5.0, 0, {})
+        lines = metrics.render().splitlines()
+
+        labels = 'viewset="DocumentViewSet",action="list",depth="1",filters="date_after"'
+        for line in (f'mediaarchive_request_duration_seconds_bucket{{{labels},le="0.1"}} 1',
+                     f'mediaarchive_request_duration_seconds_bucket{{{labels},le="1.0"}} 2',
+                     f'mediaarchive_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2',
+                     f'mediaarchive_request_duration_seconds_sum{{{labels}}} 0.55',
+                     f'mediaarchive_request_duration_seconds_count{{{labels}}} 2',
+                     f'mediaarchive_request_queries_total{{{labels}}} 7',
+                     f'mediaarchive_request_db_seconds_total{{{labels}}} 0.21000000000000002',
+                     '# TYPE mediaarchive_request_render_seconds_total counter'):
+            with self.subTest(line=line):
+                self.assertIn(line, lines)
+        self.assertIn('mediaarchive_request_duration_seconds_count{viewset="Say \\"hi\\"\\n",action="list",depth="1",'
+                      'filters="date_after"} 1', lines)
+
+    def test_query_timer(self):
+        timer = QueryTimer()
+        execute = mock.Mock(return_value='rows')
+        for index in range(middleware.SLOW_QUERY_SAMPLES + 3):
+            self.assertEqual(timer(execute, f"SELECT {index}", (), False, {}), 'rows')
+        failing = mock.Mock(side_effect=RuntimeError)
+        with self.assertRaises(RuntimeError):
+            timer(failing, "SELECT 1/0", (), False, {})
+
+        self.assertEqual(timer.count, middleware.SLOW_QUERY_SAMPLES + 4)
+        self.assertGreater(timer.duration, 0)
+        self.assertEqual(len(timer.slowest), middleware.SLOW_QUERY_SAMPLES)
+        self.assertEqual(execute.call_count, middleware.SLOW_QUERY_SAMPLES + 3)
+
+    def test_labels(self):
+        factory = RequestFactory()
+        for viewset, params, depth, filters in (
+                (views.DocumentViewSet, {'depth': 2, 'date_after': '2020-01-01', 'limit': 5}, '2', 'date_after'),
+                (views.ProjectViewSet, {'images_count_min': 10, 'ordering': '-images_count'}, '0', 'images_count_min'),
+                (views.DocumentViewSet, {'date': '2020-05-01', 'utm_source': 'mail', 'x1': 1, 'x2': 2}, '0', 'date,other'),
+                (views.DocumentViewSet, {'depth': 'deep', 'nonsense': 1}, '0', 'other'),
+                (views.LocationViewSet, {'in_bbox': '10,41,20,60', 'zoom': 6}, '0', 'in_bbox'),
+                (views.ProjectViewSet, {'depth': 123456}, str(MAX_DEPTH), ''),
+                (views.ProjectViewSet, {'depth': -3}, '0', '')):
+            with self.subTest(viewset=viewset.__name__, params=params):
+                labels = middleware.get_labels(factory.get('/', params), viewset.as_view({'get': 'list'}))
+                self.assertEqual(labels, {'viewset': viewset.__name__, 'action': 'list', 'depth': depth,
+                                          'filters': filters})
+
+    def test_method_labels(self):
+        view = views.DocumentViewSet.as_view({'get': 'list'})
+        for method, action in (('GET', 'list'), ('POST', 'post'), ('OPTIONS', 'options'), ('BREW', 'other'),
+                               ('X' * 200, 'other')):
+            with self.subTest(method=method):
+                request = RequestFactory().generic(method, '/')
+                self.assertEqual(middleware.get_labels(request, view)['action'], action)
+
+    def test_overhead(self):
+        # A load loop through a view that does nothing, with and without the middleware
+        requests = 2000
+        view = views.DocumentViewSet.as_view({'get': 'list'})
+        metrics = RequestMetrics()
+
+        def get_response(request):
+            # The calls the request handler makes around the view
+            performance.process_view(request, view, (), {})
+            performance.process_template_response(request, None)
+            return HttpResponse()
+
+        performance = PerformanceMiddleware(get_response)
+        factory = RequestFactory()
+        path = f"{performance.prefix}document/"
+        batch = [factory.get(path, {'date_after': '2020-01-01', 'page': index}) for index in range(requests)]
+
+        with mock.patch.object(middleware, 'request_metrics', metrics):
+            started = time.perf_counter()
+            for request in batch:
+                get_response(request)
+            baseline = time.perf_counter() - started
+            started = time.perf_counter()
+            for request in batch:
+                self.assertIn('Server-Timing', performance(request))
+            timed = time.perf_counter() - started
+
+        series, = metrics.series.values()
+        self.assertEqual(series['count'], requests)
+        # Well under a millisecond per request, next to API requests of tens of milliseconds
+        self.assertLess((timed - baseline) / requests, 0.0005)
+
+
+class FacetTests(SeededTestCase):
+    """
+    Facet counts of filtered media, including a filter on the relation counted.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.first, cls.second = (models.TypeOfImage.objects.create(text=text) for text in ("Facet first", "Facet second"))
+        cls.images = list(models.Image.objects.order_by('pk')[:6])
+        for index, image in enumerate(cls.images):
+            image.type_of_image.add(cls.first, *([cls.second] if index % 2 else []))
+
+    def get_counts(self, facet, **params):
+        response = self.client.get(f"{get_url(views.IIIFImageViewSet)}facets/", params)
+        self.assertEqual(response.status_code, 200)
+        return {value['id']: value['count'] for value in response.json()[facet]}
+
+    def test_filter_on_the_counted_relation(self):
+        counts = self.get_counts('type_of_image', type_of_image=self.first.pk)
+        filtered = models.Image.objects.filter(type_of_image=self.first)
+        expected = (models.Image.type_of_image.through.objects.filter(image__in=filtered)
+                    .values('typeofimage').annotate(count=Count('image', distinct=True)))
+        self.assertEqual({row['typeofimage']: row['count'] for row in expected if row['typeofimage']},
+                         {pk: count for pk, count in counts.items() if pk is not None})
+        self.assertEqual((counts[self.first.pk], counts[self.second.pk]), (6, 3))
+
+    def test_filter_on_another_relation(self):
+        counts = self.get_counts('project', type_of_image=self.second.pk)
+        self.assertEqual(sum(counts.values()), 3)
+        self.assertEqual(counts, dict(models.Image.objects.filter(type_of_image=self.second).order_by()
+                                      .values_list('project').annotate(count=Count('pk'))))
+
+
+class NameListTests(SeededTestCase):
+    """
+    Name lists annotated in the list query match the names read per row, also
+    for names composed of several fields.
+    """
+
+    seed_sizes = {**SeededTestCase.seed_sizes, 'types_per_document': 5}
+
+    def test_types_per_document(self):
+        self.assertEqual(set(models.Document.objects.annotate(count=Count('type')).values_list('count', flat=True)),
+                         {5})
+        self.assertEqual(get_type_names_documents(size=100),
+                         list(models.Document.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_annotated_names(self):
+        for relation, name_field in (('type', 'text'), ('staff_member', STAFF_MEMBER_NAME)):
+            with self.subTest(relation=relation):
+                field = NameListField(relation, name_field)
+                related = models.Document._meta.get_field(relation).related_model
+                documents = models.Document.objects.order_by('pk').prefetch_related(
+                    Prefetch(relation, related.objects.order_by(*get_relation_ordering(related))))
+                annotated = documents.annotate(names=field.get_annotation(models.Document))
+                self.assertEqual([document.names for document in annotated],
+                                 [field.summarize(getattr(document, relation)) for document in documents])
+                self.assertEqual([document.names for document in annotated],
+                                 [[str(obj) for obj in getattr(document, relation).all()] for document in documents])
+
+
+class QuantityTests(SimpleTestCase):
+
+    def test_parse_quantity(self):
+        for text, expected in (('250 millions', 250_000_000), ('1.3 billions', 1_300_000_000), ('12k', 12_000),
+                               ('1,300,000', 1_300_000), ('1,3 millions', 1_300_000), ('~ 5 000', 5_000),
+                               ('12 M.', 12_000_000), ("1'000", 1_000), ('2.5 mio', 2_500_000), (42, 42),
+                               (None, None), ('', None), ('many', None), ('12 parsecs', None), ('1.2.3', None)):
+            with self.subTest(text=text):
+                self.assertEqual(parse_quantity(text), expected)
+
+
+class LegacyDocumentTests(TestCase):
+    """
+    Documents stored before checksums, whose files may be missing.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = FileSystemStorage(location=directory.name)
+        patcher = mock.patch.object(models.Document._meta.get_field('upload'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_missing_file(self):
+        document = models.Document.objects.create(title="Lost", upload='lost.csv', page_count=0)
+        document.title = "Lost report"
+        document.save()
+        with self.assertLogs(documents.logger.name, 'WARNING'):
+            documents.update_document_content(document.pk)
+        document.refresh_from_db()
+        self.assertEqual((document.title, document.checksum), ("Lost report", ''))
+
+    def test_backfill(self):
+        data = b"year,count\n2020,3\n"
+        self.storage.save('old.csv', ContentFile(data))
+        document = models.Document.objects.create(title="Old", upload='old.csv', page_count=0, content="Kept")
+        documents.update_document_content(document.pk)
+        document.refresh_from_db()
+        self.assertEqual((document.checksum, document.page_count, document.content),
+                         (hashlib.sha256(data).hexdigest(), 0, "Kept"))
+
+
+def make_pdf(pages, padding=0):
+    # A PDF skeleton with a page tree and pages objects, padded between objects
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"<< /Type /Pages /Count %d >>" % pages]
+    objects += [b"<< /Type\n/Page /Parent 2 0 R >>"] * pages
+    body = b''.join(b"%d 0 obj %s endobj\n%s" % (index, content, b' ' * padding)
+                    for index, content in enumerate(objects, 1))
+    return b"%PDF-1.4\n" + body + b"%%EOF\n"
+
+
+def make_docx(paragraphs, pages=None):
+    namespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>')
+        if pages is not None:
+            archive.writestr('docProps/app.xml', f'<Properties><Pages>{pages}</Pages></Properties>')
+    buffer.seek(0)
+    return buffer
+
+
+class DocumentContentTests(SimpleTestCase):
+    """
+    Page counts and texts of generated PDF and DOCX files.
+    """
+
+    def test_pdf_pages(self):
+        with mock.patch.object(documents, 'PdfReader', None):
+            for pages, chunk_size, padding in ((3, 1024 * 1024, 0), (5, 7, 0), (12, 100, 37), (0, 16, 3)):
+                with self.subTest(pages=pages, chunk_size=chunk_size, padding=padding):
+                    with mock.patch.object(documents, 'CHUNK_SIZE', chunk_size):
+                        self.assertEqual(documents.extract_content(io.BytesIO(make_pdf(pages, padding)), 'report.pdf'),
+                                         (pages, ''))
+
+    def test_docx(self):
+        self.assertEqual(documents.extract_content(make_docx(["First paragraph", "Second"], pages=4), 'report.DOCX'),
+                         (4, "First paragraph\nSecond"))
+        self.assertEqual(documents.extract_content(make_docx(["Only"]), 'report.docx'), (None, "Only"))
+        with mock.patch.object(documents, 'MAX_CONTENT_LENGTH', 8):
+            self.assertEqual(documents.extract_content(make_docx(["First paragraph"]), 'report.docx'), (None, "First pa"))
+
+    def test_unreadable(self):
+        with self.assertLogs(documents.logger.name, 'INFO'):
+            self.assertEqual(documents.extract_content(io.BytesIO(b"not a zip"), 'broken.docx'), (None, ''))
+        self.assertEqual(documents.extract_content(io.BytesIO(b"a,b\n"), 'table.csv'), (None, ''))
+
+
+class IngestTests(TransactionTestCase):
+    """
+    Bulk ingest of a temporary directory of generated documents, described by
+    CSV and JSON manifests. Files are processed in threads instead of
+    processes, and background tasks run at commit.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        os.mkdir(os.path.join(self.root, 'files'))
+        for patcher in (mock.patch.object(models.Document._meta.get_field('upload'), 'storage',
+                                          FileSystemStorage(location=os.path.join(self.root, 'storage'))),
+                        mock.patch.object(ingest, 'ProcessPoolExecutor', ThreadPoolExecutor),
+                        mock.patch.object(tasks, 'TASK_WORKERS', 0)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_file(self, name, data):
+        with open(os.path.join(self.root, 'files', name), 'wb') as file:
+            file.write(data.getvalue() if isinstance(data, io.BytesIO) else data)
+
+    def write_manifest(self, name, rows):
+        path = os.path.join(self.root, name)
+        with open(path, 'w', encoding='utf-8', newline='') as manifest:
+            if name.endswith('.json'):
+                json.dump(rows, manifest)
+            else:
+                writer = csv.DictWriter(manifest, ['path', 'kind', 'title', 'date', 'project', 'location',
+                                                   'staff_members', 'types'])
+                writer.writeheader()
+                writer.writerows(rows)
+        return path
+
+    def run_ingest(self, manifest):
+        run = ingest.Ingest(ingest.read_manifest(manifest), os.path.join(self.root, '.ingest-state'), workers=2,
+                            batch_size=2, log=lambda message: None)
+        return run.run(), run.errors
+
+    def test_ingest_and_resume(self):
+        self.write_file('report-1.csv', b"year,count\n2020,3\n")
+        self.write_file('report-2.csv', b"year,count\n2021,4\n")
+        self.write_file('notes.docx', make_docx(["Field notes"], pages=2))
+        self.write_file('late.csv', b"year\n")
+        self.write_file('program.exe', b"MZ")
+        manifest = self.write_manifest('manifest.csv', [
+            {'path': 'files/report-1.csv', 'title': "Report one", 'date': '2020-05-01', 'project': "Excavation",
+             'location': "Uppsala", 'staff_members': "Ada Lovelace; Alan Turing", 'types': "report;dataset"},
+            {'path': 'files/report-2.csv', 'kind': 'document', 'project': "Excavation", 'staff_members': "Ada Lovelace",
+             'types': "report"},
+            {'path': 'files/notes.docx'},
+            {'path': 'files/late.csv', 'date': '2024-02-30'},
+            {'path': 'files/program.exe', 'kind': 'document'},
+            {'path': 'files/missing.csv'},
+        ])
+
+        ingested, errors = self.run_ingest(manifest)
+        self.assertEqual(ingested, 3)
+        self.assertEqual(sorted(os.path.basename(error['entry']['path']) for error in errors),
+                         ['late.csv', 'missing.csv', 'program.exe'])
+        self.assertIn("Invalid date 2024-02-30", next(error['error'] for error in errors
+                                                      if error['entry']['path'].endswith('late.csv')))
+
+        documents = {document.title: document for document in models.Document.objects.all()}
+        self.assertEqual(set(documents), {"Report one", "report-2", "notes"})
+        first = documents["Report one"]
+        self.assertEqual((first.date, first.project.name, first.location.name), (date(2020, 5, 1), "Excavation", "Uppsala"))
+        self.assertEqual(first.project, documents["report-2"].project)
+        self.assertEqual({(member.firstname, member.lastname) for member in first.staff_member.all()},
+                         {("Ada", "Lovelace"), ("Alan", "Turing")})
+        self.assertEqual(set(first.type.values_list('text', flat=True)), {"report", "dataset"})
+        self.assertEqual([str(member) for member in documents["report-2"].staff_member.all()], ["Ada Lovelace"])
+        self.assertEqual(models.StaffMember.objects.count(), 2)
+        self.assertEqual(first.checksum, hashlib.sha256(b"year,count\n2020,3\n").hexdigest())
+        self.assertEqual((documents["notes"].page_count, documents["notes"].content), (2, "Field notes"))
+        self.assertEqual(models.Document.objects.filter(search_vector__isnull=False).count(), 3)
+
+        with open(os.path.join(self.root, '.ingest-state'), encoding='utf-8') as state:
+            self.assertEqual(sorted(os.path.basename(line.strip()) for line in state),
+                             ['notes.docx', 'report-1.csv', 'report-2.csv'])
+
+        # Resumed from a JSON manifest: the ingested files are skipped, the failed ones tried again
+        self.write_file('report-3.csv', b"year,count\n2022,5\n")
+        manifest = self.write_manifest('manifest.json', [
+            {'path': 'files/report-1.csv', 'title': "Report one"},
+            {'path': 'files/report-3.csv', 'title': "Report three", 'types': ["report"]},
+            {'path': 'files/late.csv', 'date': '2024-02-30'},
+        ])
+        ingested, errors = self.run_ingest(manifest)
+        self.assertEqual((ingested, len(errors)), (1, 1))
+        self.assertEqual(models.Document.objects.count(), 4)
+        self.assertEqual(list(models.Document.objects.get(title="Report three").type.values_list('text', flat=True)),
+                         ["report"])
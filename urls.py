@@ -1,4 +1,4 @@
-from django.urls import path, include
+from django.urls import path, include, re_path
 from rest_framework import routers
 from . import views
 import diana.utils as utils
@@ -14,16 +14,24 @@ router.register(rf'{endpoint}/image', views.IIIFImageViewSet, basename='image')
 router.register(rf'{endpoint}/document', views.DocumentViewSet, basename='document')
 router.register(rf'{endpoint}/object3dhop', views.Object3DHopViewSet, basename='object 3D hop')
 router.register(rf'{endpoint}/objectpointcloud', views.ObjectPointcloudViewSet, basename='object pointcloud')
+router.register(rf'{endpoint}/search', views.SearchViewSet, basename='search')
+router.register(rf'{endpoint}/upload', views.ChunkedUploadViewSet, basename='chunked upload')
 
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Tile URL templates of map clients have no trailing slash
+    re_path(rf'^{endpoint}/geojson/location/tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt$',
+            views.LocationViewSet.as_view({'get': 'tiles'}, detail=False, basename='place on geojson'), name='location-tiles'),
+    re_path(rf'^{endpoint}/iiif/(?P<kind>image)/(?P<pk>\d+)/manifest\.json$', views.IIIFManifestView.as_view(), name='iiif-manifest'),
+    re_path(rf'^{endpoint}/metrics/?$', views.MetricsView.as_view(), name='metrics'),
+    re_path(rf'^{endpoint}/iiif/(?P<kind>project|location)/(?P<pk>\d+)/collection\.json$', views.IIIFManifestView.as_view(), name='iiif-collection'),
 
     # Automatically generated views
     *utils.get_model_urls('mediaarchive', endpoint, 
-        exclude=['project', 'image', 'location', 'document', 'object3dhop', 'objectpointcloud']),
+        exclude=['project', 'image', 'location', 'document', 'object3dhop', 'objectpointcloud', 'chunkedupload']),
 
     *utils.get_model_urls('mediaarchive', f'{endpoint}', 
-        exclude=['project', 'image', 'location', 'document', 'object3dhop', 'objectpointcloud']),
+        exclude=['project', 'image', 'location', 'document', 'object3dhop', 'objectpointcloud', 'chunkedupload']),
     *documentation
 ]
\ No newline at end of file
@@ -0,0 +1,34 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+# Multipliers of the written quantities, e.g. "250 millions", "1.3 billions", "12k"
+QUANTITY_UNITS = {
+    '': 1,
+    'k': 10 ** 3, 'thousand': 10 ** 3, 'thousands': 10 ** 3,
+    'm': 10 ** 6, 'mil': 10 ** 6, 'mio': 10 ** 6, 'million': 10 ** 6, 'millions': 10 ** 6,
+    'b': 10 ** 9, 'bn': 10 ** 9, 'billion': 10 ** 9, 'billions': 10 ** 9,
+}
+QUANTITY = re.compile(r"^\s*~?\s*([0-9][0-9 ,.']*)\s*([a-z]*)\.?\s*$")
+
+
+def parse_quantity(text):
+    """
+    Returns the integer written in text, as "250 millions", "1.3 billions",
+    "12k" or "1,300,000", or None when it cannot be read.
+    """
+    if text is None:
+        return None
+    match = QUANTITY.match(str(text).lower())
+    if match is None or match.group(2) not in QUANTITY_UNITS:
+        return None
+
+    number = match.group(1).replace(' ', '').replace("'", '')
+    # Commas are thousands separators ("1,300,000") unless they are the only
+    # separator and not followed by three digits ("1,3 millions")
+    if ',' in number and '.' not in number and not re.fullmatch(r'[0-9]{1,3}(,[0-9]{3})+', number):
+        number = number.replace(',', '.')
+    number = number.replace(',', '')
+    try:
+        return int(Decimal(number) * QUANTITY_UNITS[match.group(2)])
+    except InvalidOperation:
+        return None
@@ -1,15 +1,18 @@
 import os
 from django.core.exceptions import ValidationError
 
+DOCUMENT_EXTENSIONS = ['.pdf', '.doc', '.docx', '.xlsx', '.xls', '.csv']
+IMAGE_EXTENSIONS = ['.pdf', '.png', '.jpg', '.jpeg', '.svg', '.eps', '.tif', '.tiff']
+
 def validate_file_extension(value):
     ext = os.path.splitext(value.name)[1]  # [0] returns path+filename
-    valid_extensions = ['.pdf', '.doc', '.docx', '.xlsx', '.xls', '.csv']
+    valid_extensions = DOCUMENT_EXTENSIONS
     if not ext.lower() in valid_extensions:
         raise ValidationError('Unsupported file extension.')
     
 
 def validate_image_extension(value):
     ext = os.path.splitext(value.name)[1]  # [0] returns path+filename
-    valid_extensions = ['.pdf', '.png', '.jpg', '.jpeg', '.svg', '.eps', '.tif', '.tiff']
+    valid_extensions = IMAGE_EXTENSIONS
     if not ext.lower() in valid_extensions:
         raise ValidationError('Unsupported file extension.')
\ No newline at end of file
@@ -4,26 +4,258 @@ from django.db.models import Q
 from diana.abstract.views import DynamicDepthViewSet, GeoViewSet
 from diana.abstract.models import get_fields, DEFAULT_FIELDS
 from django.db.models import Q
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from django.db import connection, transaction
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.views import View
+from django.db.models import Count, Max, Min
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.filters import OrderingFilter
+from rest_framework.renderers import JSONRenderer
+from rest_framework_gis.filters import InBBoxFilter
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from .cache import CachedResponseMixin
+from .documents import CHUNK_SIZE, UPLOAD_DIR, get_checksum, get_document_etag, ranged_file_response
+from .export import EXPORT_SERIALIZERS, StreamingExportMixin
+from .fastpath import FastListMixin
+from .filters import DocumentFilter, ImageFilter, Object3DHopFilter, ObjectPointCloudFilter, ProjectFilter
+from .iiif import MANIFEST_BASE_URL, MANIFEST_CONTENT_TYPE, get_manifest
+from .metrics import request_metrics
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .queries import annotate_display_geometry, annotate_relation_summaries, count_facets, defer_unused_columns, estimate_count, plan_queryset
+from .search import SEARCH_MODELS, search
+from .validators import validate_file_extension
+from types import SimpleNamespace
 import json
-    
+import os
+import re
+
+
+def get_depth(request, default=0):
+    try:
+        return int(request.query_params.get('depth', default))
+    except ValueError:
+        return default # Same fallback as the serializer context in DynamicDepthViewSet
+
+
+class MediaArchiveViewSet(CachedResponseMixin, StreamingExportMixin, FastListMixin, DynamicDepthViewSet):
+    """
+    Plans select_related/prefetch_related from the serializer fields and the
+    requested depth, so that list endpoints run a constant number of queries.
+    Passing a cursor parameter (empty for the first page) switches the list to
+    keyset pagination. The fields, omit and view=card parameters select the
+    serialized fields, and the columns of the others are not fetched.
+    Responses are cached, see CachedResponseMixin, and the whole table can be
+    streamed with export/, see StreamingExportMixin. JSON is rendered with
+    orjson when it is installed, and list pages can skip the serializers, see
+    FastListMixin.
+    """
+
+    keyset_pagination_class = KeysetPagination
+    cached_actions = (*CachedResponseMixin.cached_actions, 'facets')
+    # Relations counted by facets/, mapped to the field labelling their objects
+    facet_fields = {}
+    renderer_classes = [FastJSONRenderer if renderer is JSONRenderer else renderer
+                        for renderer in DynamicDepthViewSet.renderer_classes]
+
+    @property
+    def paginator(self):
+        if self.keyset_pagination_class is None or \
+                self.keyset_pagination_class.cursor_query_param not in self.request.query_params:
+            return super().paginator
+        if not isinstance(getattr(self, '_keyset_paginator', None), self.keyset_pagination_class):
+            self._keyset_paginator = self.keyset_pagination_class()
+        return self._keyset_paginator
+
+    def get_serializer_field_names(self):
+        return serializers.select_fields(self.get_serializer_class(), self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_serializer_field_names()
+        return context
+
+    def get_cache_depth(self):
+        return get_depth(self.request)
+
+    def get_cache_models(self):
+        found = super().get_cache_models()
+        if self.action == 'facets':
+            found |= {self.queryset.model._meta.get_field(relation).related_model for relation in self.facet_fields}
+        return found
+
+    def get_summary_field_names(self):
+        # Summaries the filters and the ordering can reference, serialized or not
+        names = set(self.get_serializer_field_names()) | set(getattr(self, 'ordering_fields', None) or ())
+        if getattr(self, 'filterset_class', None) is not None:
+            names |= set(self.filterset_class.base_filters)
+        return names
+
+    def get_filterable_queryset(self):
+        return annotate_relation_summaries(super().get_queryset(), self.get_serializer_class(),
+                                           self.get_summary_field_names())
+
+    def get_queryset(self):
+        # Only the serialization is restricted to the selected fields
+        field_names = self.get_serializer_field_names()
+        queryset = defer_unused_columns(self.get_filterable_queryset(), field_names)
+        return plan_queryset(queryset, field_names, get_depth(self.request))
+
+    @action(detail=False, url_path='count', url_name='count')
+    def count(self, request, *args, **kwargs):
+        return self.cached(self.get_count_response, request, *args, **kwargs)
+
+    def get_count_response(self, request, *args, **kwargs):
+        # Relations only matter for serialization, not for counting
+        queryset = self.filter_queryset(self.get_filterable_queryset())
+        if request.query_params.get('estimate', '').lower() in ('1', 'true'):
+            estimate = estimate_count(queryset)
+            if estimate is not None:
+                return Response({'count': estimate, 'estimated': True})
+        return Response({'count': queryset.count()})
+
+    @action(detail=False)
+    def facets(self, request, *args, **kwargs):
+        return self.cached(self.get_facets_response, request, *args, **kwargs)
+
+    def get_facets_response(self, request, *args, **kwargs):
+        return Response(count_facets(self.filter_queryset(self.get_filterable_queryset()), self.facet_fields))
+
+
+class LocationViewSet(CachedResponseMixin, StreamingExportMixin, GeoViewSet):
+    """
+    list:
+    Returns the locations as a GeoJSON feature collection. Use in_bbox=min_lon,min_lat,max_lon,max_lat
+    to restrict it to the visible map, and zoom=<0-22> to simplify the geometries to the map resolution.
+
+    tiles:
+    Returns a Mapbox Vector Tile with the locations in tile z/x/y.
+
+    export:
+    Streams every location as NDJSON, CSV or GeoJSON.
+    """
 
-class LocationViewSet(GeoViewSet):
     serializer_class = serializers.LocationSerializer
     queryset = models.Location.objects.all().order_by('id')
     filterset_fields = get_fields(models.Location, exclude=DEFAULT_FIELDS + ['geometry'])
+    filter_backends = [DjangoFilterBackend, InBBoxFilter]
+    bbox_filter_field = 'geometry'
+    bbox_filter_include_overlapping = True
+    max_zoom = 22
+    renderer_classes = [FastJSONRenderer if renderer is JSONRenderer else renderer
+                        for renderer in GeoViewSet.renderer_classes]
+
+    def get_zoom(self):
+        try:
+            zoom = int(self.request.query_params['zoom'])
+        except (KeyError, ValueError):
+            return None
+        return min(max(zoom, 0), self.max_zoom)
 
+    def get_cache_depth(self):
+        return self.get_serializer_class().Meta.depth
 
-class ProjectViewSet(DynamicDepthViewSet):
+    def get_queryset(self):
+        meta = self.get_serializer_class().Meta
+        queryset = plan_queryset(super().get_queryset(), meta.fields, meta.depth)
+        zoom = self.get_zoom()
+        if zoom is not None and self.action == 'list':
+            queryset = annotate_display_geometry(queryset, zoom)
+        return queryset
+
+    @action(detail=False, url_path=r'tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.mvt', url_name='tiles')
+    def tiles(self, request, z, x, y):
+        z, x, y = int(z), int(x), int(y)
+        if z > self.max_zoom or x >= 2 ** z or y >= 2 ** z:
+            raise NotFound("Tile out of range")
+
+        table = models.Location._meta.db_table
+        srid = models.Location._meta.get_field('geometry').srid
+        with connection.cursor() as cursor:
+            # The envelope is moved to the SRID of the column so that the spatial index is used
+            cursor.execute(f"""
+                WITH bounds AS (SELECT ST_TileEnvelope(%s, %s, %s) AS geom),
+                tile AS (
+                    SELECT location.id, location.name,
+                           ST_AsMVTGeom(ST_Transform(location.geometry, 3857), bounds.geom) AS geom
+                    FROM {table} AS location, bounds
+                    WHERE location.geometry && ST_Transform(bounds.geom, %s)
+                )
+                SELECT ST_AsMVT(tile, 'locations', 4096, 'geom') FROM tile
+            """, [z, x, y, srid])
+            tile = cursor.fetchone()[0]
+
+        return HttpResponse(bytes(tile or b''), content_type='application/vnd.mapbox-vector-tile')
+
+
+class ProjectViewSet(MediaArchiveViewSet):
+    """
+    list:
+    Returns the projects with their media counts, which can be filtered (e.g. images_count_min=10) and
+    ordered (e.g. ordering=-images_count). Use compact=true to get the counts without the lists of media ids.
+
+    summary:
+    Returns the date range, the media counts by type and the staff members of a project.
+    """
 
     queryset = models.Project.objects.all().order_by('id')
     serializer_class = serializers.ProjectSerializer
-    filterset_fields = get_fields(models.Project, exclude=DEFAULT_FIELDS)#, 'images_count', 'threedhop_count', 'pointcloud_count'])
+    filterset_class = ProjectFilter
+    facet_fields = {'location': 'name'}
+    filter_backends = [*MediaArchiveViewSet.filter_backends, OrderingFilter]
+    ordering_fields = ['id', 'name', 'images_count', 'threedhop_count', 'pointcloud_count', 'documents_count']
     search_fields = ["name"]
+    cached_actions = (*MediaArchiveViewSet.cached_actions, 'summary')
+    media_models = {
+        'image': models.Image,
+        'object3dhop': models.Object3DHop,
+        'objectpointcloud': models.ObjectPointCloud,
+        'document': models.Document,
+    }
+
+    def get_serializer_class(self):
+        if self.request.query_params.get('compact', '').lower() in ('1', 'true'):
+            return serializers.CompactProjectSerializer
+        return super().get_serializer_class()
 
+    @action(detail=True)
+    def summary(self, request, *args, **kwargs):
+        return self.cached(self.get_summary_response, request, *args, **kwargs)
 
-class IIIFImageViewSet(DynamicDepthViewSet):
+    def get_summary_response(self, request, *args, **kwargs):
+        project = self.get_object()
+        media = {
+            name: model.objects.filter(project=project).aggregate(count=Count('pk'), date_from=Min('date'), date_to=Max('date'))
+            for name, model in self.media_models.items()
+        }
+        dates = [date for summary in media.values() for date in (summary['date_from'], summary['date_to']) if date]
+
+        staff = models.StaffMember.objects.filter(projects_for_member=project)
+        for model in self.media_models.values():
+            staff = staff.union(models.StaffMember.objects.filter(pk__in=model.objects.filter(project=project).values('staff_member')))
+
+        return Response({
+            'id': project.id,
+            'name': project.name,
+            'count': sum(summary['count'] for summary in media.values()),
+            'date_from': min(dates, default=None),
+            'date_to': max(dates, default=None),
+            'media': media,
+            'staff': [{'id': member.id, 'firstname': member.firstname, 'lastname': member.lastname}
+                      for member in staff.order_by('lastname', 'firstname')],
+        })
+
+
+class IIIFImageViewSet(MediaArchiveViewSet):
     """
     retrieve:
     Returns a single image instance.
@@ -33,33 +265,231 @@ class IIIFImageViewSet(DynamicDepthViewSet):
 
     count:
     Returns a count of the existing images after the application of any filter.
+
+    facets:
+    Returns the number of images per project, location and type of image after the application of any filter,
+    e.g. date_after=2019-01-01&date_before=2021-12-31&location=3.
     """
     
     queryset = models.Image.objects.all().order_by('id')
     serializer_class = serializers.TIFFImageSerializer
-    filterset_fields = get_fields(models.Image, exclude=DEFAULT_FIELDS + ['iiif_file', 'file'])
+    filterset_class = ImageFilter
+    facet_fields = {'project': 'name', 'location': 'name', 'type_of_image': 'text'}
 
 
 
-class Object3DHopViewSet(DynamicDepthViewSet):
+class Object3DHopViewSet(MediaArchiveViewSet):
     
-    queryset = models.Object3DHop.objects.all()
+    queryset = models.Object3DHop.objects.all().order_by('id')
     serializer_class = serializers.Object3DHopSerializer
-    filterset_fields = get_fields(models.Object3DHop, exclude=DEFAULT_FIELDS+['preview_image', 'trackball_start', 
-                                                                              'start_angle', 'start_pan', 
-                                                                              'min_max_phi', 'min_max_theta'])
+    filterset_class = Object3DHopFilter
+    facet_fields = {'project': 'name', 'location': 'name', 'technique': 'text'}
 
 
-class ObjectPointcloudViewSet(DynamicDepthViewSet):
+class ObjectPointcloudViewSet(MediaArchiveViewSet):
     
-    queryset = models.ObjectPointCloud.objects.all()
+    queryset = models.ObjectPointCloud.objects.all().order_by('id')
     serializer_class = serializers.ObjectPointCloudSerializer
-    filterset_fields = get_fields(models.ObjectPointCloud, exclude=DEFAULT_FIELDS+['preview_image', 'camera_position', 
-                                                                                   'look_at'])
+    filterset_class = ObjectPointCloudFilter
+    facet_fields = {'project': 'name', 'location': 'name', 'technique': 'text'}
 
 
-class DocumentViewSet(DynamicDepthViewSet):
+class DocumentViewSet(MediaArchiveViewSet):
     
-    queryset = models.Document.objects.all()
+    queryset = models.Document.objects.all().order_by('id')
     serializer_class = serializers.DocumentSerializer
-    filterset_fields = get_fields(models.Document, exclude=DEFAULT_FIELDS+['upload'])
\ No newline at end of file
+    filterset_class = DocumentFilter
+    facet_fields = {'project': 'name', 'location': 'name', 'type': 'text'}
+
+    @action(detail=True)
+    def download(self, request, pk=None):
+        document = models.Document.objects.filter(pk=pk).only('id', 'upload', 'checksum').first() if pk.isdigit() else None
+        if document is None or not document.upload:
+            raise NotFound
+        return ranged_file_response(request, document.upload, get_document_etag(document))
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    list:
+    Ranked full text search across images, documents, 3D-hop objects and point clouds, tolerant to typos in titles.
+    Use q=<text>, type=<comma-separated subset of image,document,object3dhop,objectpointcloud> and limit=<1-100>.
+    """
+
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self, request):
+        try:
+            return min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            return self.default_limit
+
+    def list(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'results': []})
+
+        names = [name for name in request.query_params.get('type', '').split(',') if name in SEARCH_MODELS] or list(SEARCH_MODELS)
+        querysets = {}
+        for name in names:
+            serializer_class = EXPORT_SERIALIZERS[name]
+            field_names = serializer_class.Meta.fields
+            queryset = annotate_relation_summaries(SEARCH_MODELS[name].objects.all(), serializer_class, field_names)
+            querysets[name] = plan_queryset(defer_unused_columns(queryset, field_names), field_names, 0)
+
+        context = {'request': request, 'depth': 0}
+        results = [
+            {'type': name, 'score': instance.search_score, **EXPORT_SERIALIZERS[name](instance, context=context).data}
+            for name, instance in search(text, querysets, self.get_limit(request))
+        ]
+        return Response({'results': results})
+
+
+class IIIFManifestView(View):
+    """
+    Serves the IIIF Presentation 3 manifest of an image, or the collection of
+    the image manifests of a project or location. Manifests are prebuilt by the
+    build_iiif_manifests command or built on their first request, and cached
+    until the image, project or location changes (see signals.py).
+    """
+
+    def get(self, request, kind, pk):
+        entry = get_manifest(kind, int(pk), MANIFEST_BASE_URL or request.build_absolute_uri('/'))
+        if entry is None:
+            raise Http404
+        etag, content = entry
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=MANIFEST_CONTENT_TYPE)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, no-cache'
+        # IIIF viewers load manifests from other origins
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+
+class ChunkedUploadViewSet(viewsets.ViewSet):
+    """
+    create:
+    Starts the upload of a document file, given its filename, its size in bytes and optionally its SHA-256 checksum.
+
+    retrieve:
+    Returns the number of bytes received (offset), to resume an interrupted upload from there.
+
+    partial_update:
+    Writes a chunk: the raw bytes, with a Content-Range: bytes <start>-<end>/<size> header, start being the offset.
+
+    complete:
+    Creates the document from the complete file, with the title, description, date, project, location,
+    staff_member and type posted.
+    """
+
+    permission_classes = [IsAdminUser]
+    lookup_field = 'uuid'
+    lookup_value_regex = '[0-9a-f-]{36}'
+    content_range = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def get_upload(self, uuid, lock=False):
+        queryset = models.ChunkedUpload.objects.select_for_update() if lock else models.ChunkedUpload.objects.all()
+        try:
+            return queryset.get(uuid=uuid)
+        except (models.ChunkedUpload.DoesNotExist, DjangoValidationError):
+            raise NotFound
+
+    def get_state(self, upload):
+        return {'id': str(upload.uuid), 'filename': upload.filename, 'size': upload.size,
+                'offset': upload.offset, 'document': upload.document_id}
+
+    def create(self, request):
+        filename = os.path.basename(str(request.data.get('filename', '')))
+        try:
+            validate_file_extension(SimpleNamespace(name=filename))
+            size = int(request.data.get('size'))
+        except (DjangoValidationError, TypeError, ValueError):
+            raise ValidationError("A filename with a document extension and a size in bytes are required")
+        if size < 0:
+            raise ValidationError("The size cannot be negative")
+        upload = models.ChunkedUpload.objects.create(filename=filename, size=size,
+                                                     checksum=str(request.data.get('checksum', '')).lower())
+        return Response(self.get_state(upload), status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, uuid=None):
+        return Response(self.get_state(self.get_upload(uuid)))
+
+    @transaction.atomic
+    def partial_update(self, request, uuid=None):
+        match = self.content_range.match(request.headers.get('Content-Range', ''))
+        if match is None:
+            raise ValidationError("A Content-Range: bytes <start>-<end>/<size> header is required")
+        start, end, total = map(int, match.groups())
+
+        upload = self.get_upload(uuid, lock=True)
+        if upload.document_id is not None or start != upload.offset:
+            # Already complete, or a chunk lost or sent twice: the client resumes from offset
+            return Response(self.get_state(upload), status=status.HTTP_409_CONFLICT)
+        if total != upload.size or end < start or end >= upload.size:
+            raise ValidationError("The Content-Range does not match the upload")
+
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        length = end - start + 1
+        with open(upload.path, 'r+b' if os.path.exists(upload.path) else 'w+b') as part:
+            part.seek(start)
+            part.truncate()
+            while length > 0:
+                chunk = request.stream.read(min(CHUNK_SIZE, length)) if request.stream else b''
+                if not chunk:
+                    break
+                part.write(chunk)
+                length -= len(chunk)
+            if length:
+                part.truncate(start)
+                raise ValidationError("The body is shorter than the Content-Range")
+
+        upload.offset = end + 1
+        upload.save()
+        return Response(self.get_state(upload))
+
+    @action(detail=True, methods=['post'])
+    @transaction.atomic
+    def complete(self, request, uuid=None):
+        upload = self.get_upload(uuid, lock=True)
+        if upload.document_id is not None:
+            return Response(self.get_state(upload))
+        if upload.offset != upload.size:
+            return Response(self.get_state(upload), status=status.HTTP_409_CONFLICT)
+
+        serializer = serializers.DocumentUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with open(upload.path, 'rb') as part:
+            if upload.checksum and get_checksum(part) != upload.checksum:
+                # The file is corrupt: start again
+                upload.offset = 0
+                upload.save()
+                os.remove(upload.path)
+                return Response({**self.get_state(upload), 'detail': "The checksum does not match"},
+                                status=status.HTTP_409_CONFLICT)
+            # Document.save computes the size and checksum of the file
+            document = serializer.save(upload=File(part, name=upload.filename))
+
+        upload.document = document
+        upload.save()
+        transaction.on_commit(lambda: os.remove(upload.path))
+        return Response({**self.get_state(upload), **serializer.data}, status=status.HTTP_201_CREATED)
+
+
+class MetricsView(View):
+    """
+    Exposes the request timings recorded by middleware.PerformanceMiddleware in
+    the Prometheus text format. Set MEDIAARCHIVE_METRICS_TOKEN to require an
+    Authorization: Bearer <token> header.
+    """
+
+    def get(self, request):
+        token = getattr(settings, 'MEDIAARCHIVE_METRICS_TOKEN', None)
+        if token and not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return HttpResponse(status=401)
+        return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')